@@ -0,0 +1,12 @@
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class UnculledFileBasedCache(FileBasedCache):
+    """
+    File cache shared by the benchmark processes. The stock backend lists
+    the whole directory on every set to decide whether to cull, which
+    dominates at thousands of users; the directory is thrown away anyway.
+    """
+
+    def _cull(self):
+        pass
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Channel layer benchmark: InMemoryChannelLayer vs UnixSocketChannelLayer vs Redis.
+
+Measures
+  * throughput: messages/s through one channel with a concurrent receiver
+  * fan-out latency: time from group_send until every member has received
+    the message (p50/p95/p99 over many rounds)
+
+The Unix socket broker runs in its own process and every simulated worker
+gets its own layer instance (its own broker connection). The in-memory
+layer can only be shared inside one process, so all of its "workers" use
+a single instance. Redis is included when channels_redis is installed and
+a server answers on REDIS_HOST/REDIS_PORT (a local redis-server is fine).
+
+Usage:
+    python benchmarks/channel_layers.py [--messages 20000] [--members 200] [--workers 4] [--rounds 200]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from channels.layers import InMemoryChannelLayer  # noqa: E402
+from chat.layers import ChannelBroker, UnixSocketChannelLayer  # noqa: E402
+
+
+def run_broker(path):
+    asyncio.run(ChannelBroker(path).serve_forever())
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def measure_throughput(sender, receiver, messages):
+    channel = await receiver.new_channel()
+
+    async def consume():
+        for _ in range(messages):
+            await receiver.receive(channel)
+
+    consumer = asyncio.ensure_future(consume())
+    started = time.perf_counter()
+    for i in range(messages):
+        await sender.send(channel, {'type': 'bench.message', 'i': i})
+    await consumer
+    return messages / (time.perf_counter() - started)
+
+
+async def measure_fanout(layers, members, rounds):
+    group = 'bench_fanout'
+    arrivals = []
+    round_done = asyncio.Event()
+    received = 0
+
+    async def member(layer):
+        nonlocal received
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        ready.release()
+        while True:
+            message = await layer.receive(channel)
+            arrivals.append(time.perf_counter() - message['sent_at'])
+            received += 1
+            if received == members:
+                round_done.set()
+
+    ready = asyncio.Semaphore(0)
+    tasks = [asyncio.ensure_future(member(layers[i % len(layers)])) for i in range(members)]
+    for _ in range(members):
+        await ready.acquire()
+
+    latencies = []
+    sender = layers[0]
+    for _ in range(rounds):
+        arrivals.clear()
+        received = 0
+        round_done.clear()
+        await sender.group_send(group, {'type': 'bench.fanout', 'sent_at': time.perf_counter()})
+        await round_done.wait()
+        latencies.append(max(arrivals))
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return latencies
+
+
+async def bench(name, make_layers, args):
+    layers = make_layers()
+    throughput = await measure_throughput(layers[0], layers[-1], args.messages)
+    latencies = await measure_fanout(layers, args.members, args.rounds)
+    for layer in layers:
+        if hasattr(layer, 'close'):
+            await layer.close()
+        elif hasattr(layer, 'close_pools'):
+            await layer.close_pools()
+    print(
+        f'{name:<12} {throughput:>12,.0f} msg/s   fan-out to {args.members}: '
+        f'p50 {percentile(latencies, 50) * 1000:7.2f} ms  '
+        f'p95 {percentile(latencies, 95) * 1000:7.2f} ms  '
+        f'p99 {percentile(latencies, 99) * 1000:7.2f} ms'
+    )
+
+
+def redis_available(host, port):
+    try:
+        import channels_redis  # noqa: F401
+    except ImportError:
+        return False
+    try:
+        socket.create_connection((host, port), timeout=0.5).close()
+    except OSError:
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--members', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=4, help='layer instances sharing the group')
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+    # Capacity is raised so throughput measures the transport, not ChannelFull
+    capacity = max(args.messages, 100)
+
+    asyncio.run(bench('inmemory', lambda: [InMemoryChannelLayer(capacity=capacity)], args))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'channels.sock')
+        broker = multiprocessing.Process(target=run_broker, args=(path,), daemon=True)
+        broker.start()
+        while not os.path.exists(path):
+            time.sleep(0.01)
+        try:
+            asyncio.run(bench('unixsocket', lambda: [
+                UnixSocketChannelLayer(path=path, capacity=capacity) for _ in range(args.workers)
+            ], args))
+        finally:
+            broker.terminate()
+            broker.join()
+
+    host = os.environ.get('REDIS_HOST', '127.0.0.1')
+    port = int(os.environ.get('REDIS_PORT', 6379))
+    if redis_available(host, port):
+        from channels_redis.core import RedisChannelLayer
+        asyncio.run(bench('redis', lambda: [
+            RedisChannelLayer(hosts=[(host, port)], capacity=capacity) for _ in range(args.workers)
+        ], args))
+    else:
+        print(f'redis        skipped (channels_redis not installed or no server on {host}:{port})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Settings for benchmarks/websocket_fanout.py.
+
+A throwaway SQLite file (WAL, so workers can write concurrently), a cache
+shared by every process (served by the broker with the Unix socket layer,
+file based otherwise), and the channel layer chosen by the harness through
+BENCH_* environment variables.
+"""
+import os
+
+os.environ.setdefault('SECRET_KEY', 'benchmark-only-secret-key-not-for-deployment')
+os.environ.setdefault('DEBUG', 'True')
+
+from irefuel_backend.settings import *  # noqa: E402,F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCH_DATABASE', os.path.join(BASE_DIR, 'bench.sqlite3')),  # noqa: F405
+        'OPTIONS': {
+            'timeout': 30,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
+    }
+}
+
+# Presence and notification sequence numbers must be shared between workers
+CACHES = {
+    'default': {
+        'BACKEND': 'benchmarks.cache.UnculledFileBasedCache',
+        'LOCATION': os.environ.get('BENCH_CACHE_DIR', os.path.join(BASE_DIR, 'bench_cache')),  # noqa: F405
+    }
+}
+
+_layer = os.environ.get('BENCH_LAYER', 'unixsocket')
+if _layer == 'unixsocket':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'chat.layers.UnixSocketChannelLayer',
+            'CONFIG': {'path': os.environ.get('BENCH_BROKER_SOCKET', '/tmp/irefuel-bench.sock')},
+        },
+    }
+    # The broker serves the cache too, as in a CHANNEL_BROKER_SOCKET deployment
+    CACHES = {
+        'default': {
+            'BACKEND': 'chat.layers.BrokerCache',
+            'LOCATION': os.environ.get('BENCH_BROKER_SOCKET', '/tmp/irefuel-bench.sock'),
+        },
+    }
+elif _layer == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [(os.environ.get('REDIS_HOST', '127.0.0.1'), int(os.environ.get('REDIS_PORT', 6379)))],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'root': {'level': 'ERROR'},
+}
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+"""
+Cross-process WebSocket fan-out benchmark.
+
+Starts N worker processes that each load the real ASGI application
+(irefuel_backend.asgi) behind the chosen channel layer, opens simulated
+student/vendor/courier sockets against ChatConsumer and
+NotificationConsumer, then drives chat messages (from the student sockets)
+and order updates (NotificationService.notify_orders_update from the
+driver process) for a fixed duration.
+
+Sockets are fed to the application in-process, the way an ASGI server
+would after the handshake, so nothing listens on the network; JWT auth,
+consumers, the database and the channel layer are all the real ones.
+The two chat sockets of a room land on different workers, so every chat
+message and most order updates cross processes through the layer.
+
+Workers share a throwaway SQLite database and a cache (the broker's with
+the Unix socket layer, file based otherwise; see benchmarks/settings.py);
+presence and notification sequence numbers live in the cache and break
+across processes with the default local-memory one.
+
+Reports connections per worker, fan-out latency percentiles per event
+type (stamp at send -> frame handed to the socket), memory per connection
+(RSS growth while connecting) and CPU per delivered frame for the workers
+and the broker. Linux only (/proc).
+
+Usage:
+    python benchmarks/websocket_fanout.py --workers 4 --rooms 1000 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MARKER = 'bench:'
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+
+def rss_bytes() -> int:
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * PAGE_SIZE
+
+
+def process_cpu_seconds(pid) -> float:
+    with open(f'/proc/{pid}/stat') as stat:
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def own_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def seed(rooms):
+    """Create users and orders in the throwaway database, return socket specs"""
+    from decimal import Decimal
+    from django.contrib.auth import get_user_model
+    from rest_framework_simplejwt.tokens import AccessToken
+    from orders.models import Order
+
+    User = get_user_model()
+    vendor_count = max(1, rooms // 20)
+    courier_count = max(1, rooms // 10)
+
+    def create_users(user_type, count):
+        User.objects.bulk_create([
+            User(username=f'bench_{user_type}_{i}', user_type=user_type, first_name=user_type, last_name=str(i))
+            for i in range(count)
+        ])
+        return list(User.objects.filter(user_type=user_type).order_by('id'))
+
+    students = create_users('student', rooms)
+    vendors = create_users('vendor', vendor_count)
+    couriers = create_users('delivery', courier_count)
+
+    Order.objects.bulk_create([
+        Order(
+            student=students[i],
+            vendor=vendors[i % vendor_count],
+            delivery_person=couriers[i % courier_count],
+            status='preparing',
+            total_amount=Decimal('10.00'),
+            delivery_address='Library',
+            estimated_preparation_time=10
+        )
+        for i in range(rooms)
+    ])
+    orders = list(Order.objects.order_by('id').values_list('id', 'student_id', 'vendor_id'))
+
+    tokens = {user.id: str(AccessToken.for_user(user)) for user in students + vendors + couriers}
+    roles = {user.id: user.user_type for user in students + vendors + couriers}
+
+    specs = []
+    for order_id, student_id, vendor_id in orders:
+        specs.append({'path': f'/ws/chat/{order_id}/', 'user_id': student_id, 'peer_id': vendor_id,
+                      'role': 'student', 'token': tokens[student_id]})
+        specs.append({'path': f'/ws/chat/{order_id}/', 'user_id': vendor_id, 'peer_id': student_id,
+                      'role': 'vendor', 'token': tokens[vendor_id]})
+    for user_id, token in tokens.items():
+        specs.append({'path': '/ws/notifications/', 'user_id': user_id, 'peer_id': None,
+                      'role': roles[user_id], 'token': token})
+    return specs, [order_id for order_id, _, _ in orders]
+
+
+class SimulatedSocket:
+    """Drives one ASGI websocket connection without a network in between"""
+
+    def __init__(self, application, spec, stats):
+        self.application = application
+        self.spec = spec
+        self.stats = stats
+        self.inbound = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.closed = False
+
+    async def connect(self):
+        scope = {
+            'type': 'websocket',
+            'path': self.spec['path'],
+            'raw_path': self.spec['path'].encode(),
+            'query_string': f'token={self.spec["token"]}'.encode(),
+            'headers': [(b'host', b'localhost')],
+            'subprotocols': [],
+            'client': ('127.0.0.1', 0),
+            'server': ('127.0.0.1', 8000),
+        }
+        self.task = asyncio.ensure_future(self.application(scope, self.inbound.get, self.on_send))
+        await self.inbound.put({'type': 'websocket.connect'})
+        await asyncio.wait_for(self.accepted.wait(), 60)
+        return not self.closed
+
+    async def on_send(self, message):
+        if message['type'] == 'websocket.accept':
+            self.accepted.set()
+        elif message['type'] == 'websocket.close':
+            self.closed = True
+            self.accepted.set()
+        elif message['type'] == 'websocket.send':
+            self.stats['frames'] += 1
+            text = message.get('text')
+            # Only stamped frames are parsed, to keep client-side CPU out of the numbers
+            if text and MARKER in text:
+                frame = json.loads(text)
+                sent_at = float(frame['message'][len(MARKER):])
+                self.stats['latency'][frame['type']].append(time.monotonic() - sent_at)
+
+    async def send_chat(self):
+        await self.inbound.put({'type': 'websocket.receive', 'text': json.dumps({
+            'message': f'{MARKER}{time.monotonic()}',
+            'receiver_id': self.spec['peer_id']
+        })})
+
+    async def close(self):
+        await self.inbound.put({'type': 'websocket.disconnect', 'code': 1000})
+        try:
+            await asyncio.wait_for(self.task, 10)
+        except Exception:
+            self.task.cancel()
+
+
+async def worker_main(index, specs, options, ready, start, results):
+    from irefuel_backend.asgi import application
+
+    stats = {'frames': 0, 'latency': defaultdict(list)}
+    loop = asyncio.get_running_loop()
+    rss_before = rss_bytes()
+
+    sockets = [SimulatedSocket(application, spec, stats) for spec in specs]
+    connected = 0
+    for batch_start in range(0, len(sockets), options['connect_batch']):
+        batch = sockets[batch_start:batch_start + options['connect_batch']]
+        connected += sum(await asyncio.gather(*(socket.connect() for socket in batch)))
+    rss_after = rss_bytes()
+
+    ready.put(index)
+    await loop.run_in_executor(None, start.wait)
+
+    stats['frames'] = 0
+    cpu_before = own_cpu_seconds()
+    senders = [socket for socket in sockets if socket.spec['peer_id'] and socket.spec['role'] == 'student']
+    interval = options['workers'] / options['chat_rate'] if options['chat_rate'] else None
+    deadline = time.monotonic() + options['duration']
+    next_at = time.monotonic()
+    sent = 0
+    while interval and senders and next_at < deadline:
+        await senders[sent % len(senders)].send_chat()
+        sent += 1
+        next_at += interval
+        await asyncio.sleep(max(0, next_at - time.monotonic()))
+    await asyncio.sleep(max(0, deadline - time.monotonic()) + options['drain'])
+    cpu = own_cpu_seconds() - cpu_before
+
+    crashed = [socket.task.exception() for socket in sockets if socket.task.done() and not socket.task.cancelled()
+               and socket.task.exception() is not None]
+    results.put({
+        'worker': index,
+        'crashed': len(crashed),
+        'first_error': repr(crashed[0]) if crashed else None,
+        'connections': connected,
+        'rss_per_connection': (rss_after - rss_before) / max(connected, 1),
+        'chat_sent': sent,
+        'frames': stats['frames'],
+        'cpu': cpu,
+        'latency': dict(stats['latency']),
+    })
+    await asyncio.gather(*(socket.close() for socket in sockets))
+
+
+def run_worker(index, specs, options, ready, start, results):
+    setup_django()
+    asyncio.run(worker_main(index, specs, options, ready, start, results))
+
+
+def drive_order_updates(order_ids, rate, duration):
+    """Push order updates in 50ms ticks from the driver process"""
+    from orders.models import Order
+    from delivery.services import NotificationService
+
+    orders = list(Order.objects.filter(id__in=order_ids).order_by('id'))
+    tick = 0.05
+    per_tick = max(1, int(rate * tick))
+    deadline = time.monotonic() + duration
+    sent = 0
+    while rate and time.monotonic() < deadline:
+        started = time.monotonic()
+        batch = [orders[(sent + i) % len(orders)] for i in range(per_tick)]
+        NotificationService.notify_orders_update(batch, f'{MARKER}{time.monotonic()}')
+        sent += len(batch)
+        time.sleep(max(0, tick - (time.monotonic() - started)))
+    return sent
+
+
+def start_broker(path):
+    from chat.layers import ChannelBroker
+    asyncio.run(ChannelBroker(path).serve_forever())
+
+
+def report(options, results, updates_sent, broker_cpu):
+    connections = sum(result['connections'] for result in results)
+    frames = sum(result['frames'] for result in results)
+    worker_cpu = sum(result['cpu'] for result in results)
+
+    print(f'layer {options["layer"]}, {options["workers"]} workers, {options["duration"]}s of traffic')
+    print(f'connections: {connections} total, ' + ', '.join(
+        f'w{result["worker"]}={result["connections"]}' for result in sorted(results, key=lambda r: r['worker'])
+    ))
+    rss = [result['rss_per_connection'] for result in results]
+    print(f'memory per connection: {sum(rss) / len(rss) / 1024:.1f} KiB (worker RSS growth while connecting)')
+    chat_sent = sum(result['chat_sent'] for result in results)
+    print(f'sent: {chat_sent} chat messages, {updates_sent} order updates')
+
+    # Chat frames go to both room members, order updates to student, vendor and courier
+    expected = {'chat_message': chat_sent * 2, 'order_update': updates_sent * 3}
+
+    latencies = defaultdict(list)
+    for result in results:
+        for event_type, values in result['latency'].items():
+            latencies[event_type].extend(values)
+    for event_type, values in sorted(latencies.items()):
+        print(
+            f'{event_type:<14} delivered {len(values)}/{expected.get(event_type, "?")}  '
+            f'p50 {percentile(values, 50) * 1000:7.2f} ms  p95 {percentile(values, 95) * 1000:7.2f} ms  '
+            f'p99 {percentile(values, 99) * 1000:7.2f} ms  max {max(values) * 1000:7.2f} ms'
+        )
+
+    crashed = sum(result['crashed'] for result in results)
+    if crashed:
+        print(f'consumers crashed: {crashed}, e.g. ' + next(r['first_error'] for r in results if r['first_error']))
+    print(f'frames delivered: {frames}')
+    if frames:
+        print(f'worker CPU per frame: {worker_cpu / frames * 1e6:.1f} us ({worker_cpu:.2f}s total)')
+        if broker_cpu is not None:
+            print(f'broker CPU per frame: {broker_cpu / frames * 1e6:.1f} us ({broker_cpu:.2f}s total)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--layer', choices=['unixsocket', 'redis', 'inmemory'], default='unixsocket')
+    parser.add_argument('--rooms', type=int, default=1000, help='orders with an open chat (2 chat sockets each)')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of traffic')
+    parser.add_argument('--chat-rate', type=float, default=50, help='chat messages per second, all workers')
+    parser.add_argument('--update-rate', type=float, default=100, help='order updates per second')
+    parser.add_argument('--drain', type=float, default=2, help='seconds to wait for in-flight frames')
+    parser.add_argument('--connect-batch', type=int, default=200)
+    args = parser.parse_args()
+    if args.layer == 'inmemory' and args.workers != 1:
+        parser.error('the in-memory layer only works with --workers 1')
+
+    tmpdir = tempfile.TemporaryDirectory()
+    os.environ['BENCH_DATABASE'] = os.path.join(tmpdir.name, 'bench.sqlite3')
+    os.environ['BENCH_CACHE_DIR'] = os.path.join(tmpdir.name, 'cache')
+    os.environ['BENCH_BROKER_SOCKET'] = os.path.join(tmpdir.name, 'channels.sock')
+    os.environ['BENCH_LAYER'] = args.layer
+    setup_django()
+
+    context = multiprocessing.get_context('spawn')
+    broker = None
+    if args.layer == 'unixsocket':
+        # Started first: it serves the cache that seeding already writes to
+        broker = context.Process(target=start_broker, args=(os.environ['BENCH_BROKER_SOCKET'],), daemon=True)
+        broker.start()
+        while not os.path.exists(os.environ['BENCH_BROKER_SOCKET']):
+            time.sleep(0.01)
+
+    from django.core.management import call_command
+    from django.db import connections
+    call_command('migrate', verbosity=0)
+    specs, order_ids = seed(args.rooms)
+    connections.close_all()
+
+    options = {
+        'layer': args.layer,
+        'workers': args.workers,
+        'duration': args.duration,
+        'chat_rate': args.chat_rate,
+        'drain': args.drain,
+        'connect_batch': args.connect_batch,
+    }
+    ready, results, start = context.Queue(), context.Queue(), context.Event()
+    workers = [
+        context.Process(target=run_worker, args=(i, specs[i::args.workers], options, ready, start, results))
+        for i in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        ready.get()
+
+    broker_cpu_before = process_cpu_seconds(broker.pid) if broker else None
+    start.set()
+    # With --layer inmemory the workers can't see the driver's events, so only chat is measured
+    updates_sent = drive_order_updates(order_ids, args.update_rate if args.layer != 'inmemory' else 0, args.duration)
+    collected = [results.get() for _ in workers]
+    broker_cpu = process_cpu_seconds(broker.pid) - broker_cpu_before if broker else None
+
+    for worker in workers:
+        worker.join()
+    if broker:
+        broker.terminate()
+        broker.join()
+
+    report(options, collected, updates_sent, broker_cpu)
+    tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ChatMessage, ChatRoom
+from .models import ChatMessage, ChatRoom, UnreadCounter
 
 
 @admin.register(ChatMessage)
@@ -19,3 +19,10 @@ class ChatRoomAdmin(admin.ModelAdmin):
     raw_id_fields = ('order',)
     filter_horizontal = ('participants',)
     readonly_fields = ('created_at',)
+
+
+@admin.register(UnreadCounter)
+class UnreadCounterAdmin(admin.ModelAdmin):
+    list_display = ('user', 'order', 'count')
+    search_fields = ('user__username', 'order__id')
+    raw_id_fields = ('user', 'order')
@@ -0,0 +1,111 @@
+"""
+Per-connection outbound queues for WebSocket consumers.
+
+Handlers never wait on the client: frames are queued and written by a
+background task, so a stalled phone can't back up its channel in the
+channel layer. Frames with a coalesce key replace the queued frame with
+the same key (e.g. the latest order_update for an order supersedes older
+ones). A connection whose queue reaches WS_OUTBOUND_HIGH_WATER is closed
+with a ``reconnect`` frame carrying the last delivered ``seq`` so the
+client can resume from the replay buffer.
+"""
+import asyncio
+import itertools
+import json
+from collections import OrderedDict
+from django.conf import settings
+from irefuel_backend import metrics
+
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+
+class OutboundQueueMixin:
+    """Mix into an AsyncWebsocketConsumer before the consumer base class"""
+
+    outbound_queue = None
+    writer_task = None
+    delivered_seq = None
+    outbound_closed = False
+
+    def high_water_mark(self) -> int:
+        return getattr(settings, 'WS_OUTBOUND_HIGH_WATER', 100)
+
+    async def send(self, text_data=None, bytes_data=None, close=False, coalesce_key=None, seq=None):
+        if self.outbound_closed:
+            # Cut off as a slow consumer; the client resumes from the reconnect frame
+            metrics.incr('ws.outbound.dropped')
+            return
+        if close:
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+            return
+
+        if self.outbound_queue is None:
+            self.outbound_queue = OrderedDict()
+            self.outbound_ready = asyncio.Event()
+            self.outbound_idle = asyncio.Event()
+            self.outbound_ids = itertools.count()
+            self.writer_task = asyncio.ensure_future(self.write_outbound())
+
+        key = coalesce_key if coalesce_key is not None else ('frame', next(self.outbound_ids))
+        if key in self.outbound_queue:
+            # Superseded: drop the queued frame and send the newest one in order
+            del self.outbound_queue[key]
+            metrics.incr('ws.outbound.coalesced')
+            metrics.incr('ws.outbound.depth', -1)
+        elif len(self.outbound_queue) >= self.high_water_mark():
+            await self.disconnect_slow_consumer()
+            return
+
+        self.outbound_queue[key] = (text_data, bytes_data, seq)
+        self.outbound_idle.clear()
+        metrics.incr('ws.outbound.depth')
+        metrics.max_gauge('ws.outbound.max_depth', len(self.outbound_queue))
+        self.outbound_ready.set()
+
+    async def write_outbound(self):
+        while True:
+            await self.outbound_ready.wait()
+            while self.outbound_queue:
+                _, (text_data, bytes_data, seq) = self.outbound_queue.popitem(last=False)
+                metrics.incr('ws.outbound.depth', -1)
+                await super().send(text_data=text_data, bytes_data=bytes_data)
+                if seq is not None:
+                    self.delivered_seq = seq
+            self.outbound_ready.clear()
+            self.outbound_idle.set()
+
+    async def flush_outbound(self, timeout):
+        """Wait until every queued frame has been written, for at most timeout seconds"""
+        if not self.outbound_queue or self.writer_task is None:
+            return
+        try:
+            await asyncio.wait_for(self.outbound_idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stop_outbound(self):
+        if self.writer_task:
+            self.writer_task.cancel()
+            self.writer_task = None
+        if self.outbound_queue:
+            metrics.incr('ws.outbound.dropped', len(self.outbound_queue))
+            metrics.incr('ws.outbound.depth', -len(self.outbound_queue))
+            self.outbound_queue.clear()
+
+    async def disconnect_slow_consumer(self):
+        if self.outbound_closed:
+            return
+        self.outbound_closed = True
+        metrics.incr('ws.outbound.dropped')
+        metrics.incr('ws.outbound.slow_disconnects')
+        self.stop_outbound()
+        await super().send(text_data=json.dumps({
+            'type': 'reconnect',
+            'reason': 'slow_consumer',
+            'last_seq': self.delivered_seq
+        }))
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    async def websocket_disconnect(self, message):
+        self.stop_outbound()
+        await super().websocket_disconnect(message)
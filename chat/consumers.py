@@ -1,18 +1,110 @@
+import asyncio
 import json
+from urllib.parse import parse_qs
+from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
-from .models import ChatMessage, ChatRoom
+from django.db.models import Q
+from .models import ChatMessage, ChatRoom, UnreadCounter
+from .presence import PresenceService
+from .encoding import DEFAULT_ENCODING, available_encodings, encode_frame
+from .replay import ReplayBuffer
+from .backpressure import OutboundQueueMixin
+from .drain import DrainMixin
 from orders.models import Order
+from delivery.liveness import LivenessService
+from delivery.services import DeliveryAssignmentService, NotificationService
 
 User = get_user_model()
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+def is_order_participant(user, order_id):
+    """Check if user is the student, vendor or delivery person of an order"""
+    return Order.objects.filter(id=order_id).filter(
+        Q(student=user) | Q(vendor=user) | Q(delivery_person=user)
+    ).exists()
+
+
+def save_chat_message(user, order_id, message, receiver_id):
+    """Save a chat message sent over a socket, or return None if not allowed"""
+    try:
+        order = Order.objects.get(id=order_id)
+        receiver = User.objects.get(id=receiver_id)
+        
+        # Verify receiver is involved in the order
+        involved_users = [order.student, order.vendor]
+        if order.delivery_person:
+            involved_users.append(order.delivery_person)
+        
+        if receiver not in involved_users or user not in involved_users:
+            return None
+
+        chat_message = ChatMessage.objects.create(
+            sender=user,
+            receiver=receiver,
+            order=order,
+            message=message
+        )
+
+        # Create or update chat room
+        chat_room, created = ChatRoom.objects.get_or_create(
+            order=order,
+            defaults={'last_message': chat_message, 'last_activity_at': chat_message.timestamp}
+        )
+        if created:
+            chat_room.participants.set(involved_users)
+
+        NotificationService.notify_unread_update(receiver.id, order.id)
+
+        return chat_message
+    except (Order.DoesNotExist, User.DoesNotExist):
+        return None
+
+
+def superseded_key(event):
+    """
+    Queue key for events where only the newest one matters, so a slow
+    client's queued copy is replaced instead of piling up. None means the
+    event must always be delivered.
+    """
+    event_type = event['type']
+    if event_type in ('order_update', 'unread_update', 'courier_location', 'vendor_order'):
+        return (event_type, event.get('order_id'))
+    if event_type in ('delivery_offer', 'offer_retracted'):
+        # A retraction replaces a still queued offer for the same order
+        return ('offer', event.get('order_id'))
+    if event_type in ('presence', 'typing'):
+        return (event_type, event.get('order_id'), event['user_id'])
+    if event_type == 'read_receipt':
+        return (event_type, event.get('order_id'), event['reader_id'])
+    return None
+
+
+def chat_message_event(user, order_id, chat_message):
+    """Group event for a newly saved chat message"""
+    return {
+        'type': 'chat_message',
+        'order_id': int(order_id),
+        'message': chat_message.message,
+        'sender_id': user.id,
+        'sender_name': user.get_full_name(),
+        'sender_type': user.user_type,
+        'receiver_id': chat_message.receiver_id,
+        'timestamp': chat_message.timestamp.isoformat(),
+        'message_id': chat_message.id
+    }
+
+
+class ChatConsumer(DrainMixin, OutboundQueueMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.order_id = self.scope['url_route']['kwargs']['order_id']
         self.room_group_name = f'chat_order_{self.order_id}'
         self.user = self.scope['user']
+        self.pending_read_up_to = None
+        self.read_flush_task = None
+        self.is_present = False
 
         # Check if user has permission to join this chat
         if await self.has_permission():
@@ -22,10 +114,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
             await self.accept()
+            await sync_to_async(PresenceService.connect)(self.user.id)
+            self.is_present = True
+            await self.broadcast_presence(True)
         else:
             await self.close()
 
     async def disconnect(self, close_code):
+        # Flush receipts that are still waiting for their window
+        await self.flush_write_behind()
+
+        if self.is_present:
+            if await sync_to_async(PresenceService.stop_typing)(self.order_id, self.user.id):
+                await self.broadcast_typing(False)
+            still_online = await sync_to_async(PresenceService.disconnect)(self.user.id)
+            await self.broadcast_presence(still_online)
+
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -34,28 +138,50 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
-        message = text_data_json['message']
-        receiver_id = text_data_json['receiver_id']
+        frame_type = text_data_json.get('type')
+
+        if frame_type == 'read_up_to':
+            try:
+                message_id = int(text_data_json['message_id'])
+            except (KeyError, TypeError, ValueError):
+                await self.send_error('read_up_to needs a numeric message_id.')
+                return
+            await self.queue_read_receipt(message_id)
+            return
+
+        if frame_type == 'typing':
+            await self.update_typing(bool(text_data_json.get('is_typing', True)))
+            return
+
+        await sync_to_async(PresenceService.touch)(self.user.id)
+
+        if frame_type == 'ping':
+            # Keeps presence alive while the chat is open and quiet
+            await self.send(text_data=json.dumps({'type': 'pong'}))
+            return
+
+        message = text_data_json.get('message')
+        receiver_id = text_data_json.get('receiver_id')
+        if not message or receiver_id is None:
+            await self.send_error('message and receiver_id are required.')
+            return
 
         # Save message to database
         chat_message = await self.save_message(message, receiver_id)
 
         if chat_message:
+            # A sent message ends the typing period without a separate event
+            await sync_to_async(PresenceService.stop_typing)(self.order_id, self.user.id)
+
             # Send message to room group
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message,
-                    'sender_id': self.user.id,
-                    'sender_name': self.user.get_full_name(),
-                    'sender_type': self.user.user_type,
-                    'receiver_id': receiver_id,
-                    'timestamp': chat_message.timestamp.isoformat(),
-                    'message_id': chat_message.id
-                }
+                chat_message_event(self.user, self.order_id, chat_message)
             )
 
+    async def send_error(self, error):
+        await self.send(text_data=json.dumps({'type': 'error', 'error': error}))
+
     async def chat_message(self, event):
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
@@ -69,96 +195,500 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'message_id': event['message_id']
         }))
 
+    async def read_receipt(self, event):
+        # Send read receipt to WebSocket
+        await self.send(text_data=json.dumps({
+            'type': 'read_receipt',
+            'reader_id': event['reader_id'],
+            'read_up_to': event['read_up_to']
+        }), coalesce_key=superseded_key(event))
+
+    async def presence(self, event):
+        # Send presence change to WebSocket
+        await self.send(text_data=json.dumps({
+            'type': 'presence',
+            'user_id': event['user_id'],
+            'online': event['online']
+        }), coalesce_key=superseded_key(event))
+
+    async def typing(self, event):
+        # Send typing indicator to WebSocket
+        await self.send(text_data=json.dumps({
+            'type': 'typing',
+            'user_id': event['user_id'],
+            'is_typing': event['is_typing'],
+            'expires_in': event['expires_in']
+        }), coalesce_key=superseded_key(event))
+
+    async def broadcast_presence(self, online):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'presence',
+                'order_id': int(self.order_id),
+                'user_id': self.user.id,
+                'online': online
+            }
+        )
+
+    async def broadcast_typing(self, is_typing):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'typing',
+                'order_id': int(self.order_id),
+                'user_id': self.user.id,
+                'is_typing': is_typing,
+                'expires_in': PresenceService.typing_ttl()
+            }
+        )
+
+    async def update_typing(self, is_typing):
+        """Only the start and end of a typing period are broadcast"""
+        if is_typing:
+            changed = await sync_to_async(PresenceService.start_typing)(self.order_id, self.user.id)
+        else:
+            changed = await sync_to_async(PresenceService.stop_typing)(self.order_id, self.user.id)
+        if changed:
+            await self.broadcast_typing(is_typing)
+
+    async def flush_write_behind(self):
+        if self.read_flush_task:
+            self.read_flush_task.cancel()
+            await self.flush_read_receipts()
+
+    async def queue_read_receipt(self, message_id):
+        """Coalesce read receipts so a burst of frames becomes one UPDATE"""
+        if self.pending_read_up_to is None or message_id > self.pending_read_up_to:
+            self.pending_read_up_to = message_id
+        if self.read_flush_task is None:
+            self.read_flush_task = asyncio.ensure_future(self.delayed_read_flush())
+
+    async def delayed_read_flush(self):
+        await asyncio.sleep(getattr(settings, 'CHAT_READ_RECEIPT_WINDOW', 0.5))
+        self.read_flush_task = None
+        await self.flush_read_receipts()
+
+    async def flush_read_receipts(self):
+        read_up_to = self.pending_read_up_to
+        self.pending_read_up_to = None
+        self.read_flush_task = None
+        if read_up_to is None:
+            return
+
+        if await self.mark_read_up_to(read_up_to):
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    'type': 'read_receipt',
+                    'order_id': int(self.order_id),
+                    'reader_id': self.user.id,
+                    'read_up_to': read_up_to
+                }
+            )
+
+    @database_sync_to_async
+    def mark_read_up_to(self, message_id):
+        """Mark every message up to message_id as read in a single ranged UPDATE"""
+        marked = ChatMessage.objects.filter(
+            order_id=self.order_id,
+            receiver=self.user,
+            is_read=False,
+            id__lte=message_id
+        ).update(is_read=True)
+        if marked:
+            UnreadCounter.recount(self.user.id, self.order_id)
+            NotificationService.notify_unread_update(self.user.id, int(self.order_id))
+        return marked
+
     @database_sync_to_async
     def has_permission(self):
         """Check if user is involved in this order"""
-        try:
-            order = Order.objects.get(id=self.order_id)
-            involved_users = [order.student, order.vendor]
-            if order.delivery_person:
-                involved_users.append(order.delivery_person)
-            return self.user in involved_users
-        except Order.DoesNotExist:
-            return False
+        return is_order_participant(self.user, self.order_id)
 
     @database_sync_to_async
     def save_message(self, message, receiver_id):
         """Save chat message to database"""
-        try:
-            order = Order.objects.get(id=self.order_id)
-            receiver = User.objects.get(id=receiver_id)
-            
-            # Verify receiver is involved in the order
-            involved_users = [order.student, order.vendor]
-            if order.delivery_person:
-                involved_users.append(order.delivery_person)
-            
-            if receiver not in involved_users or self.user not in involved_users:
-                return None
-
-            chat_message = ChatMessage.objects.create(
-                sender=self.user,
-                receiver=receiver,
-                order=order,
-                message=message
-            )
+        return save_chat_message(self.user, self.order_id, message, receiver_id)
 
-            # Create or update chat room
-            chat_room, created = ChatRoom.objects.get_or_create(order=order)
-            if created:
-                chat_room.participants.set(involved_users)
 
-            return chat_message
-        except (Order.DoesNotExist, User.DoesNotExist):
-            return None
+class NotificationConsumer(DrainMixin, OutboundQueueMixin, AsyncWebsocketConsumer):
+    """
+    Consumer for real-time notifications.
+
+    Clients may narrow and shape the stream with query string options:
+    ``events`` (comma separated event types), ``orders`` (comma separated
+    order ids) and ``encoding`` (json, compact or msgpack).
 
+    Every notification carries a per-user ``seq``. A reconnecting client
+    passes ``last_seq`` to be sent only the events it missed, or gets a
+    ``resync_required`` frame when they are no longer buffered.
+    """
 
-class NotificationConsumer(AsyncWebsocketConsumer):
-    """Consumer for real-time notifications"""
+    NOTIFICATION_FIELDS = {
+        'order_update': ('order_id', 'status', 'message'),
+        'new_message': ('order_id', 'sender_name', 'message'),
+        'unread_update': ('order_id', 'unread_count', 'total_unread'),
+        'delivery_request': ('order_id', 'location', 'amount'),
+        'vendor_order': ('action', 'version', 'order_id', 'status', 'order'),
+        'delivery_offer': ('order_id', 'location', 'amount', 'vendor_name'),
+        'offer_retracted': ('order_id',),
+    }
+
+    offer_group_name = None
     
     async def connect(self):
         self.user = self.scope['user']
         if self.user.is_authenticated:
             self.user_group_name = f'user_{self.user.id}'
+            self.parse_options()
             
             await self.channel_layer.group_add(
                 self.user_group_name,
                 self.channel_name
             )
+            if self.user.user_type == 'vendor':
+                # Live order queue deltas, see orders.views.vendor_live_orders
+                self.vendor_group_name = f'vendor_{self.user.id}'
+                await self.channel_layer.group_add(self.vendor_group_name, self.channel_name)
             await self.accept()
+            await sync_to_async(PresenceService.connect)(self.user.id)
+            if self.user.user_type == 'delivery':
+                await database_sync_to_async(LivenessService.beat)(self.user.id)
+                # Claimable deliveries in the courier's area, while they have capacity
+                group = await database_sync_to_async(DeliveryAssignmentService.offer_group_for)(self.user)
+                await self.set_offer_group(group)
+            if self.negotiated:
+                await self.send(text_data=json.dumps({
+                    'type': 'connected',
+                    'encoding': self.encoding,
+                    'events': sorted(self.event_filter) if self.event_filter else None,
+                    'orders': sorted(self.order_filter) if self.order_filter else None
+                }))
+            if self.last_seq is not None:
+                await self.replay(self.last_seq)
         else:
             await self.close()
 
+    async def replay(self, last_seq):
+        """Send events after last_seq. Runs before any live event is handled."""
+        missed = await sync_to_async(ReplayBuffer.since)(self.user.id, last_seq)
+        if missed is None:
+            current = await sync_to_async(ReplayBuffer.current)(self.user.id)
+            self.replayed_seq = current
+            await self.send(text_data=json.dumps({'type': 'resync_required', 'seq': current}))
+            return
+
+        for event in missed:
+            # The client asked for exactly this gap, so replayed events are never coalesced
+            await self.send_notification(event, replayed=True)
+        if missed:
+            self.replayed_seq = missed[-1]['seq']
+
+    def parse_options(self):
+        options = parse_qs(self.scope.get('query_string', b'').decode())
+        self.negotiated = any(key in options for key in ('events', 'orders', 'encoding'))
+
+        events = ','.join(options.get('events', [])).split(',')
+        self.event_filter = {event for event in events if event in self.NOTIFICATION_FIELDS}
+
+        orders = ','.join(options.get('orders', [])).split(',')
+        self.order_filter = {int(order_id) for order_id in orders if order_id.isdigit()}
+
+        encoding = options.get('encoding', [DEFAULT_ENCODING])[-1]
+        self.encoding = encoding if encoding in available_encodings() else DEFAULT_ENCODING
+
+        last_seq = options.get('last_seq', [''])[-1]
+        self.last_seq = int(last_seq) if last_seq.isdigit() else None
+        # Live events up to here were covered by the replay; seqs come from several processes, so later
+        # ones may arrive in any order and are never compared with each other
+        self.replayed_seq = self.last_seq or 0
+
     async def disconnect(self, close_code):
         if hasattr(self, 'user_group_name'):
+            await sync_to_async(PresenceService.disconnect)(self.user.id)
             await self.channel_layer.group_discard(
                 self.user_group_name,
                 self.channel_name
             )
+        if hasattr(self, 'vendor_group_name'):
+            await self.channel_layer.group_discard(self.vendor_group_name, self.channel_name)
+        if self.offer_group_name:
+            await self.channel_layer.group_discard(self.offer_group_name, self.channel_name)
+
+    async def set_offer_group(self, group):
+        """Move to another offer group and send the offers already open in it"""
+        if group == self.offer_group_name:
+            return
+        if self.offer_group_name:
+            await self.channel_layer.group_discard(self.offer_group_name, self.channel_name)
+        self.offer_group_name = group
+        if group is None:
+            return
+
+        await self.channel_layer.group_add(group, self.channel_name)
+        offers = await database_sync_to_async(lambda: [
+            NotificationService._delivery_offer_payload(order)
+            for order in DeliveryAssignmentService.open_offers(group)
+        ])()
+        frame = encode_frame({'type': 'delivery_offers', 'offers': offers}, self.encoding)
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def receive(self, text_data):
+        text_data_json = json.loads(text_data)
+
+        if text_data_json.get('type') == 'ping':
+            # Keep presence alive while the app is open
+            await sync_to_async(PresenceService.touch)(self.user.id)
+            await self.send(text_data=json.dumps({'type': 'pong'}))
+        elif text_data_json.get('type') == 'heartbeat' and self.user.user_type == 'delivery':
+            # Courier liveness, see delivery.liveness
+            await sync_to_async(PresenceService.touch)(self.user.id)
+            await database_sync_to_async(LivenessService.beat)(self.user.id)
+            await self.send(text_data=json.dumps({
+                'type': 'heartbeat_ack',
+                'interval': LivenessService.heartbeat_interval()
+            }))
+
+    def wants(self, event):
+        if self.event_filter and event['type'] not in self.event_filter:
+            return False
+        if self.order_filter and event.get('order_id') not in self.order_filter:
+            return False
+        return True
+
+    async def send_notification(self, event, replayed=False):
+        """Send a notification, using the frame pre-encoded by the sender when present"""
+        seq = event.get('seq')
+        if not replayed and seq is not None and seq <= self.replayed_seq:
+            # Already sent during replay
+            return
+
+        if not self.wants(event):
+            return
+
+        frame = event.get('frames', {}).get(self.encoding)
+        if frame is None:
+            payload = {'type': event['type']}
+            for field in self.NOTIFICATION_FIELDS[event['type']]:
+                payload[field] = event[field]
+            if seq is not None:
+                payload['seq'] = seq
+            frame = encode_frame(payload, self.encoding)
+
+        coalesce_key = None if replayed else superseded_key(event)
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame, coalesce_key=coalesce_key, seq=seq)
+        else:
+            await self.send(text_data=frame, coalesce_key=coalesce_key, seq=seq)
 
     async def order_update(self, event):
         """Send order status updates"""
-        await self.send(text_data=json.dumps({
-            'type': 'order_update',
-            'order_id': event['order_id'],
-            'status': event['status'],
-            'message': event['message']
-        }))
+        await self.send_notification(event)
 
     async def new_message(self, event):
         """Send new message notifications"""
-        await self.send(text_data=json.dumps({
-            'type': 'new_message',
-            'order_id': event['order_id'],
-            'sender_name': event['sender_name'],
-            'message': event['message']
-        }))
+        await self.send_notification(event)
+
+    async def unread_update(self, event):
+        """Send unread counter changes"""
+        await self.send_notification(event)
+
+    async def vendor_order(self, event):
+        """Send live order queue deltas to vendors"""
+        await self.send_notification(event)
 
     async def delivery_request(self, event):
         """Send delivery assignment notifications"""
+        await self.send_notification(event)
+
+    async def delivery_offer(self, event):
+        """Send a claimable delivery to couriers in its area"""
+        await self.send_notification(event)
+
+    async def offer_retracted(self, event):
+        """Withdraw an offer another courier has claimed"""
+        await self.send_notification(event)
+
+    async def offers_subscription(self, event):
+        """Courier availability, capacity or area changed"""
+        if self.user.user_type == 'delivery':
+            await self.set_offer_group(event['group'])
+
+
+class MultiplexConsumer(DrainMixin, OutboundQueueMixin, AsyncWebsocketConsumer):
+    """
+    Single socket per client carrying any number of streams.
+
+    Clients send {"action": "subscribe" | "unsubscribe", "stream": ..., "order_id": ...}
+    for the "chat" and "courier_location" order streams and the
+    "notifications" stream, and {"action": "send", "stream": "chat",
+    "order_id": ..., "message": ..., "receiver_id": ...} to post a chat
+    message. Every frame sent back carries the stream it belongs to.
+    """
+
+    ORDER_STREAMS = {
+        'chat': 'chat_order_{order_id}',
+        'courier_location': 'courier_location_order_{order_id}',
+    }
+
+    async def connect(self):
+        self.user = self.scope['user']
+        self.subscriptions = {}
+        self.is_present = False
+
+        if self.user.is_authenticated:
+            await self.accept()
+            await sync_to_async(PresenceService.connect)(self.user.id)
+            self.is_present = True
+        else:
+            await self.close()
+
+    async def disconnect(self, close_code):
+        for group_name in self.subscriptions.values():
+            await self.channel_layer.group_discard(group_name, self.channel_name)
+        self.subscriptions = {}
+        if self.is_present:
+            await sync_to_async(PresenceService.disconnect)(self.user.id)
+
+    async def receive(self, text_data):
+        text_data_json = json.loads(text_data)
+        action = text_data_json.get('action')
+        stream = text_data_json.get('stream')
+        order_id = text_data_json.get('order_id')
+
+        if action == 'subscribe':
+            await self.subscribe(stream, order_id)
+        elif action == 'unsubscribe':
+            await self.unsubscribe(stream, order_id)
+        elif action == 'send' and stream == 'chat':
+            await self.send_chat_message(
+                order_id, text_data_json.get('message'), text_data_json.get('receiver_id')
+            )
+        elif action == 'ping':
+            await sync_to_async(PresenceService.touch)(self.user.id)
+            await self.send(text_data=json.dumps({'type': 'pong'}))
+        else:
+            await self.send_error(stream, f'Unsupported action {action!r}.')
+
+    async def subscribe(self, stream, order_id):
+        key = self.subscription_key(stream, order_id)
+        if key is None:
+            await self.send_error(stream, 'Unknown stream or invalid order_id.')
+            return
+
+        if key not in self.subscriptions:
+            if len(self.subscriptions) >= getattr(settings, 'WS_MAX_SUBSCRIPTIONS', 100):
+                await self.send_error(stream, 'Too many subscriptions on this connection.')
+                return
+
+            if stream == 'notifications':
+                group_name = f'user_{self.user.id}'
+            else:
+                if not await database_sync_to_async(is_order_participant)(self.user, key[1]):
+                    await self.send_error(stream, 'You are not involved in this order.', key[1])
+                    return
+                group_name = self.ORDER_STREAMS[stream].format(order_id=key[1])
+
+            await self.channel_layer.group_add(group_name, self.channel_name)
+            self.subscriptions[key] = group_name
+
         await self.send(text_data=json.dumps({
-            'type': 'delivery_request',
-            'order_id': event['order_id'],
-            'location': event['location'],
-            'amount': event['amount']
+            'type': 'subscribed',
+            'stream': stream,
+            'order_id': key[1]
         }))
+
+    async def unsubscribe(self, stream, order_id):
+        key = self.subscription_key(stream, order_id)
+        group_name = self.subscriptions.pop(key, None)
+        if group_name:
+            await self.channel_layer.group_discard(group_name, self.channel_name)
+        await self.send(text_data=json.dumps({
+            'type': 'unsubscribed',
+            'stream': stream,
+            'order_id': key[1] if key else None
+        }))
+
+    async def send_chat_message(self, order_id, message, receiver_id):
+        key = self.subscription_key('chat', order_id)
+        if key is None or not message or receiver_id is None:
+            await self.send_error('chat', 'order_id, message and receiver_id are required.')
+            return
+
+        chat_message = await database_sync_to_async(save_chat_message)(
+            self.user, key[1], message, receiver_id
+        )
+        if chat_message is None:
+            await self.send_error('chat', 'You cannot send this message.', key[1])
+            return
+
+        await self.channel_layer.group_send(
+            self.ORDER_STREAMS['chat'].format(order_id=key[1]),
+            chat_message_event(self.user, key[1], chat_message)
+        )
+
+    def subscription_key(self, stream, order_id):
+        if stream == 'notifications':
+            return (stream, None)
+        if stream not in self.ORDER_STREAMS:
+            return None
+        try:
+            return (stream, int(order_id))
+        except (TypeError, ValueError):
+            return None
+
+    async def send_error(self, stream, error, order_id=None):
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'stream': stream,
+            'order_id': order_id,
+            'error': error
+        }))
+
+    async def forward(self, stream, event):
+        payload = {key: value for key, value in event.items() if key != 'frames'}
+        await self.send(
+            text_data=json.dumps({**payload, 'stream': stream}),
+            coalesce_key=superseded_key(event)
+        )
+
+    # Chat stream events
+    async def chat_message(self, event):
+        await self.forward('chat', event)
+
+    async def read_receipt(self, event):
+        await self.forward('chat', event)
+
+    async def presence(self, event):
+        await self.forward('chat', event)
+
+    async def typing(self, event):
+        await self.forward('chat', event)
+
+    # Courier location stream events
+    async def courier_location(self, event):
+        await self.forward('courier_location', event)
+
+    # Notification stream events
+    async def order_update(self, event):
+        await self.forward('notifications', event)
+
+    async def new_message(self, event):
+        await self.forward('notifications', event)
+
+    async def unread_update(self, event):
+        await self.forward('notifications', event)
+
+    async def delivery_request(self, event):
+        await self.forward('notifications', event)
+
+    async def offer_retracted(self, event):
+        await self.forward('notifications', event)
+
+    async def offers_subscription(self, event):
+        # The delivery offer feed is only carried by ws/notifications/
+        pass
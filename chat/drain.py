@@ -0,0 +1,164 @@
+"""
+Graceful drain of WebSocket connections for rolling deploys.
+
+On SIGTERM, or on the ASGI lifespan shutdown, the worker stops accepting
+sockets, flushes write-behind work (e.g. coalesced read receipts) and then
+closes its connections one by one over WS_DRAIN_WINDOW seconds. Each
+client is sent a ``reconnect_after`` frame just before its close with a
+random delay of up to WS_RECONNECT_JITTER seconds and its last delivered
+``seq``, so reconnects (and the re-polls that follow them) are spread out
+instead of arriving as one spike. The server's own SIGTERM handler runs
+once the drain is done. Sockets are only tracked once they are accepted.
+"""
+import asyncio
+import json
+import random
+import signal
+import threading
+import weakref
+from channels.exceptions import StopConsumer
+from django.conf import settings
+from irefuel_backend import metrics
+
+SERVICE_RESTART_CLOSE_CODE = 1012
+# Seconds a connection may take to write its queued frames before it is closed anyway
+DRAIN_FLUSH_TIMEOUT = 2
+
+_consumers = weakref.WeakSet()
+_drain_task = None
+_handler_installed = False
+
+
+def is_draining() -> bool:
+    return _drain_task is not None
+
+
+def reset():
+    """Leave drain mode, for tests"""
+    global _drain_task
+    _drain_task = None
+    metrics.set_gauge('ws.draining', 0)
+
+
+async def drain(window=None, jitter=None):
+    """Close every registered connection, spread evenly over the window; later calls wait for the first"""
+    global _drain_task
+    if _drain_task is None:
+        metrics.set_gauge('ws.draining', 1)
+        _drain_task = asyncio.ensure_future(_close_all(window, jitter))
+    await asyncio.shield(_drain_task)
+
+
+async def _close_all(window, jitter):
+    if window is None:
+        window = getattr(settings, 'WS_DRAIN_WINDOW', 20)
+    if jitter is None:
+        jitter = getattr(settings, 'WS_RECONNECT_JITTER', 10)
+
+    consumers = list(_consumers)
+    random.shuffle(consumers)
+    step = window / len(consumers) if consumers else 0
+    await asyncio.gather(*(
+        consumer.drain_connection(close_in=i * step, reconnect_after=random.uniform(0, jitter))
+        for i, consumer in enumerate(consumers)
+    ), return_exceptions=True)
+
+
+def install_signal_handler():
+    """
+    Run a drain on SIGTERM through the server's event loop, then restore
+    the handler that was there before (the ASGI server's) and deliver the
+    signal to it. A second SIGTERM during the drain is handed over at
+    once. Servers only run their loop's signal handling on the main thread.
+    """
+    global _handler_installed
+    if _handler_installed or threading.current_thread() is not threading.main_thread():
+        return
+    _handler_installed = True
+
+    loop = asyncio.get_running_loop()
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def hand_over():
+        global _handler_installed
+        loop.remove_signal_handler(signal.SIGTERM)
+        signal.signal(signal.SIGTERM, previous if previous is not None else signal.SIG_DFL)
+        _handler_installed = False
+        signal.raise_signal(signal.SIGTERM)
+
+    async def drain_then_hand_over():
+        try:
+            await drain()
+        finally:
+            hand_over()
+
+    def handle_sigterm():
+        if is_draining():
+            hand_over()
+            return
+        asyncio.ensure_future(drain_then_hand_over())
+
+    loop.add_signal_handler(signal.SIGTERM, handle_sigterm)
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan app, for servers that announce their shutdown before closing sockets"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            install_signal_handler()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await drain()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+class DrainMixin:
+    """Mix into consumers before OutboundQueueMixin"""
+
+    rejected_while_draining = False
+
+    async def websocket_connect(self, message):
+        if is_draining():
+            # Rejected before the handshake, the client retries elsewhere
+            self.rejected_while_draining = True
+            await self.close(code=SERVICE_RESTART_CLOSE_CODE)
+            return
+        await super().websocket_connect(message)
+
+    async def accept(self, subprotocol=None, headers=None):
+        await super().accept(subprotocol=subprotocol, headers=headers)
+        install_signal_handler()
+        _consumers.add(self)
+        if is_draining():
+            # Accepted while the drain was starting, so it missed this socket
+            asyncio.ensure_future(self.drain_connection(
+                close_in=0, reconnect_after=random.uniform(0, getattr(settings, 'WS_RECONNECT_JITTER', 10))
+            ))
+
+    async def websocket_disconnect(self, message):
+        if self.rejected_while_draining:
+            # connect() never ran, so there is nothing to clean up
+            raise StopConsumer()
+        _consumers.discard(self)
+        await super().websocket_disconnect(message)
+
+    async def flush_write_behind(self):
+        """Persist work the consumer has deferred; override where there is any"""
+
+    async def drain_connection(self, close_in, reconnect_after):
+        await self.flush_write_behind()
+        await asyncio.sleep(close_in)
+        if self not in _consumers:
+            return
+
+        await self.send(text_data=json.dumps({
+            'type': 'reconnect_after',
+            'delay_ms': int(reconnect_after * 1000),
+            'last_seq': self.delivered_seq
+        }))
+        await self.flush_outbound(timeout=DRAIN_FLUSH_TIMEOUT)
+        _consumers.discard(self)
+        await self.close(code=SERVICE_RESTART_CLOSE_CODE)
+        metrics.incr('ws.drain.closed')
@@ -0,0 +1,65 @@
+"""
+Wire encodings for notification frames.
+
+Notifications are encoded once by the sender for every supported format
+and carried in the group event, so consumers only pick a pre-built frame
+instead of re-serializing per recipient.
+
+Formats:
+    json     the verbose dict clients have always received
+    compact  the same dict with short keys (see SHORT_KEYS), no whitespace
+    msgpack  compact keys packed with MessagePack, sent as binary frames;
+             only offered when the optional ``msgpack`` package is installed
+"""
+import json
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+SHORT_KEYS = {
+    'type': 't',
+    'order_id': 'o',
+    'status': 's',
+    'message': 'm',
+    'sender_name': 'n',
+    'location': 'l',
+    'amount': 'a',
+    'unread_count': 'u',
+    'total_unread': 'U',
+    'seq': 'q',
+}
+
+DEFAULT_ENCODING = 'json'
+
+
+def available_encodings():
+    encodings = ['json', 'compact']
+    if msgpack is not None:
+        encodings.append('msgpack')
+    return encodings
+
+
+def compact(payload: dict) -> dict:
+    return {SHORT_KEYS.get(key, key): value for key, value in payload.items()}
+
+
+def encode_frames(payload: dict) -> dict:
+    """Encode a payload once for every available format"""
+    frames = {
+        'json': json.dumps(payload),
+        'compact': json.dumps(compact(payload), separators=(',', ':')),
+    }
+    if msgpack is not None:
+        frames['msgpack'] = msgpack.packb(compact(payload))
+    return frames
+
+
+def encode_frame(payload: dict, encoding: str):
+    """Encode a single frame, for events that were sent without pre-built frames"""
+    if encoding == 'msgpack' and msgpack is not None:
+        return msgpack.packb(compact(payload))
+    if encoding == 'compact':
+        return json.dumps(compact(payload), separators=(',', ':'))
+    return json.dumps(payload)
@@ -0,0 +1,513 @@
+"""
+Channel layer for several ASGI workers on a single host, without Redis.
+
+A small broker process (``manage.py run_channel_broker``) owns every
+channel queue and group and listens on a Unix domain socket; each worker
+talks to it through UnixSocketChannelLayer. Requests are multiplexed over
+one socket per event loop and ``receive`` is a long poll, so a message is
+pushed to the waiting worker as soon as it is sent.
+
+The broker also serves the Django cache (BrokerCache) to the same
+processes, so notification seqs, presence and the other shared keys need
+no Redis either; incr is atomic because the broker handles one request
+at a time.
+
+Frames are a 4 byte length followed by a pickle, which is only safe
+because the socket is created mode 0600: run the broker as the same user
+as the workers. The broker keeps no state on disk; restarting it drops
+queued messages, group memberships and cached keys, as restarting Redis
+would.
+"""
+import asyncio
+import itertools
+import os
+import pickle
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+DEFAULT_SOCKET_PATH = '/tmp/irefuel-channels.sock'
+# Seconds between sweeps of expired messages, group members and cache keys
+SWEEP_INTERVAL = 10
+
+_HEADER = struct.Struct('!I')
+
+
+def _encode(obj) -> bytes:
+    body = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(len(body)) + body
+
+
+async def _read(reader):
+    header = await reader.readexactly(_HEADER.size)
+    return pickle.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+
+
+def _read_blocking(sock):
+    return pickle.loads(_recv_exactly(sock, _HEADER.unpack(_recv_exactly(sock, _HEADER.size))[0]))
+
+
+def _recv_exactly(sock, size) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Channel broker closed the connection')
+        data += chunk
+    return bytes(data)
+
+
+class _Peer:
+    """A worker connected to the broker"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.closed = False
+
+    def reply(self, req_id, status, value=None):
+        if not self.closed:
+            self.writer.write(_encode((req_id, status, value)))
+
+
+class ChannelBroker:
+    """In-memory channels and groups shared by every connected worker"""
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH):
+        self.path = path
+        self.channels = {}  # channel -> deque of (expires_at, message)
+        self.waiters = {}   # channel -> OrderedDict of (peer, req_id) pending receives
+        self.groups = {}    # group -> {channel: expires_at}
+        self.peers = {}     # handler task -> peer
+        self.cache = {}     # cache key -> (expires_at or None, value)
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle_peer, path=self.path)
+        os.chmod(self.path, 0o600)
+        self.sweeper = asyncio.ensure_future(self.sweep_periodically())
+        return self.server
+
+    async def close(self):
+        self.sweeper.cancel()
+        self.server.close()
+        for peer in self.peers.values():
+            peer.writer.close()
+        await asyncio.gather(*self.peers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def serve_forever(self):
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+    async def sweep_periodically(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            self.sweep()
+
+    def sweep(self):
+        """
+        Drop what nobody will read: expired messages and cache keys, empty
+        queues, expired group members (e.g. sockets of a crashed worker that
+        never left their groups) and receives from peers that have gone.
+        Otherwise these are only cleaned up when the same key is touched.
+        """
+        now = time.time()
+        for channel, queue in list(self.channels.items()):
+            live = deque(item for item in queue if item[0] >= now)
+            if live:
+                self.channels[channel] = live
+            else:
+                del self.channels[channel]
+        for channel, waiters in list(self.waiters.items()):
+            for waiter in [waiter for waiter in waiters if waiter[0].closed]:
+                del waiters[waiter]
+            if not waiters:
+                del self.waiters[channel]
+        for group, members in list(self.groups.items()):
+            for channel in [channel for channel, expires_at in members.items() if expires_at < now]:
+                del members[channel]
+            if not members:
+                del self.groups[group]
+        expired = [key for key, (expires_at, _) in self.cache.items() if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self.cache[key]
+
+    async def handle_peer(self, reader, writer):
+        peer = _Peer(writer)
+        task = asyncio.current_task()
+        self.peers[task] = peer
+        try:
+            while True:
+                req_id, op, args = await _read(reader)
+                getattr(self, f'op_{op}')(peer, req_id, *args)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            peer.closed = True
+            del self.peers[task]
+            writer.close()
+
+    def deliver(self, channel, message, expiry, capacity, front=False) -> bool:
+        """Hand the message to a waiting receiver or queue it; False when full"""
+        waiters = self.waiters.get(channel)
+        while waiters:
+            (peer, req_id), _ = waiters.popitem(last=False)
+            if not peer.closed:
+                peer.reply(req_id, 'ok', message)
+                return True
+        self.waiters.pop(channel, None)
+
+        queue = self.channels.setdefault(channel, deque())
+        now = time.time()
+        while queue and queue[0][0] < now:
+            queue.popleft()
+        if front:
+            queue.appendleft((now + expiry, message))
+            return True
+        if len(queue) >= capacity:
+            return False
+        queue.append((now + expiry, message))
+        return True
+
+    def op_send(self, peer, req_id, channel, message, expiry, capacity):
+        if self.deliver(channel, message, expiry, capacity):
+            peer.reply(req_id, 'ok')
+        else:
+            peer.reply(req_id, 'full')
+
+    def op_requeue(self, peer, req_id, channel, message, expiry):
+        # A receive was cancelled after the message was already on its way
+        self.deliver(channel, message, expiry, capacity=None, front=True)
+
+    def op_receive(self, peer, req_id, channel):
+        queue = self.channels.get(channel)
+        now = time.time()
+        while queue:
+            expires_at, message = queue.popleft()
+            if expires_at >= now:
+                if not queue:
+                    del self.channels[channel]
+                peer.reply(req_id, 'ok', message)
+                return
+        self.channels.pop(channel, None)
+        self.waiters.setdefault(channel, OrderedDict())[(peer, req_id)] = None
+
+    def op_cancel(self, peer, req_id, channel, receive_id):
+        waiters = self.waiters.get(channel)
+        if waiters and (peer, receive_id) in waiters:
+            del waiters[(peer, receive_id)]
+            peer.reply(receive_id, 'cancelled')
+            if not waiters:
+                del self.waiters[channel]
+
+    def op_group_add(self, peer, req_id, group, channel, group_expiry):
+        self.groups.setdefault(group, {})[channel] = time.time() + group_expiry
+        peer.reply(req_id, 'ok')
+
+    def op_group_discard(self, peer, req_id, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+        peer.reply(req_id, 'ok')
+
+    def op_group_send(self, peer, req_id, group, message, expiry, default_capacity, capacities):
+        members = self.groups.get(group, {})
+        now = time.time()
+        for channel, expires_at in list(members.items()):
+            if expires_at < now:
+                del members[channel]
+                continue
+            # Full channels are skipped, like the other layers do for groups
+            capacity = next((c for pattern, c in capacities if re.match(pattern, channel)), default_capacity)
+            self.deliver(channel, message, expiry, capacity)
+        peer.reply(req_id, 'ok')
+
+    def op_flush(self, peer, req_id):
+        self.channels.clear()
+        self.groups.clear()
+        peer.reply(req_id, 'ok')
+
+    def cache_entry(self, key):
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= time.time():
+            del self.cache[key]
+            return None
+        return entry
+
+    def op_cache_get_many(self, peer, req_id, keys):
+        found = {}
+        for key in keys:
+            entry = self.cache_entry(key)
+            if entry is not None:
+                found[key] = entry[1]
+        peer.reply(req_id, 'ok', found)
+
+    def op_cache_set_many(self, peer, req_id, items, expires_at):
+        for key, value in items.items():
+            self.cache[key] = (expires_at, value)
+        peer.reply(req_id, 'ok')
+
+    def op_cache_add(self, peer, req_id, key, value, expires_at):
+        if self.cache_entry(key) is not None:
+            peer.reply(req_id, 'ok', False)
+            return
+        self.cache[key] = (expires_at, value)
+        peer.reply(req_id, 'ok', True)
+
+    def op_cache_touch(self, peer, req_id, key, expires_at):
+        entry = self.cache_entry(key)
+        if entry is not None:
+            self.cache[key] = (expires_at, entry[1])
+        peer.reply(req_id, 'ok', entry is not None)
+
+    def op_cache_incr(self, peer, req_id, key, delta):
+        entry = self.cache_entry(key)
+        if entry is None:
+            peer.reply(req_id, 'missing')
+            return
+        self.cache[key] = (entry[0], entry[1] + delta)
+        peer.reply(req_id, 'ok', entry[1] + delta)
+
+    def op_cache_delete_many(self, peer, req_id, keys):
+        deleted = 0
+        for key in keys:
+            if self.cache_entry(key) is not None:
+                del self.cache[key]
+                deleted += 1
+        peer.reply(req_id, 'ok', deleted)
+
+    def op_cache_clear(self, peer, req_id):
+        self.cache.clear()
+        peer.reply(req_id, 'ok')
+
+
+class _BrokerConnection:
+    """One multiplexed socket to the broker, bound to a single event loop"""
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+        self.closed = False
+        self.lock = asyncio.Lock()
+        self.ids = itertools.count()
+        self.pending = {}
+        self.abandoned = {}  # receive ids cancelled locally -> (channel, expiry)
+
+    async def open(self):
+        async with self.lock:
+            if self.writer is None:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+                self.reader_task = asyncio.ensure_future(self.read_replies(reader))
+
+    def write(self, req_id, op, *args):
+        self.writer.write(_encode((req_id, op, args)))
+
+    async def request(self, op, *args, expiry=None):
+        if self.writer is None:
+            await self.open()
+        req_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[req_id] = future
+        self.write(req_id, op, *args)
+        try:
+            await self.writer.drain()
+            return await future
+        except asyncio.CancelledError:
+            if self.pending.pop(req_id, None) is not None and op == 'receive' and not self.closed:
+                self.abandoned[req_id] = (args[0], expiry)
+                self.write(None, 'cancel', args[0], req_id)
+            raise
+
+    async def read_replies(self, reader):
+        try:
+            while True:
+                req_id, status, value = await _read(reader)
+                future = self.pending.pop(req_id, None)
+                if future is None:
+                    abandoned = self.abandoned.pop(req_id, None)
+                    if abandoned and status == 'ok':
+                        channel, expiry = abandoned
+                        self.write(None, 'requeue', channel, value, expiry)
+                elif future.done():
+                    continue
+                elif status == 'ok':
+                    future.set_result(value)
+                elif status == 'full':
+                    future.set_exception(ChannelFull())
+                else:
+                    future.set_exception(RuntimeError(f'Channel broker error: {value}'))
+        except (asyncio.IncompleteReadError, ConnectionError) as exc:
+            self.fail_pending(exc)
+        finally:
+            self.closed = True
+            self.writer.close()
+
+    def fail_pending(self, exc):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f'Lost connection to channel broker: {exc}'))
+        self.pending.clear()
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """
+    Channel layer backed by ChannelBroker.
+
+    CONFIG: ``path`` of the broker socket, plus the usual ``expiry``,
+    ``group_expiry``, ``capacity`` and ``channel_capacity`` options.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, expiry=60, group_expiry=86400, capacity=100,
+                 channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.path = path
+        self.group_expiry = group_expiry
+        self.client_prefix = uuid.uuid4().hex
+        self.connections = {}
+
+    async def connection(self) -> _BrokerConnection:
+        # Sync code reaches the layer through async_to_sync, which runs a
+        # fresh event loop per call, so connections are kept per loop
+        loop = asyncio.get_running_loop()
+        conn = self.connections.get(loop)
+        if conn is None or conn.closed:
+            for stale in [other for other in self.connections if other.is_closed()]:
+                del self.connections[stale]
+            conn = self.connections[loop] = _BrokerConnection(self.path)
+        return conn
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        conn = await self.connection()
+        await conn.request('send', channel, message, self.expiry, self.get_capacity(channel))
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        conn = await self.connection()
+        return await conn.request('receive', channel, expiry=self.expiry)
+
+    async def new_channel(self, prefix='specific'):
+        return f'{prefix}.{self.client_prefix}!{uuid.uuid4().hex}'
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        conn = await self.connection()
+        await conn.request('group_add', group, channel, self.group_expiry)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        conn = await self.connection()
+        await conn.request('group_discard', group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_group_name(group), 'Group name not valid'
+        conn = await self.connection()
+        # Members are only known to the broker, so it gets the capacity rules
+        capacities = [(pattern.pattern, capacity) for pattern, capacity in self.channel_capacity]
+        await conn.request('group_send', group, message, self.expiry, self.capacity, capacities)
+
+    async def flush(self):
+        conn = await self.connection()
+        await conn.request('flush')
+
+    async def close(self):
+        conn = self.connections.pop(asyncio.get_running_loop(), None)
+        if conn is not None and conn.writer is not None:
+            conn.reader_task.cancel()
+            await asyncio.gather(conn.reader_task, return_exceptions=True)
+
+
+class BrokerCache(BaseCache):
+    """
+    Django cache backend served by ChannelBroker, shared by every process
+    on the host. LOCATION is the broker socket. Each thread keeps one
+    blocking connection, and every operation is a single round trip.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location or DEFAULT_SOCKET_PATH
+        self.local = threading.local()
+
+    def request(self, op, *args):
+        sock = getattr(self.local, 'sock', None)
+        try:
+            if sock is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self.path)
+                self.local.sock = sock
+            sock.sendall(_encode((None, op, args)))
+            _, status, value = _read_blocking(sock)
+        except OSError:
+            # Reconnect on the next call, e.g. after a broker restart
+            self.local.sock = None
+            if sock is not None:
+                sock.close()
+            raise
+        return status, value
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self.request('cache_add', key, value, self.get_backend_timeout(timeout))[1]
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self.request('cache_get_many', [key])[1].get(key, default)
+
+    def get_many(self, keys, version=None):
+        made = {self.make_and_validate_key(key, version=version): key for key in keys}
+        found = self.request('cache_get_many', list(made))[1]
+        return {made[key]: value for key, value in found.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self.request('cache_set_many', {key: value}, self.get_backend_timeout(timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        items = {self.make_and_validate_key(key, version=version): value for key, value in data.items()}
+        self.request('cache_set_many', items, self.get_backend_timeout(timeout))
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self.request('cache_touch', key, self.get_backend_timeout(timeout))[1]
+
+    def incr(self, key, delta=1, version=None):
+        made = self.make_and_validate_key(key, version=version)
+        status, value = self.request('cache_incr', made, delta)
+        if status == 'missing':
+            raise ValueError(f"Key '{key}' not found")
+        return value
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self.request('cache_delete_many', [key])[1] > 0
+
+    def delete_many(self, keys, version=None):
+        self.request('cache_delete_many', [self.make_and_validate_key(key, version=version) for key in keys])
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return key in self.request('cache_get_many', [key])[1]
+
+    def clear(self):
+        self.request('cache_clear')
@@ -0,0 +1,23 @@
+import asyncio
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chat.layers import ChannelBroker, DEFAULT_SOCKET_PATH
+
+
+class Command(BaseCommand):
+    help = 'Run the channel broker shared by all ASGI workers on this host (UnixSocketChannelLayer)'
+
+    def add_arguments(self, parser):
+        layer_config = settings.CHANNEL_LAYERS.get('default', {}).get('CONFIG', {})
+        parser.add_argument(
+            '--path',
+            default=layer_config.get('path', DEFAULT_SOCKET_PATH),
+            help='Unix socket to listen on'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Channel broker listening on {options["path"]}'))
+        try:
+            asyncio.run(ChannelBroker(options['path']).serve_forever())
+        except KeyboardInterrupt:
+            pass
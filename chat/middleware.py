@@ -0,0 +1,115 @@
+"""
+Stateless JWT authentication for WebSocket connections.
+
+The access token is read from the ``token`` query string parameter or from
+the ``Sec-WebSocket-Protocol`` header (``jwt, <token>``) and verified
+locally with simplejwt. Users are loaded through a short-TTL in-process
+cache so reconnect storms don't hit the database. Connections without a
+token fall back to the session based AuthMiddlewareStack.
+"""
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+
+JWT_SUBPROTOCOL = 'jwt'
+
+_user_cache = OrderedDict()
+
+
+def clear_user_cache():
+    _user_cache.clear()
+
+
+def _get_cached_user(user_id):
+    entry = _user_cache.get(user_id)
+    if entry is None:
+        return None
+    expires_at, user = entry
+    if expires_at < time.monotonic():
+        del _user_cache[user_id]
+        return None
+    _user_cache.move_to_end(user_id)
+    return user
+
+
+def _cache_user(user_id, user):
+    _user_cache[user_id] = (time.monotonic() + getattr(settings, 'WS_AUTH_USER_CACHE_TTL', 30), user)
+    _user_cache.move_to_end(user_id)
+    while len(_user_cache) > getattr(settings, 'WS_AUTH_USER_CACHE_SIZE', 10000):
+        _user_cache.popitem(last=False)
+
+
+@database_sync_to_async
+def _load_user(user_id):
+    User = get_user_model()
+    try:
+        return User.objects.get(pk=user_id, is_active=True)
+    except User.DoesNotExist:
+        return None
+
+
+async def get_jwt_user(raw_token):
+    """Return the user for a valid access token, or AnonymousUser"""
+    from rest_framework_simplejwt.exceptions import TokenError
+    from rest_framework_simplejwt.settings import api_settings
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    try:
+        token = AccessToken(raw_token)
+        user_id = token[api_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return AnonymousUser()
+
+    user = _get_cached_user(user_id)
+    if user is None:
+        user = await _load_user(user_id)
+        if user is None:
+            return AnonymousUser()
+        _cache_user(user_id, user)
+    return user
+
+
+def get_token_from_scope(scope):
+    """Return (token, via_subprotocol) from the query string or subprotocol header"""
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if query.get('token'):
+        return query['token'][-1], False
+
+    subprotocols = scope.get('subprotocols') or []
+    if len(subprotocols) >= 2 and subprotocols[0] == JWT_SUBPROTOCOL:
+        return subprotocols[1], True
+    return None, False
+
+
+class JWTAuthMiddleware:
+    """Populate scope['user'] from a JWT, bypassing sessions entirely"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.session_app = AuthMiddlewareStack(inner)
+
+    async def __call__(self, scope, receive, send):
+        raw_token, via_subprotocol = get_token_from_scope(scope)
+        if raw_token is None:
+            return await self.session_app(scope, receive, send)
+
+        scope = dict(scope, user=await get_jwt_user(raw_token))
+
+        if via_subprotocol:
+            # Browsers drop the socket unless the server echoes a subprotocol
+            async def send_with_subprotocol(message):
+                if message['type'] == 'websocket.accept' and not message.get('subprotocol'):
+                    message = dict(message, subprotocol=JWT_SUBPROTOCOL)
+                await send(message)
+            return await self.inner(scope, receive, send_with_subprotocol)
+
+        return await self.inner(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    return JWTAuthMiddleware(inner)
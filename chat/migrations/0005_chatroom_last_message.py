@@ -0,0 +1,36 @@
+# Generated by Django 5.2.3 on 2026-10-19 16:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_last_message(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    for room in ChatRoom.objects.all():
+        latest = ChatMessage.objects.filter(order_id=room.order_id).order_by('-timestamp', '-id').first()
+        if latest:
+            room.last_message = latest
+            room.last_activity_at = latest.timestamp
+            room.save(update_fields=['last_message', 'last_activity_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_unreadcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.chatmessage'),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def backfill_unread_counters(apps, schema_editor):
+    # Recomputed from the messages, so it also corrects counters written since 0004
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    UnreadCounter = apps.get_model('chat', 'UnreadCounter')
+    UnreadCounter.objects.all().delete()
+    unread = ChatMessage.objects.filter(is_read=False).values('receiver_id', 'order_id').annotate(unread=Count('id'))
+    UnreadCounter.objects.bulk_create(
+        [UnreadCounter(user_id=row['receiver_id'], order_id=row['order_id'], count=row['unread']) for row in unread.iterator()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_chatroom_last_message'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_unread_counters, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from orders.models import Order
 
@@ -16,6 +16,16 @@ class ChatMessage(models.Model):
     class Meta:
         ordering = ['timestamp']
 
+    def save(self, *args, **kwargs):
+        is_new = self._state.adding
+        super().save(*args, **kwargs)
+        if is_new:
+            ChatRoom.objects.filter(order_id=self.order_id).update(
+                last_message=self, last_activity_at=self.timestamp
+            )
+            if not self.is_read:
+                UnreadCounter.increment(self.receiver_id, self.order_id)
+
     def __str__(self):
         return f"Message from {self.sender.username} to {self.receiver.username} - Order #{self.order.id}"
 
@@ -24,8 +34,60 @@ class ChatRoom(models.Model):
     """Chat room for an order involving student, vendor, and delivery person"""
     order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='chat_room')
     participants = models.ManyToManyField(User, related_name='chat_rooms')
+    last_message = models.ForeignKey(ChatMessage, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_activity_at = models.DateTimeField(null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
 
     def __str__(self):
         return f"Chat Room for Order #{self.order.id}"
+
+
+class UnreadCounter(models.Model):
+    """Denormalized unread message count per user and order"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='unread_counters')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='unread_counters')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'order')
+
+    def __str__(self):
+        return f"{self.user.username} - Order #{self.order.id}: {self.count} unread"
+
+    @classmethod
+    def increment(cls, user_id, order_id):
+        with transaction.atomic():
+            updated = cls.objects.filter(user_id=user_id, order_id=order_id).update(
+                count=models.F('count') + 1
+            )
+            if not updated:
+                counter, created = cls.objects.get_or_create(
+                    user_id=user_id, order_id=order_id, defaults={'count': 1}
+                )
+                if not created:
+                    cls.objects.filter(pk=counter.pk).update(count=models.F('count') + 1)
+
+    @classmethod
+    def reset(cls, user_id, order_id):
+        cls.objects.filter(user_id=user_id, order_id=order_id, count__gt=0).update(count=0)
+
+    @classmethod
+    def recount(cls, user_id, order_id):
+        """Resync a counter after a partial read, counting only that room's unread messages"""
+        remaining = ChatMessage.objects.filter(
+            receiver_id=user_id, order_id=order_id, is_read=False
+        ).count()
+        cls.objects.filter(user_id=user_id, order_id=order_id).update(count=remaining)
+
+    @classmethod
+    def get_count(cls, user_id, order_id):
+        return cls.objects.filter(user_id=user_id, order_id=order_id).values_list('count', flat=True).first() or 0
+
+    @classmethod
+    def get_totals(cls, user_id):
+        """Return (total, {order_id: count}) for a user's rooms with unread messages"""
+        per_order = dict(
+            cls.objects.filter(user_id=user_id, count__gt=0).values_list('order_id', 'count')
+        )
+        return sum(per_order.values()), per_order
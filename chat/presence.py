@@ -0,0 +1,87 @@
+"""
+Ephemeral presence and typing state.
+
+Everything here lives in the Django cache with a TTL so that crashed
+connections expire on their own; nothing is written to the database.
+"""
+from typing import Dict, Iterable
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _presence_key(user_id) -> str:
+    return f'presence:user:{user_id}'
+
+
+def _typing_key(order_id, user_id) -> str:
+    return f'presence:typing:{order_id}:{user_id}'
+
+
+class PresenceService:
+    """Tracks online users and who is typing in which order chat"""
+
+    @staticmethod
+    def presence_ttl() -> int:
+        return getattr(settings, 'CHAT_PRESENCE_TTL', 90)
+
+    @staticmethod
+    def typing_ttl() -> int:
+        return getattr(settings, 'CHAT_TYPING_TTL', 5)
+
+    @classmethod
+    def connect(cls, user_id) -> None:
+        """Count a new socket for the user; presence is a per-user connection count"""
+        key = _presence_key(user_id)
+        ttl = cls.presence_ttl()
+        if not cache.add(key, 1, ttl):
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Expired between add() and incr()
+                cache.set(key, 1, ttl)
+            cache.touch(key, ttl)
+
+    @classmethod
+    def disconnect(cls, user_id) -> bool:
+        """Drop one socket for the user and return whether they are still online"""
+        key = _presence_key(user_id)
+        try:
+            remaining = cache.decr(key)
+        except ValueError:
+            return False
+        if remaining <= 0:
+            cache.delete(key)
+            return False
+        return True
+
+    @classmethod
+    def touch(cls, user_id) -> None:
+        """Keep a live connection from expiring"""
+        key = _presence_key(user_id)
+        if not cache.touch(key, cls.presence_ttl()):
+            cache.add(key, 1, cls.presence_ttl())
+
+    @staticmethod
+    def online_users(user_ids: Iterable[int]) -> Dict[int, bool]:
+        user_ids = list(user_ids)
+        found = cache.get_many([_presence_key(user_id) for user_id in user_ids])
+        return {user_id: _presence_key(user_id) in found for user_id in user_ids}
+
+    @classmethod
+    def start_typing(cls, order_id, user_id) -> bool:
+        """
+        Mark a user as typing. Returns True only when this starts a new
+        typing period, so repeated keystroke frames are not re-broadcast.
+        """
+        return cache.add(_typing_key(order_id, user_id), True, cls.typing_ttl())
+
+    @staticmethod
+    def stop_typing(order_id, user_id) -> bool:
+        """Clear typing state and return whether the user was typing"""
+        return cache.delete(_typing_key(order_id, user_id))
+
+    @staticmethod
+    def typing_users(order_id, user_ids: Iterable[int]) -> Dict[int, bool]:
+        user_ids = list(user_ids)
+        found = cache.get_many([_typing_key(order_id, user_id) for user_id in user_ids])
+        return {user_id: _typing_key(order_id, user_id) in found for user_id in user_ids}
@@ -0,0 +1,69 @@
+"""
+Per-user notification sequence numbers and replay buffer.
+
+Every notification sent to a user gets the next number of that user's
+sequence. The last NOTIFICATION_BUFFER_SIZE events are kept in a ring of
+cache slots (``seq % size``) that expire after NOTIFICATION_BUFFER_TTL
+seconds, so a reconnecting client can be sent only what it missed.
+"""
+from typing import List, Optional
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _sequence_key(user_id) -> str:
+    return f'notify:seq:{user_id}'
+
+
+def _slot_key(user_id, slot) -> str:
+    return f'notify:event:{user_id}:{slot}'
+
+
+class ReplayBuffer:
+    """Bounded ring buffer of recent notifications per user"""
+
+    @staticmethod
+    def size() -> int:
+        return getattr(settings, 'NOTIFICATION_BUFFER_SIZE', 200)
+
+    @staticmethod
+    def ttl() -> int:
+        return getattr(settings, 'NOTIFICATION_BUFFER_TTL', 3600)
+
+    @classmethod
+    def append(cls, user_id, payload: dict) -> dict:
+        """Stamp the payload with the user's next sequence number and store it"""
+        key = _sequence_key(user_id)
+        cache.add(key, 0, timeout=None)
+        seq = cache.incr(key)
+        event = {**payload, 'seq': seq}
+        cache.set(_slot_key(user_id, seq % cls.size()), event, cls.ttl())
+        return event
+
+    @staticmethod
+    def current(user_id) -> int:
+        return cache.get(_sequence_key(user_id), 0)
+
+    @classmethod
+    def since(cls, user_id, last_seq: int) -> Optional[List[dict]]:
+        """
+        Events after last_seq in order, or None when some of them are no
+        longer buffered and the client has to do a full refresh.
+        """
+        current = cls.current(user_id)
+        if last_seq > current or current - last_seq > cls.size():
+            return None
+        if last_seq == current:
+            return []
+
+        wanted = range(last_seq + 1, current + 1)
+        keys = {seq: _slot_key(user_id, seq % cls.size()) for seq in wanted}
+        found = cache.get_many(keys.values())
+
+        events = []
+        for seq in wanted:
+            event = found.get(keys[seq])
+            if event is None or event['seq'] != seq:
+                return None
+            events.append(event)
+        return events
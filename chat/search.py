@@ -0,0 +1,202 @@
+"""
+Full-text search over chat messages, order instructions and delivery notes.
+
+PostgreSQL uses expression GIN indexes over to_tsvector(); SQLite uses a
+trigger-maintained FTS5 table. Every hit is identified by a search key of
+``object_id * 4 + kind`` so both backends share one keyset cursor format.
+"""
+import base64
+import json
+import re
+from typing import List, Optional, Tuple
+from django.db import connection
+
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'chat_search_fts'
+
+KIND_MESSAGE = 1
+KIND_ORDER_NOTE = 2
+KIND_DELIVERY_NOTE = 3
+
+KIND_NAMES = {
+    KIND_MESSAGE: 'message',
+    KIND_ORDER_NOTE: 'order_note',
+    KIND_DELIVERY_NOTE: 'delivery_note',
+}
+
+# (kind, table, text column, order id column)
+SEARCH_SOURCES = (
+    (KIND_MESSAGE, 'chat_chatmessage', 'message', 'order_id'),
+    (KIND_ORDER_NOTE, 'orders_order', 'special_instructions', 'id'),
+    (KIND_DELIVERY_NOTE, 'delivery_deliveryrequest', 'delivery_notes', 'order_id'),
+)
+
+INVOLVED_ORDERS_SQL = (
+    'SELECT id FROM orders_order '
+    'WHERE student_id = %s OR vendor_id = %s OR delivery_person_id = %s'
+)
+
+
+SEARCH_VENDORS = ('postgresql', 'sqlite')
+
+
+def install_search_index(db_connection):
+    """
+    Create or repair the backend specific search structures. Safe to run
+    repeatedly; does nothing until every source table exists, so a partial
+    migrate leaves it to the next one.
+    """
+    if db_connection.vendor not in SEARCH_VENDORS:
+        return
+    tables = set(db_connection.introspection.table_names())
+    if any(table not in tables for _, table, _, _ in SEARCH_SOURCES):
+        return
+    if db_connection.vendor == 'postgresql':
+        _install_postgres(db_connection)
+    else:
+        _install_sqlite(db_connection, tables)
+
+
+def _install_postgres(db_connection):
+    with db_connection.cursor() as cursor:
+        for _, table, column, _ in SEARCH_SOURCES:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_{column}_fts_idx ON {table} "
+                f"USING gin (to_tsvector('{SEARCH_CONFIG}', coalesce({column}, '')))"
+            )
+
+
+def _sqlite_triggers(kind, table, column, order_column) -> dict:
+    """Trigger name -> CREATE statement keeping one source's rows in the FTS table"""
+    key = f"{{row}}.id * 4 + {kind}"
+    insert = (
+        f"INSERT INTO {FTS_TABLE}(rowid, body, order_id) "
+        f"SELECT {key.format(row='NEW')}, NEW.{column}, NEW.{order_column} "
+        f"WHERE coalesce(NEW.{column}, '') != '';"
+    )
+    delete = f"DELETE FROM {FTS_TABLE} WHERE rowid = {key.format(row='OLD')};"
+    return {
+        f'{table}_fts_insert': f"AFTER INSERT ON {table} BEGIN {insert} END",
+        f'{table}_fts_update': (
+            f"AFTER UPDATE OF {column} ON {table} "
+            f"WHEN OLD.{column} IS NOT NEW.{column} BEGIN {delete} {insert} END"
+        ),
+        f'{table}_fts_delete': f"AFTER DELETE ON {table} BEGIN {delete} END",
+    }
+
+
+def _install_sqlite(db_connection, tables):
+    """Create the FTS table and any missing trigger, reindexing each source whose triggers were incomplete"""
+    from django.db import transaction
+
+    with transaction.atomic(using=db_connection.alias), db_connection.cursor() as cursor:
+        if FTS_TABLE not in tables:
+            cursor.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(body, order_id UNINDEXED)")
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        existing = {name for name, in cursor.fetchall()}
+
+        for kind, table, column, order_column in SEARCH_SOURCES:
+            triggers = _sqlite_triggers(kind, table, column, order_column)
+            if FTS_TABLE in tables and all(name in existing for name in triggers):
+                continue
+            for name, body in triggers.items():
+                if name not in existing:
+                    cursor.execute(f"CREATE TRIGGER {name} {body}")
+            # Rows written while a trigger was missing are not indexed, so rebuild this source
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid % 4 = {kind}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}(rowid, body, order_id) "
+                f"SELECT id * 4 + {kind}, {column}, {order_column} FROM {table} "
+                f"WHERE coalesce({column}, '') != ''"
+            )
+
+
+def encode_cursor(score: float, key: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([score, key]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[float, int]]:
+    try:
+        score, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), int(key)
+    except (ValueError, TypeError):
+        return None
+
+
+class ChatSearchService:
+    """Ranked, keyset-paginated search restricted to the caller's orders"""
+
+    @staticmethod
+    def is_supported() -> bool:
+        return connection.vendor in SEARCH_VENDORS
+
+    @classmethod
+    def search(cls, user, query: str, after: Optional[Tuple[float, int]] = None, limit: int = 20) -> List[dict]:
+        """Callers check is_supported() first"""
+        if connection.vendor == 'postgresql':
+            rows = cls._search_postgres(user, query, after, limit)
+        else:
+            rows = cls._search_sqlite(user, query, after, limit)
+
+        return [
+            {
+                'type': KIND_NAMES[key % 4],
+                'id': key // 4,
+                'order_id': order_id,
+                'text': body,
+                'score': score,
+                'key': key,
+            }
+            for key, score, order_id, body in rows
+        ]
+
+    @staticmethod
+    def _keyset_clause(after):
+        if after is None:
+            return '', []
+        score, key = after
+        return 'WHERE score < %s OR (score = %s AND search_key > %s)', [score, score, key]
+
+    @classmethod
+    def _search_postgres(cls, user, query, after, limit):
+        parts = []
+        params = [query, user.id, user.id, user.id]
+        for kind, table, column, order_column in SEARCH_SOURCES:
+            document = f"to_tsvector('{SEARCH_CONFIG}', coalesce(t.{column}, ''))"
+            parts.append(
+                f"SELECT t.id * 4 + {kind} AS search_key, "
+                f"ts_rank({document}, q.query)::float8 AS score, "
+                f"t.{order_column} AS order_id, t.{column} AS body "
+                f"FROM {table} t, q WHERE {document} @@ q.query "
+                f"AND t.{order_column} IN (SELECT id FROM involved)"
+            )
+        keyset, keyset_params = cls._keyset_clause(after)
+        sql = (
+            f"WITH q AS (SELECT plainto_tsquery('{SEARCH_CONFIG}', %s) AS query), "
+            f"involved AS ({INVOLVED_ORDERS_SQL}) "
+            f"SELECT search_key, score, order_id, body FROM ({' UNION ALL '.join(parts)}) hits "
+            f"{keyset} ORDER BY score DESC, search_key LIMIT %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + keyset_params + [limit])
+            return cursor.fetchall()
+
+    @classmethod
+    def _search_sqlite(cls, user, query, after, limit):
+        # Quote every token so user input can never be parsed as FTS5 syntax
+        tokens = re.findall(r'\w+', query)
+        if not tokens:
+            return []
+        match = ' '.join(f'"{token}"' for token in tokens)
+
+        keyset, keyset_params = cls._keyset_clause(after)
+        sql = (
+            f"SELECT search_key, score, order_id, body FROM ("
+            f"SELECT rowid AS search_key, -bm25({FTS_TABLE}) AS score, order_id, body "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"AND order_id IN ({INVOLVED_ORDERS_SQL})"
+            f") hits {keyset} ORDER BY score DESC, search_key LIMIT %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match, user.id, user.id, user.id] + keyset_params + [limit])
+            return cursor.fetchall()
@@ -56,8 +56,8 @@ class ChatRoomSerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatRoom
         fields = ('id', 'order', 'order_info', 'participants', 'latest_message', 
-                 'created_at', 'is_active')
-        read_only_fields = ('id', 'created_at')
+                 'last_activity_at', 'created_at', 'is_active')
+        read_only_fields = ('id', 'last_activity_at', 'created_at')
 
     def get_order_info(self, obj):
         return {
@@ -69,7 +69,7 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         }
 
     def get_latest_message(self, obj):
-        latest = obj.order.chat_messages.first()
+        latest = obj.last_message
         if latest:
             return {
                 'message': latest.message,
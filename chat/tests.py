@@ -1,10 +1,33 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.core.cache import cache
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from asgiref.testing import ApplicationCommunicator
+from channels.exceptions import ChannelFull
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
+from django.core.exceptions import ImproperlyConfigured
 from django.urls import reverse
 from decimal import Decimal
-from .models import ChatMessage, ChatRoom
+from .models import ChatMessage, ChatRoom, UnreadCounter
+from .presence import PresenceService
+from .routing import websocket_urlpatterns
+from .search import install_search_index
+from . import drain
+from .layers import BrokerCache, ChannelBroker, UnixSocketChannelLayer
+from .middleware import JWTAuthMiddlewareStack, clear_user_cache, get_jwt_user
+from irefuel_backend import metrics
+from irefuel_backend.deployment import check_shared_state
 from orders.models import Order
 from users.models import Cafeteria
 
@@ -162,3 +185,690 @@ class ChatTestCase(TestCase):
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['unread_count'], 1)
+
+    def test_unread_counter_per_order_and_reset_on_read(self):
+        """Test that unread counters are kept per order and reset when read"""
+        self.client.force_authenticate(user=self.vendor)
+        for text in ('First', 'Second'):
+            self.client.post('/api/chat/send/', {
+                'receiver': self.student.id,
+                'order': self.order.id,
+                'message': text
+            }, format='json')
+        
+        self.assertEqual(UnreadCounter.get_count(self.student.id, self.order.id), 2)
+        
+        self.client.force_authenticate(user=self.student)
+        response = self.client.get('/api/chat/unread-count/')
+        self.assertEqual(response.data['unread_count'], 2)
+        self.assertEqual(response.data['orders'], [{'order_id': self.order.id, 'unread_count': 2}])
+        
+        self.client.get(f'/api/chat/orders/{self.order.id}/')
+        response = self.client.get('/api/chat/unread-count/')
+        self.assertEqual(response.data['unread_count'], 0)
+        self.assertEqual(response.data['orders'], [])
+
+    def test_chat_rooms_list_latest_message_and_query_count(self):
+        """Test that room list shows the newest message, sorted by activity, in constant queries"""
+        self.client.force_authenticate(user=self.student)
+        orders = [self.order] + [
+            Order.objects.create(
+                student=self.student,
+                vendor=self.vendor,
+                total_amount=Decimal('3.00'),
+                delivery_address='Test Address',
+                estimated_preparation_time=10
+            )
+            for _ in range(3)
+        ]
+        for order in orders:
+            for text in ('Old message', f'Newest for {order.id}'):
+                self.client.post('/api/chat/send/', {
+                    'receiver': self.vendor.id,
+                    'order': order.id,
+                    'message': text
+                }, format='json')
+        
+        # Page count, rooms page and participants prefetch
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/chat/rooms/')
+        
+        results = response.data['results']
+        self.assertEqual([room['order'] for room in results], [o.id for o in reversed(orders)])
+        self.assertEqual(results[0]['latest_message']['message'], f'Newest for {orders[-1].id}')
+
+    def test_search_is_ranked_paginated_and_scoped_to_caller(self):
+        """Test full-text search across messages and notes for the caller's orders only"""
+        from delivery.models import DeliveryRequest
+        
+        self.order.special_instructions = 'Leave it at gate 3'
+        self.order.save()
+        ChatMessage.objects.create(
+            sender=self.student, receiver=self.vendor, order=self.order,
+            message='I am waiting by gate 3 now'
+        )
+        DeliveryRequest.objects.create(
+            order=self.order, delivery_person=self.delivery_person,
+            delivery_notes='Student was at gate 3'
+        )
+        other_student = User.objects.create_user(
+            username='other', password='testpass123', user_type='student'
+        )
+        other_order = Order.objects.create(
+            student=other_student, vendor=self.vendor, total_amount=Decimal('1.00'),
+            delivery_address='Elsewhere', estimated_preparation_time=5,
+            special_instructions='Also gate 3'
+        )
+        
+        self.client.force_authenticate(user=self.student)
+        response = self.client.get('/api/chat/search/', {'q': 'gate 3', 'limit': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first_page = response.data['results']
+        self.assertEqual(len(first_page), 2)
+        self.assertIsNotNone(response.data['next_cursor'])
+        
+        response = self.client.get('/api/chat/search/', {
+            'q': 'gate 3', 'limit': 2, 'cursor': response.data['next_cursor']
+        })
+        hits = first_page + response.data['results']
+        self.assertEqual(sorted(hit['type'] for hit in hits), ['delivery_note', 'message', 'order_note'])
+        self.assertTrue(all(hit['order_id'] == self.order.id for hit in hits))
+        self.assertNotIn(other_order.id, [hit['order_id'] for hit in hits])
+        scores = [hit['score'] for hit in hits]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_search_index_install_repairs_missing_triggers(self):
+        """Test that a missing trigger is recreated with its source reindexed, and unsupported databases get a 501"""
+        from django.db import connection
+        from delivery.models import DeliveryRequest
+        
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER delivery_deliveryrequest_fts_insert')
+        DeliveryRequest.objects.create(
+            order=self.order, delivery_person=self.delivery_person, delivery_notes='Left at the blue door'
+        )
+        with mock.patch.object(connection.introspection, 'table_names', return_value=['chat_chatmessage']):
+            install_search_index(connection)  # Partial schema: waits for the next migrate
+        install_search_index(connection)
+        
+        self.client.force_authenticate(user=self.student)
+        response = self.client.get('/api/chat/search/', {'q': 'blue door'})
+        self.assertEqual([hit['type'] for hit in response.data['results']], ['delivery_note'])
+        
+        with mock.patch('chat.views.ChatSearchService.is_supported', return_value=False):
+            response = self.client.get('/api/chat/search/', {'q': 'blue door'})
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+
+class ChatConsumerTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user(
+            username='student1',
+            password='testpass123',
+            user_type='student'
+        )
+        self.vendor = User.objects.create_user(
+            username='vendor1',
+            password='testpass123',
+            user_type='vendor'
+        )
+        self.order = Order.objects.create(
+            student=self.student,
+            vendor=self.vendor,
+            total_amount=Decimal('5.99'),
+            delivery_address='Test Address',
+            estimated_preparation_time=15
+        )
+        self.messages = [
+            ChatMessage.objects.create(
+                sender=self.vendor,
+                receiver=self.student,
+                order=self.order,
+                message=f'Message {i}'
+            )
+            for i in range(3)
+        ]
+
+    async def connect(self, user):
+        communicator = ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+            'type': 'websocket',
+            'path': f'/ws/chat/{self.order.id}/',
+            'headers': [],
+            'query_string': b'',
+            'user': user,
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        response = await communicator.receive_output(timeout=2)
+        self.assertEqual(response['type'], 'websocket.accept')
+        presence = await self.receive_json(communicator)
+        self.assertEqual(presence, {'type': 'presence', 'user_id': user.id, 'online': True})
+        return communicator
+
+    async def send_json(self, communicator, data):
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def receive_json(self, communicator, timeout=2):
+        response = await communicator.receive_output(timeout=timeout)
+        return json.loads(response['text'])
+
+    async def disconnect(self, communicator):
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=2)
+
+    @override_settings(CHAT_READ_RECEIPT_WINDOW=0.05)
+    def test_read_up_to_is_coalesced_into_one_receipt(self):
+        """Test that a burst of read_up_to frames yields one ranged update and receipt"""
+        async def scenario():
+            communicator = await self.connect(self.student)
+            await self.send_json(communicator, {'type': 'read_up_to', 'message_id': 'latest'})
+            error = await self.receive_json(communicator)
+            await self.send_json(communicator, {'type': 'read_up_to', 'message_id': self.messages[0].id})
+            await self.send_json(communicator, {'type': 'read_up_to', 'message_id': self.messages[1].id})
+            receipt = await self.receive_json(communicator)
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+            await self.disconnect(communicator)
+            return error, receipt
+
+        error, receipt = async_to_sync(scenario)()
+        self.assertEqual(error, {'type': 'error', 'error': 'read_up_to needs a numeric message_id.'})
+        self.assertEqual(receipt, {
+            'type': 'read_receipt',
+            'reader_id': self.student.id,
+            'read_up_to': self.messages[1].id
+        })
+        unread = ChatMessage.objects.filter(receiver=self.student, is_read=False)
+        self.assertEqual(list(unread), [self.messages[2]])
+        self.assertEqual(UnreadCounter.get_count(self.student.id, self.order.id), 1)
+
+    def test_typing_is_coalesced_and_presence_readable_over_http(self):
+        """Test that repeated typing frames broadcast once and presence is served from the cache"""
+        client = APIClient()
+        client.force_authenticate(user=self.vendor)
+
+        def get_participants():
+            response = client.get(f'/api/chat/orders/{self.order.id}/presence/')
+            return {p['id']: p for p in response.data['participants']}
+
+        async def scenario():
+            communicator = await self.connect(self.student)
+            await self.send_json(communicator, {'type': 'typing', 'is_typing': True})
+            await self.send_json(communicator, {'type': 'typing', 'is_typing': True})
+            typing = await self.receive_json(communicator)
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+            while_connected = await sync_to_async(get_participants)()
+            await self.disconnect(communicator)
+            after_disconnect = await sync_to_async(get_participants)()
+            return typing, while_connected, after_disconnect
+
+        typing, while_connected, after_disconnect = async_to_sync(scenario)()
+        self.assertEqual(typing['user_id'], self.student.id)
+        self.assertTrue(typing['is_typing'])
+        self.assertEqual(while_connected[self.student.id], {'id': self.student.id, 'online': True, 'typing': True})
+        self.assertEqual(while_connected[self.vendor.id], {'id': self.vendor.id, 'online': False, 'typing': False})
+        self.assertFalse(after_disconnect[self.student.id]['online'])
+        self.assertFalse(after_disconnect[self.student.id]['typing'])
+
+    def test_ping_refreshes_presence_and_bad_frames_get_an_error(self):
+        """Test that a chat socket can keep presence alive and survives incomplete messages"""
+        async def scenario():
+            communicator = await self.connect(self.student)
+            # Simulate the presence TTL running out on a quiet socket
+            await sync_to_async(cache.delete)(f'presence:user:{self.student.id}')
+            await self.send_json(communicator, {'type': 'ping'})
+            pong = await self.receive_json(communicator)
+            online = await sync_to_async(PresenceService.online_users)([self.student.id])
+            await self.send_json(communicator, {'message': 'Hello'})
+            missing_receiver = await self.receive_json(communicator)
+            await self.send_json(communicator, {'receiver_id': self.vendor.id})
+            missing_message = await self.receive_json(communicator)
+            await self.send_json(communicator, {'type': 'ping'})
+            still_open = await self.receive_json(communicator)
+            await self.disconnect(communicator)
+            return pong, online, missing_receiver, missing_message, still_open
+
+        pong, online, missing_receiver, missing_message, still_open = async_to_sync(scenario)()
+        self.assertEqual(pong, {'type': 'pong'})
+        self.assertEqual(online, {self.student.id: True})
+        error = {'type': 'error', 'error': 'message and receiver_id are required.'}
+        self.assertEqual(missing_receiver, error)
+        self.assertEqual(missing_message, error)
+        self.assertEqual(still_open, {'type': 'pong'})
+        self.assertEqual(ChatMessage.objects.count(), 3)
+
+    def test_multiplexed_socket_subscribes_per_stream(self):
+        """Test that one socket can carry several authorized streams"""
+        other_order = Order.objects.create(
+            student=User.objects.create_user(username='other', password='testpass123', user_type='student'),
+            vendor=self.vendor,
+            total_amount=Decimal('1.00'),
+            delivery_address='Elsewhere',
+            estimated_preparation_time=5
+        )
+
+        async def scenario():
+            communicator = ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+                'type': 'websocket',
+                'path': '/ws/stream/',
+                'headers': [],
+                'query_string': b'',
+                'user': self.student,
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(timeout=2))['type'], 'websocket.accept')
+
+            frames = []
+            for frame in (
+                {'action': 'subscribe', 'stream': 'chat', 'order_id': self.order.id},
+                {'action': 'subscribe', 'stream': 'chat', 'order_id': other_order.id},
+                {'action': 'subscribe', 'stream': 'notifications'},
+                {'action': 'send', 'stream': 'chat', 'order_id': self.order.id,
+                 'message': 'Hello', 'receiver_id': self.vendor.id},
+            ):
+                await self.send_json(communicator, frame)
+                frames.append(await self.receive_json(communicator))
+            # Withdrawn dispatch offers reach the notifications stream instead of closing the socket
+            await get_channel_layer().group_send(
+                f'user_{self.student.id}', {'type': 'offer_retracted', 'order_id': self.order.id}
+            )
+            frames.append(await self.receive_json(communicator))
+            await self.disconnect(communicator)
+            return frames
+
+        subscribed, forbidden, notifications, message, retracted = async_to_sync(scenario)()
+        self.assertEqual(subscribed, {'type': 'subscribed', 'stream': 'chat', 'order_id': self.order.id})
+        self.assertEqual(forbidden['type'], 'error')
+        self.assertEqual(forbidden['order_id'], other_order.id)
+        self.assertEqual(notifications, {'type': 'subscribed', 'stream': 'notifications', 'order_id': None})
+        self.assertEqual(message['stream'], 'chat')
+        self.assertEqual(message['type'], 'chat_message')
+        self.assertEqual(
+            (retracted['type'], retracted['stream'], retracted['order_id']),
+            ('offer_retracted', 'notifications', self.order.id)
+        )
+        self.assertEqual(message['order_id'], self.order.id)
+        self.assertEqual(message['message'], 'Hello')
+
+    def test_notification_filters_and_compact_encoding(self):
+        """Test that notification sockets only get negotiated events, in the negotiated encoding"""
+        from delivery.services import NotificationService
+
+        other_order = Order.objects.create(
+            student=self.student,
+            vendor=self.vendor,
+            total_amount=Decimal('1.00'),
+            delivery_address='Elsewhere',
+            estimated_preparation_time=5
+        )
+
+        async def scenario():
+            communicator = ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+                'type': 'websocket',
+                'path': '/ws/notifications/',
+                'headers': [],
+                'query_string': f'events=order_update&orders={self.order.id}&encoding=compact'.encode(),
+                'user': self.student,
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(timeout=2))['type'], 'websocket.accept')
+            connected = await self.receive_json(communicator)
+
+            await sync_to_async(NotificationService.notify_order_update)(other_order, 'Ignored')
+            await sync_to_async(NotificationService.notify_unread_update)(self.student.id, self.order.id)
+            await sync_to_async(NotificationService.notify_order_update)(self.order, 'Confirmed')
+            frame = await communicator.receive_output(timeout=2)
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+            await self.disconnect(communicator)
+            return connected, frame
+
+        connected, frame = async_to_sync(scenario)()
+        self.assertEqual(connected['encoding'], 'compact')
+        self.assertEqual(connected['events'], ['order_update'])
+        self.assertEqual(
+            frame['text'],
+            json.dumps({'t': 'order_update', 'o': self.order.id, 's': 'pending', 'm': 'Confirmed', 'q': 3}, separators=(',', ':'))
+        )
+
+    @override_settings(NOTIFICATION_BUFFER_SIZE=3)
+    def test_notification_resume_replays_only_missed_events(self):
+        """Test that reconnecting with last_seq replays the gap, or asks for a resync once evicted"""
+        from delivery.services import NotificationService
+
+        for message in ('One', 'Two', 'Three'):
+            NotificationService.notify_order_update(self.order, message)
+
+        async def reconnect(last_seq, expected_frames):
+            communicator = ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+                'type': 'websocket',
+                'path': '/ws/notifications/',
+                'headers': [],
+                'query_string': f'last_seq={last_seq}'.encode(),
+                'user': self.student,
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(timeout=2))['type'], 'websocket.accept')
+            frames = [await self.receive_json(communicator) for _ in range(expected_frames)]
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+            await self.disconnect(communicator)
+            return frames
+
+        replayed = async_to_sync(reconnect)(1, 2)
+        self.assertEqual([(f['seq'], f['message']) for f in replayed], [(2, 'Two'), (3, 'Three')])
+
+        NotificationService.notify_order_update(self.order, 'Four')
+        NotificationService.notify_order_update(self.order, 'Five')
+        resync = async_to_sync(reconnect)(1, 1)
+        self.assertEqual(resync, [{'type': 'resync_required', 'seq': 5}])
+
+    def test_out_of_order_live_events_are_all_delivered(self):
+        """Test that only seqs covered by the replay are dropped, whatever order live events arrive in"""
+        from delivery.services import NotificationService
+
+        for message in ('One', 'Two', 'Three'):
+            NotificationService.notify_order_update(self.order, message)
+
+        async def scenario():
+            communicator = ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+                'type': 'websocket',
+                'path': '/ws/notifications/',
+                'headers': [],
+                'query_string': b'last_seq=2',
+                'user': self.student,
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(timeout=2))['type'], 'websocket.accept')
+            frames = [await self.receive_json(communicator)]
+
+            # Seqs from different processes: 3 is a late duplicate of the replay, 5 overtakes 4
+            for seq, order_id in ((3, self.order.id), (5, self.order.id + 1), (4, self.order.id + 2)):
+                await get_channel_layer().group_send(f'user_{self.student.id}', {
+                    'type': 'order_update', 'order_id': order_id, 'status': 'ready', 'message': 'Live', 'seq': seq
+                })
+            frames += [await self.receive_json(communicator) for _ in range(2)]
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+            await self.disconnect(communicator)
+            return frames
+
+        frames = async_to_sync(scenario)()
+        self.assertEqual([(f['seq'], f['message']) for f in frames], [(3, 'Three'), (5, 'Live'), (4, 'Live')])
+
+    def test_jwt_websocket_auth_with_cached_user(self):
+        """Test that sockets authenticate from a JWT and reuse the cached user"""
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        clear_user_cache()
+        token = str(AccessToken.for_user(self.student))
+        application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+        async def connect(query_string=b'', subprotocols=()):
+            communicator = ApplicationCommunicator(application, {
+                'type': 'websocket',
+                'path': '/ws/notifications/',
+                'headers': [],
+                'query_string': query_string,
+                'subprotocols': list(subprotocols),
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            response = await communicator.receive_output(timeout=2)
+            if response['type'] == 'websocket.accept':
+                await self.disconnect(communicator)
+            return response
+
+        async def scenario():
+            first = await get_jwt_user(token)
+            second = await get_jwt_user(token)
+            return (
+                first is second,
+                await connect(f'token={token}'.encode()),
+                await connect(subprotocols=('jwt', token)),
+                await connect(b'token=not-a-token'),
+            )
+
+        cached, by_query, by_subprotocol, invalid = async_to_sync(scenario)()
+        self.assertTrue(cached)
+        self.assertEqual(by_query['type'], 'websocket.accept')
+        self.assertEqual(by_subprotocol, {'type': 'websocket.accept', 'subprotocol': 'jwt'})
+        self.assertEqual(invalid['type'], 'websocket.close')
+
+    @override_settings(WS_OUTBOUND_HIGH_WATER=2)
+    def test_outbound_queue_coalesces_and_drops_slow_consumers(self):
+        """Test that superseded updates are coalesced and a stalled client is cut off with a resume hint"""
+        from chat.backpressure import OutboundQueueMixin, SLOW_CONSUMER_CLOSE_CODE
+
+        class StalledSocket:
+            def __init__(self):
+                self.sent = []
+                self.closed = []
+                self.unblock = asyncio.Event()
+
+            async def send(self, text_data=None, bytes_data=None, close=False):
+                self.sent.append(text_data)
+                if text_data == 'stuck':
+                    await self.unblock.wait()
+
+            async def close(self, code=None):
+                self.closed.append(code)
+
+        class Consumer(OutboundQueueMixin, StalledSocket):
+            pass
+
+        async def scenario():
+            consumer = Consumer()
+            await consumer.send(text_data='first', seq=1)
+            await asyncio.sleep(0)
+            await consumer.send(text_data='stuck', seq=2)
+            await asyncio.sleep(0)
+            for status_text in ('preparing', 'ready'):
+                await consumer.send(text_data=status_text, coalesce_key=('order_update', 1), seq=3)
+            await consumer.send(text_data='chat', seq=4)
+            queued = list(consumer.outbound_queue.values())
+            await consumer.send(text_data='overflow', seq=5)
+            await consumer.send(text_data='late', seq=6)
+            await consumer.send(text_data='later', coalesce_key=('order_update', 1), seq=7)
+            return consumer, queued
+
+        metrics.reset()
+        consumer, queued = async_to_sync(scenario)()
+        self.assertEqual([frame[0] for frame in queued], ['ready', 'chat'])
+        self.assertEqual(json.loads(consumer.sent[-1]), {'type': 'reconnect', 'reason': 'slow_consumer', 'last_seq': 1})
+        self.assertEqual(consumer.closed, [SLOW_CONSUMER_CLOSE_CODE])
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(counters['ws.outbound.coalesced'], 1)
+        self.assertEqual(counters['ws.outbound.slow_disconnects'], 1)
+        self.assertEqual(counters['ws.outbound.dropped'], 5)
+
+    @override_settings(CHAT_READ_RECEIPT_WINDOW=5)
+    def test_drain_flushes_receipts_and_closes_with_reconnect_hint(self):
+        """Test that a drain persists deferred receipts, then closes with a jittered reconnect hint"""
+        self.addCleanup(drain.reset)
+
+        async def scenario():
+            communicator = await self.connect(self.student)
+            await self.send_json(communicator, {'type': 'read_up_to', 'message_id': self.messages[2].id})
+            await communicator.receive_nothing(timeout=0.05)
+
+            draining = asyncio.ensure_future(drain.drain(window=0.1, jitter=2))
+            frames = []
+            while True:
+                output = await communicator.receive_output(timeout=2)
+                if output['type'] == 'websocket.close':
+                    break
+                frames.append(json.loads(output['text']))
+            await draining
+
+            rejected = ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+                'type': 'websocket',
+                'path': f'/ws/chat/{self.order.id}/',
+                'headers': [],
+                'query_string': b'',
+                'user': self.vendor,
+            })
+            await rejected.send_input({'type': 'websocket.connect'})
+            rejected_output = await rejected.receive_output(timeout=2)
+            await self.disconnect(communicator)
+            await self.disconnect(rejected)
+            return frames, output, rejected_output
+
+        frames, closed, rejected = async_to_sync(scenario)()
+        self.assertEqual(ChatMessage.objects.filter(receiver=self.student, is_read=False).count(), 0)
+        hint = frames[-1]
+        self.assertEqual(hint['type'], 'reconnect_after')
+        self.assertTrue(0 <= hint['delay_ms'] <= 2000)
+        self.assertEqual(closed['code'], drain.SERVICE_RESTART_CLOSE_CODE)
+        self.assertEqual(rejected['type'], 'websocket.close')
+
+    def test_drain_tracks_accepted_sockets_and_runs_on_lifespan_shutdown(self):
+        """Test that refused sockets are never tracked and a lifespan shutdown drains the accepted ones"""
+        outsider = User.objects.create_user(
+            username='outsider', email='outsider@test.com', password='testpass123', user_type='student'
+        )
+        self.addCleanup(drain.reset)
+
+        async def scenario():
+            tracked = len(drain._consumers)
+            refused = ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+                'type': 'websocket',
+                'path': f'/ws/chat/{self.order.id}/',
+                'headers': [],
+                'query_string': b'',
+                'user': outsider,
+            })
+            await refused.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await refused.receive_output(timeout=2))['type'], 'websocket.close')
+            tracked_after_refusal = len(drain._consumers) - tracked
+
+            communicator = await self.connect(self.student)
+            tracked_after_accept = len(drain._consumers) - tracked
+
+            lifespan_queue = asyncio.Queue()
+            sent = []
+
+            async def send(message):
+                sent.append(message['type'])
+
+            server = asyncio.ensure_future(drain.lifespan({'type': 'lifespan'}, lifespan_queue.get, send))
+            await lifespan_queue.put({'type': 'lifespan.startup'})
+            await lifespan_queue.put({'type': 'lifespan.shutdown'})
+            closed = None
+            while closed is None:
+                output = await communicator.receive_output(timeout=2)
+                if output['type'] == 'websocket.close':
+                    closed = output
+            await server
+            await self.disconnect(communicator)
+            return tracked_after_refusal, tracked_after_accept, closed, sent
+
+        with override_settings(WS_DRAIN_WINDOW=0, WS_RECONNECT_JITTER=0):
+            refused, accepted, closed, sent = async_to_sync(scenario)()
+        self.assertEqual((refused, accepted), (0, 1))
+        self.assertEqual(closed['code'], drain.SERVICE_RESTART_CLOSE_CODE)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+
+class UnixSocketChannelLayerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'channels.sock')
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_groups_are_shared_between_worker_layers(self):
+        async def scenario():
+            broker = ChannelBroker(self.path)
+            await broker.start()
+            worker_a = UnixSocketChannelLayer(path=self.path)
+            worker_b = UnixSocketChannelLayer(path=self.path, capacity=1)
+            try:
+                channel = await worker_a.new_channel()
+                await worker_a.group_add('order_1', channel)
+
+                # Sent from the other worker, picked up by the waiting receive
+                receiving = asyncio.ensure_future(worker_a.receive(channel))
+                await asyncio.sleep(0.01)
+                await worker_b.group_send('order_1', {'type': 'chat.message', 'n': 1})
+                self.assertEqual(await asyncio.wait_for(receiving, 1), {'type': 'chat.message', 'n': 1})
+
+                await worker_a.group_discard('order_1', channel)
+                await worker_b.group_send('order_1', {'type': 'chat.message', 'n': 2})
+
+                await worker_b.send(channel, {'type': 'direct'})
+                with self.assertRaises(ChannelFull):
+                    await worker_b.send(channel, {'type': 'over.capacity'})
+                self.assertEqual(await worker_a.receive(channel), {'type': 'direct'})
+
+                # A cancelled receive must not swallow the next message
+                receiving = asyncio.ensure_future(worker_a.receive(channel))
+                await asyncio.sleep(0.01)
+                receiving.cancel()
+                await worker_b.send(channel, {'type': 'after.cancel'})
+                self.assertEqual(await asyncio.wait_for(worker_a.receive(channel), 1), {'type': 'after.cancel'})
+            finally:
+                await worker_a.close()
+                await worker_b.close()
+                await broker.close()
+
+        async_to_sync(scenario)()
+
+    def test_broker_sweep_drops_state_nobody_will_read(self):
+        """Test that the periodic sweep clears what a crashed worker left behind"""
+        broker = ChannelBroker(self.path)
+        gone, live = mock.Mock(closed=True), mock.Mock(closed=False)
+        broker.op_group_add(live, 1, 'order_1', 'specific.dead!1', -1)
+        broker.op_group_add(live, 2, 'order_1', 'specific.alive!1', 60)
+        broker.deliver('specific.dead!1', {'type': 'stale'}, expiry=-1, capacity=10)
+        broker.deliver('specific.alive!1', {'type': 'fresh'}, expiry=60, capacity=10)
+        broker.op_receive(gone, 3, 'specific.orphan!1')
+        broker.op_receive(live, 4, 'specific.waiting!1')
+        broker.op_cache_set_many(live, 5, {'expired': 1}, time.time() - 1)
+        broker.op_cache_set_many(live, 6, {'kept': 1}, None)
+
+        broker.sweep()
+        self.assertEqual(broker.groups, {'order_1': {'specific.alive!1': mock.ANY}})
+        self.assertEqual(list(broker.channels), ['specific.alive!1'])
+        self.assertEqual(list(broker.waiters), ['specific.waiting!1'])
+        self.assertEqual(list(broker.cache), ['kept'])
+
+    def test_broker_serves_a_shared_cache(self):
+        """Test that two workers' caches see the same keys and incr hands out every value once"""
+        broker = ChannelBroker(self.path)
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        asyncio.run_coroutine_threadsafe(broker.start(), loop).result(timeout=5)
+
+        def stop():
+            asyncio.run_coroutine_threadsafe(broker.close(), loop).result(timeout=5)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+        self.addCleanup(stop)
+
+        worker_a, worker_b = BrokerCache(self.path, {}), BrokerCache(self.path, {})
+        worker_a.set('presence', {'online': True}, 60)
+        self.assertEqual(worker_b.get('presence'), {'online': True})
+        self.assertFalse(worker_b.add('presence', 'other'))
+        self.assertTrue(worker_b.add('seq', 0))
+        self.assertEqual(worker_a.get_many(['presence', 'seq', 'missing']), {'presence': {'online': True}, 'seq': 0})
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            values = list(pool.map(lambda i: (worker_a, worker_b)[i % 2].incr('seq'), range(200)))
+        self.assertEqual(sorted(values), list(range(1, 201)))
+        with self.assertRaises(ValueError):
+            worker_a.incr('missing')
+
+        worker_a.set('expired', 1, 0)
+        self.assertIsNone(worker_b.get('expired'))
+        self.assertTrue(worker_b.touch('seq', 0))
+        self.assertFalse(worker_a.has_key('seq'))
+        self.assertTrue(worker_b.delete('presence'))
+        self.assertIsNone(worker_a.get('presence'))
+
+    @override_settings(
+        CHANNEL_LAYERS={'default': {'BACKEND': 'chat.layers.UnixSocketChannelLayer', 'CONFIG': {'path': '/tmp/x.sock'}}},
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    )
+    def test_shared_layer_refuses_process_local_cache(self):
+        """Sequence numbers and presence would diverge between workers on a per-process cache"""
+        with self.assertRaises(ImproperlyConfigured):
+            check_shared_state()
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379/1'}}):
+            check_shared_state()
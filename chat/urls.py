@@ -11,7 +11,11 @@ urlpatterns = [
     # Chat rooms
     path('rooms/', views.UserChatRoomsView.as_view(), name='user-chat-rooms'),
     
+    # Search
+    path('search/', views.search_messages, name='search-messages'),
+    
     # Utilities
     path('unread-count/', views.UnreadMessagesCountView.as_view(), name='unread-messages-count'),
     path('orders/<int:order_id>/participants/', views.get_order_participants, name='order-participants'),
+    path('orders/<int:order_id>/presence/', views.get_order_presence, name='order-presence'),
 ]
@@ -4,9 +4,13 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
-from .models import ChatMessage, ChatRoom
+from django.db.models import F
+from .models import ChatMessage, ChatRoom, UnreadCounter
+from .presence import PresenceService
+from .search import ChatSearchService, encode_cursor, decode_cursor
 from .serializers import ChatMessageSerializer, ChatMessageCreateSerializer, ChatRoomSerializer
 from orders.models import Order
+from delivery.services import NotificationService
 
 User = get_user_model()
 
@@ -29,11 +33,14 @@ class OrderChatMessagesView(generics.ListAPIView):
             raise PermissionDenied("You are not involved in this order.")
         
         # Mark messages as read for the current user
-        ChatMessage.objects.filter(
+        marked = ChatMessage.objects.filter(
             order=order,
             receiver=user,
             is_read=False
         ).update(is_read=True)
+        if marked:
+            UnreadCounter.reset(user.id, order.id)
+            NotificationService.notify_unread_update(user.id, order.id)
         
         return ChatMessage.objects.filter(order=order)
 
@@ -49,7 +56,10 @@ class SendMessageView(generics.CreateAPIView):
         
         # Create or get chat room for the order
         order = message.order
-        chat_room, created = ChatRoom.objects.get_or_create(order=order)
+        chat_room, created = ChatRoom.objects.get_or_create(
+            order=order,
+            defaults={'last_message': message, 'last_activity_at': message.timestamp}
+        )
         
         if created:
             # Add all involved users to the chat room
@@ -58,6 +68,8 @@ class SendMessageView(generics.CreateAPIView):
                 participants.append(order.delivery_person)
             chat_room.participants.set(participants)
         
+        NotificationService.notify_unread_update(message.receiver_id, order.id)
+        
         return Response({
             'message': ChatMessageSerializer(message).data,
             'chat_room': ChatRoomSerializer(chat_room).data
@@ -69,22 +81,30 @@ class UserChatRoomsView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
+        # Latest message is a maintained pointer, so the page is built in a fixed number of queries
         return ChatRoom.objects.filter(
             participants=self.request.user,
             is_active=True
-        ).order_by('-created_at')
+        ).select_related(
+            'order__student', 'order__vendor', 'last_message__sender'
+        ).prefetch_related('participants').order_by(
+            F('last_activity_at').desc(nulls_last=True), '-created_at'
+        )
 
 
 class UnreadMessagesCountView(generics.GenericAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        unread_count = ChatMessage.objects.filter(
-            receiver=request.user,
-            is_read=False
-        ).count()
+        unread_count, per_order = UnreadCounter.get_totals(request.user.id)
         
-        return Response({'unread_count': unread_count})
+        return Response({
+            'unread_count': unread_count,
+            'orders': [
+                {'order_id': order_id, 'unread_count': count}
+                for order_id, count in per_order.items()
+            ]
+        })
 
 
 @api_view(['GET'])
@@ -115,3 +135,77 @@ def get_order_participants(request, order_id):
         'order_id': order.id,
         'participants': participants
     })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def get_order_presence(request, order_id):
+    """Online and typing state of an order's participants, read from the cache only"""
+    order = get_object_or_404(Order, id=order_id)
+    
+    involved_ids = [order.student_id, order.vendor_id]
+    if order.delivery_person_id:
+        involved_ids.append(order.delivery_person_id)
+    
+    if request.user.id not in involved_ids:
+        raise PermissionDenied("You are not involved in this order.")
+    
+    online = PresenceService.online_users(involved_ids)
+    typing = PresenceService.typing_users(order.id, involved_ids)
+    
+    return Response({
+        'order_id': order.id,
+        'participants': [
+            {'id': user_id, 'online': online[user_id], 'typing': typing[user_id]}
+            for user_id in involved_ids
+        ]
+    })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def search_messages(request):
+    """
+    Ranked full-text search over chat messages, order instructions and
+    delivery notes for orders the caller is involved in.
+    Paginate by passing back `next_cursor` as `cursor`.
+    """
+    if not ChatSearchService.is_supported():
+        return Response(
+            {'error': 'Search is not available on this database.'},
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+    
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response(
+            {'error': 'q is required.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    after = None
+    if request.query_params.get('cursor'):
+        after = decode_cursor(request.query_params['cursor'])
+        if after is None:
+            return Response(
+                {'error': 'Invalid cursor.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    try:
+        limit = min(max(int(request.query_params.get('limit', 20)), 1), 50)
+    except ValueError:
+        limit = 20
+    
+    hits = ChatSearchService.search(request.user, query, after=after, limit=limit)
+    next_cursor = None
+    if len(hits) == limit:
+        next_cursor = encode_cursor(hits[-1]['score'], hits[-1]['key'])
+    
+    return Response({
+        'results': [
+            {key: value for key, value in hit.items() if key != 'key'}
+            for hit in hits
+        ],
+        'next_cursor': next_cursor
+    })
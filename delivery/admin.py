@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import DeliveryRequest, DeliveryPersonLocation
+from .models import DeliveryRequest, DeliveryPersonLocation, CampusNode, WalkingEdge
 
 
 @admin.register(DeliveryRequest)
@@ -18,3 +18,16 @@ class DeliveryPersonLocationAdmin(admin.ModelAdmin):
     search_fields = ('delivery_person__username', 'campus_area')
     raw_id_fields = ('delivery_person',)
     readonly_fields = ('last_updated',)
+
+
+@admin.register(CampusNode)
+class CampusNodeAdmin(admin.ModelAdmin):
+    list_display = ('name', 'location', 'cafeteria')
+    search_fields = ('name',)
+
+
+@admin.register(WalkingEdge)
+class WalkingEdgeAdmin(admin.ModelAdmin):
+    list_display = ('source', 'target', 'travel_seconds', 'bidirectional')
+    list_filter = ('bidirectional',)
+    search_fields = ('source__name', 'target__name')
@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class DeliveryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'delivery'
+
+    def ready(self):
+        from orders.models import DeliveryLocation
+        from users.models import Cafeteria
+        from .campus_graph import graph_changed, place_changed
+        from .models import CampusNode, WalkingEdge
+
+        # The walking matrix is rebuilt from these, see delivery.campus_graph; signals also
+        # fire for cascades (e.g. deleting a cafeteria removes its node) that skip Model.delete()
+        for model in (CampusNode, WalkingEdge):
+            post_save.connect(graph_changed, sender=model, dispatch_uid=f'campus_routes_save_{model.__name__}')
+            post_delete.connect(graph_changed, sender=model, dispatch_uid=f'campus_routes_delete_{model.__name__}')
+        # Place names and vendors in the matrix header come from these
+        for model in (DeliveryLocation, Cafeteria):
+            post_save.connect(place_changed, sender=model, dispatch_uid=f'campus_routes_save_{model.__name__}')
@@ -0,0 +1,216 @@
+"""
+Walking travel times between campus places.
+
+CampusNode and WalkingEdge describe the walkable graph: delivery
+locations, cafeterias and plain waypoints (gates, the bridge) joined by
+paths with a walking time. All-pairs shortest times are computed with
+Dijkstra from every node and written to CAMPUS_ROUTES_PATH as a flat
+float32 matrix behind a small JSON header. Workers memory-map that file,
+so a lookup is a single index into shared pages and no process keeps its
+own copy. The file is rebuilt once per transaction that saves or deletes
+a node or edge, cascades included (post_save/post_delete, connected in
+DeliveryConfig.ready), or by ``manage.py build_campus_routes`` after
+QuerySet.update() or bulk_create(), which send no signals.
+
+File layout: MAGIC, header length (uint32, little endian), JSON header,
+padding to a 4-byte boundary, then n*n native float32 seconds with
+``inf`` for unreachable pairs.
+"""
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from array import array
+from typing import Optional
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'IRCR1\n'
+# Seconds between checks for a matrix rebuilt by another process
+RELOAD_CHECK_INTERVAL = 5
+
+_routes = None
+_loaded_mtime = None
+_checked_at = None
+
+
+def routes_path() -> str:
+    return str(getattr(settings, 'CAMPUS_ROUTES_PATH', os.path.join(settings.BASE_DIR, 'var', 'campus_routes.bin')))
+
+
+def shortest_times(node_count: int, adjacency: dict) -> array:
+    """All-pairs shortest times as a flat row-major float32 array, one Dijkstra per node"""
+    matrix = array('f', [math.inf]) * (node_count * node_count)
+    for source in range(node_count):
+        row = source * node_count
+        best = {source: 0.0}
+        heap = [(0.0, source)]
+        while heap:
+            seconds, node = heapq.heappop(heap)
+            if seconds > best[node]:
+                continue
+            matrix[row + node] = seconds
+            for neighbour, cost in adjacency.get(node, ()):
+                candidate = seconds + cost
+                if candidate < best.get(neighbour, math.inf):
+                    best[neighbour] = candidate
+                    heapq.heappush(heap, (candidate, neighbour))
+    return matrix
+
+
+def rebuild(path: str = None) -> int:
+    """Recompute the matrix from the database and atomically replace the file; returns the node count"""
+    from .models import CampusNode, WalkingEdge
+
+    path = path or routes_path()
+    nodes = list(CampusNode.objects.select_related('location', 'cafeteria').order_by('id'))
+    index = {node.id: i for i, node in enumerate(nodes)}
+
+    adjacency = {}
+    for source_id, target_id, seconds, bidirectional in WalkingEdge.objects.values_list(
+        'source_id', 'target_id', 'travel_seconds', 'bidirectional'
+    ):
+        adjacency.setdefault(index[source_id], []).append((index[target_id], seconds))
+        if bidirectional:
+            adjacency.setdefault(index[target_id], []).append((index[source_id], seconds))
+
+    header = json.dumps({
+        'nodes': [node.id for node in nodes],
+        'places': {
+            (node.location.name if node.location else node.name).lower(): i
+            for i, node in enumerate(nodes)
+        },
+        'vendors': {str(node.cafeteria.vendor_id): i for i, node in enumerate(nodes) if node.cafeteria},
+    }).encode()
+    prefix = MAGIC + struct.pack('<I', len(header)) + header
+    prefix += b'\0' * (-len(prefix) % 4)
+
+    matrix = shortest_times(len(nodes), adjacency)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.campus_routes')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(prefix)
+        matrix.tofile(f)
+    os.replace(tmp_path, path)
+    reset()
+    return len(nodes)
+
+
+class _PendingRebuild:
+    """The rebuild scheduled for the open transaction of a connection"""
+
+    def __init__(self):
+        self.ran = False
+
+    def __call__(self):
+        self.ran = True
+        try:
+            rebuild()
+        except OSError:
+            logger.exception('Could not rebuild campus routes at %s', routes_path())
+
+
+def rebuild_on_commit(using=None):
+    """Schedule a rebuild for when the current transaction commits, once however many rows it changes"""
+    from django.db import transaction
+
+    connection = transaction.get_connection(using)
+    pending = getattr(connection, 'campus_routes_rebuild', None)
+    if pending is not None and not pending.ran and any(
+        callback is pending for _, callback, _ in connection.run_on_commit
+    ):
+        return
+    connection.campus_routes_rebuild = _PendingRebuild()
+    transaction.on_commit(connection.campus_routes_rebuild, using=using)
+
+
+def graph_changed(sender, using=None, **kwargs):
+    """post_save/post_delete receiver for CampusNode and WalkingEdge"""
+    rebuild_on_commit(using)
+
+
+def place_changed(sender, instance, using=None, **kwargs):
+    """post_save receiver for delivery locations and cafeterias, whose names and vendors the header holds"""
+    if hasattr(instance, 'campus_node'):
+        rebuild_on_commit(using)
+
+
+class CampusRoutes:
+    """Read-only view of a matrix file"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a campus routes file')
+        header_length, = struct.unpack_from('<I', self._mmap, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(self._mmap[start:start + header_length])
+        offset = start + header_length
+        offset += -offset % 4
+
+        self.node_ids = header['nodes']
+        self.places = header['places']
+        self.vendors = {int(vendor_id): i for vendor_id, i in header['vendors'].items()}
+        self.size = len(self.node_ids)
+        self._matrix = memoryview(self._mmap)[offset:offset + 4 * self.size * self.size].cast('f')
+        # Longest names first, so "north campus dorm a" beats "north campus"
+        self._place_names = sorted(self.places, key=len, reverse=True)
+
+    def seconds(self, source: Optional[int], target: Optional[int]) -> Optional[float]:
+        """Walking seconds between two node indexes, None when either is unknown or unreachable"""
+        if source is None or target is None:
+            return None
+        seconds = self._matrix[source * self.size + target]
+        return None if math.isinf(seconds) else seconds
+
+    def node_for_place(self, text: str) -> Optional[int]:
+        """Node of the best known place named in a free text address or campus area"""
+        text = (text or '').lower()
+        for name in self._place_names:
+            if name in text:
+                return self.places[name]
+        return None
+
+    def node_for_vendor(self, vendor_id: int) -> Optional[int]:
+        return self.vendors.get(vendor_id)
+
+    def delivery_seconds(self, order) -> Optional[float]:
+        """Walk from the vendor's cafeteria to the order's delivery address"""
+        return self.seconds(self.node_for_vendor(order.vendor_id), self.node_for_place(order.delivery_address))
+
+    def pickup_seconds(self, location_info, order) -> Optional[float]:
+        """Walk from a courier's campus area to the order's cafeteria"""
+        return self.seconds(self.node_for_place(location_info.campus_area), self.node_for_vendor(order.vendor_id))
+
+
+def routes() -> Optional[CampusRoutes]:
+    """The current matrix, reloaded when the file has been rebuilt; None when there is none"""
+    global _routes, _loaded_mtime, _checked_at
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < RELOAD_CHECK_INTERVAL:
+        return _routes
+    _checked_at = now
+
+    try:
+        mtime = os.stat(routes_path()).st_mtime_ns
+    except FileNotFoundError:
+        _routes = _loaded_mtime = None
+        return None
+    if mtime != _loaded_mtime:
+        _routes = CampusRoutes(routes_path())
+        _loaded_mtime = mtime
+    return _routes
+
+
+def reset():
+    """Forget the loaded matrix so the next lookup maps the file again"""
+    global _routes, _loaded_mtime, _checked_at
+    _routes = _loaded_mtime = _checked_at = None
@@ -0,0 +1,155 @@
+"""
+Delivery demand heatmap for courier positioning.
+
+A periodic scheduler job folds new orders into DemandCell: one counter
+per resolved delivery area, pickup cafeteria and quarter hour of the
+week. Pre-orders and deferred orders count in the quarter hour they are
+due, the rest when they were placed. DemandProgress remembers the last
+order folded in, so each run only reads orders created since the
+previous one. Recommendations read the cells for the coming quarter
+hours, average them over the weeks of history and subtract the couriers
+already waiting in each area; raw orders are never queried on that
+path.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import DemandCell, DemandProgress
+
+BUCKET_MINUTES = 15
+BUCKETS_PER_DAY = 24 * 60 // BUCKET_MINUTES
+# Orders younger than this are left for the next run, so ones committing out of id order are not skipped
+SETTLE_SECONDS = 60
+BATCH_SIZE = 5000
+
+
+class DemandService:
+    """Precomputed demand matrix and the courier recommendation read from it"""
+
+    @staticmethod
+    def refresh_interval() -> int:
+        return getattr(settings, 'DEMAND_REFRESH_INTERVAL', 300)
+
+    @staticmethod
+    def lookahead_buckets() -> int:
+        return max(1, getattr(settings, 'DEMAND_LOOKAHEAD_MINUTES', 30) // BUCKET_MINUTES)
+
+    @staticmethod
+    def bucket_of(moment: datetime) -> Tuple[int, int]:
+        """(weekday, quarter hour of the day) in the local timezone"""
+        local = timezone.localtime(moment)
+        return local.weekday(), (local.hour * 60 + local.minute) // BUCKET_MINUTES
+
+    @staticmethod
+    def demand_at(order) -> datetime:
+        """When an order needs a courier: its pre-order slot or deferred release, else when it was placed"""
+        return order.requested_slot or order.release_at or order.created_at
+
+    @classmethod
+    def refresh(cls) -> int:
+        """Scheduler job: fold orders created since the last run into the matrix; returns how many were read"""
+        from orders.models import Order
+        from .services import DeliveryAssignmentService
+
+        folded = 0
+        while True:
+            with transaction.atomic():
+                progress, _ = DemandProgress.objects.select_for_update().get_or_create(pk=1)
+                # Orders rather than their 'pending' OrderEvent rows: the (vendor, ts) index only serves one vendor
+                # at a time, and the area, slot and status needed here live on the order anyway
+                orders = list(Order.objects.filter(
+                    id__gt=progress.last_order_id,
+                    created_at__lte=timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+                ).order_by('id').only(
+                    'id', 'vendor_id', 'delivery_address', 'status', 'created_at', 'release_at', 'requested_slot'
+                )[:BATCH_SIZE])
+                if not orders:
+                    return folded
+
+                counts = Counter()
+                for order in orders:
+                    areas = DeliveryAssignmentService.order_service_areas(order)
+                    if order.status == 'cancelled' or not areas:
+                        continue
+                    counts[cls.bucket_of(cls.demand_at(order)) + (areas[0], order.vendor_id)] += 1
+                for (weekday, bucket, area, vendor_id), count in counts.items():
+                    cell, created = DemandCell.objects.get_or_create(
+                        weekday=weekday, bucket=bucket, area=area, vendor_id=vendor_id, defaults={'orders': count}
+                    )
+                    if not created:
+                        DemandCell.objects.filter(pk=cell.pk).update(orders=F('orders') + count)
+
+                progress.last_order_id = orders[-1].id
+                if progress.first_order_at is None:
+                    progress.first_order_at = orders[0].created_at
+                progress.save()
+            folded += len(orders)
+            if len(orders) < BATCH_SIZE:
+                return folded
+
+    @classmethod
+    def upcoming_buckets(cls, now: datetime) -> List[Tuple[int, int]]:
+        weekday, bucket = cls.bucket_of(now)
+        upcoming = []
+        for offset in range(cls.lookahead_buckets()):
+            day, slot = divmod(bucket + offset, BUCKETS_PER_DAY)
+            upcoming.append(((weekday + day) % 7, slot))
+        return upcoming
+
+    @classmethod
+    def recommend(cls, delivery_person=None, now: Optional[datetime] = None) -> list:
+        """
+        Campus areas by expected orders over the lookahead minus the
+        couriers available there, best first. The asking courier does not
+        count towards the supply of their own area.
+        """
+        from users.models import Cafeteria
+        from .liveness import LivenessService
+        from .models import DeliveryPersonLocation
+        from .services import DeliveryAssignmentService
+
+        now = now or timezone.now()
+        progress = DemandProgress.objects.filter(pk=1).first()
+        if progress is None or progress.first_order_at is None:
+            return []
+        weeks = max(1.0, (now - progress.first_order_at) / timedelta(weeks=1))
+
+        slots = Q()
+        for weekday, bucket in cls.upcoming_buckets(now):
+            slots |= Q(weekday=weekday, bucket=bucket)
+        expected = defaultdict(float)
+        by_vendor = defaultdict(Counter)
+        for area, vendor_id, orders in DemandCell.objects.filter(slots).values_list('area', 'vendor_id', 'orders'):
+            expected[area] += orders / weeks
+            by_vendor[area][vendor_id] += orders
+
+        locations = list(DeliveryPersonLocation.objects.filter(
+            is_available=True, delivery_person__is_active=True
+        ).exclude(delivery_person=delivery_person))
+        stale = LivenessService.stale_couriers(location.delivery_person_id for location in locations)
+        supply = Counter(
+            DeliveryAssignmentService.courier_service_area(location)
+            for location in locations if location.delivery_person_id not in stale
+        )
+
+        cafeterias = dict(Cafeteria.objects.filter(
+            vendor_id__in={vendor_id for counts in by_vendor.values() for vendor_id in counts}
+        ).values_list('vendor_id', 'name'))
+        recommendations = [
+            {
+                'area': area,
+                'expected_orders': round(expected[area], 2),
+                'couriers': supply[area],
+                'score': round(expected[area] - supply[area], 2),
+                'cafeterias': [
+                    cafeterias[vendor_id] for vendor_id, _ in by_vendor[area].most_common(3) if vendor_id in cafeterias
+                ],
+            }
+            for area in expected
+        ]
+        recommendations.sort(key=lambda recommendation: recommendation['score'], reverse=True)
+        return recommendations
@@ -0,0 +1,108 @@
+"""
+Courier liveness from notification socket heartbeats.
+
+Each heartbeat stores its time in the Django cache, so liveness checks
+never touch the database. A courier is stale once their last beat is
+older than COURIER_HEARTBEAT_MISSES intervals. Couriers who never sent a
+beat are unknown rather than stale, because a cache restart shouldn't
+take everyone offline. The scheduler's periodic sweep flips stale
+couriers to unavailable in one UPDATE, and their next heartbeat flips
+them back unless they went unavailable by hand.
+"""
+import time
+from typing import Iterable, Set
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from irefuel_backend import metrics
+
+# Beats are kept well past the stale cutoff so a stale courier is still recognised as such
+BEAT_RETENTION = 24 * 60 * 60
+
+
+def _beat_key(user_id) -> str:
+    return f'liveness:courier:{user_id}'
+
+
+def _auto_off_key(user_id) -> str:
+    return f'liveness:auto_off:{user_id}'
+
+
+class LivenessService:
+    """Heartbeat table for couriers"""
+
+    @staticmethod
+    def heartbeat_interval() -> int:
+        return getattr(settings, 'COURIER_HEARTBEAT_INTERVAL', 15)
+
+    @classmethod
+    def stale_after(cls) -> int:
+        return cls.heartbeat_interval() * getattr(settings, 'COURIER_HEARTBEAT_MISSES', 3)
+
+    @staticmethod
+    def beat(user_id) -> bool:
+        """
+        Record a heartbeat. A courier the sweep took offline is made
+        available again; returns whether that happened.
+        """
+        cache.set(_beat_key(user_id), time.time(), BEAT_RETENTION)
+        if not cache.delete(_auto_off_key(user_id)):
+            return False
+
+        from .models import DeliveryPersonLocation
+        from .services import NotificationService
+
+        with transaction.atomic():
+            restored = DeliveryPersonLocation.objects.filter(
+                delivery_person_id=user_id, is_available=False
+            ).update(is_available=True)
+            if restored:
+                NotificationService.sync_offer_subscription(
+                    DeliveryPersonLocation.objects.select_related('delivery_person').get(
+                        delivery_person_id=user_id
+                    ).delivery_person
+                )
+        return bool(restored)
+
+    @staticmethod
+    def availability_set_by_hand(user_id, is_available: bool):
+        """A manual toggle wins over the sweep; going available counts as a heartbeat"""
+        cache.delete(_auto_off_key(user_id))
+        if is_available:
+            cache.set(_beat_key(user_id), time.time(), BEAT_RETENTION)
+
+    @classmethod
+    def stale_couriers(cls, user_ids: Iterable[int]) -> Set[int]:
+        """Couriers whose heartbeats stopped, in a single cache round trip"""
+        user_ids = list(user_ids)
+        beats = cache.get_many([_beat_key(user_id) for user_id in user_ids])
+        cutoff = time.time() - cls.stale_after()
+        return {
+            user_id for user_id in user_ids
+            if beats.get(_beat_key(user_id), cutoff) < cutoff
+        }
+
+    @classmethod
+    def sweep(cls) -> int:
+        """Scheduler job: flip every available courier with stale heartbeats to unavailable"""
+        from .models import DeliveryPersonLocation
+        from .services import NotificationService
+
+        available = DeliveryPersonLocation.objects.filter(is_available=True).values_list('delivery_person_id', flat=True)
+        stale = cls.stale_couriers(available)
+        if not stale:
+            return 0
+
+        with transaction.atomic():
+            locations = list(DeliveryPersonLocation.objects.select_related('delivery_person').filter(
+                delivery_person_id__in=stale, is_available=True
+            ))
+            DeliveryPersonLocation.objects.filter(
+                id__in=[location.id for location in locations], is_available=True
+            ).update(is_available=False)
+            cache.set_many({_auto_off_key(location.delivery_person_id): True for location in locations}, BEAT_RETENTION)
+            for location in locations:
+                NotificationService.sync_offer_subscription(location.delivery_person)
+
+        metrics.incr('couriers.auto_unavailable', len(locations))
+        return len(locations)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from delivery.campus_graph import rebuild, routes_path
+
+
+class Command(BaseCommand):
+    help = 'Precompute walking times between all campus nodes (also done on every graph change)'
+
+    def handle(self, *args, **options):
+        node_count = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Wrote {node_count}x{node_count} travel times to {routes_path()}'))
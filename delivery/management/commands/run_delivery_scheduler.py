@@ -0,0 +1,22 @@
+import asyncio
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+from delivery.scheduler import DeliveryScheduler
+from irefuel_backend.deployment import cache_is_shared, channel_layer_is_shared
+
+
+class Command(BaseCommand):
+    help = 'Expire dispatch holds and other delivery deadlines (run exactly one per deployment)'
+
+    def handle(self, *args, **options):
+        if not cache_is_shared():
+            # Heartbeats are written by the web workers; a local cache would never see them
+            raise CommandError('The delivery scheduler needs a cache shared with the web workers (CACHES).')
+        if not channel_layer_is_shared():
+            # Deadlines are announced by the web workers over the layer
+            raise CommandError('The delivery scheduler needs a channel layer shared with the web workers (CHANNEL_LAYERS).')
+        self.stdout.write(self.style.SUCCESS('Delivery scheduler running'))
+        try:
+            asyncio.run(DeliveryScheduler(get_channel_layer()).run())
+        except KeyboardInterrupt:
+            pass
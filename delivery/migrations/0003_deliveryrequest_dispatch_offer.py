@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-19 16:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryrequest',
+            name='offer_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryrequest',
+            name='passed_over',
+            field=models.ManyToManyField(blank=True, related_name='passed_delivery_requests', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 16:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0003_deliveryrequest_dispatch_offer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryrequest',
+            name='pickup_deadline',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
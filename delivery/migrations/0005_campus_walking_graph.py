@@ -0,0 +1,35 @@
+# Generated by Django 5.2.3 on 2026-10-19 16:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0004_deliveryrequest_pickup_deadline'),
+        ('orders', '0003_order_status_created_at_index'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CampusNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('cafeteria', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='campus_node', to='users.cafeteria')),
+                ('location', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='campus_node', to='orders.deliverylocation')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WalkingEdge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('travel_seconds', models.PositiveIntegerField(help_text='Walking time in seconds')),
+                ('bidirectional', models.BooleanField(default=True)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='edges_out', to='delivery.campusnode')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='edges_in', to='delivery.campusnode')),
+            ],
+        ),
+    ]
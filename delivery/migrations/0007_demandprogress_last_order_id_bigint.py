@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0006_demand_heatmap'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='demandprogress',
+            name='last_order_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
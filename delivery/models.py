@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth import get_user_model
-from orders.models import Order
+from orders.models import Order, DeliveryLocation
+from users.models import Cafeteria
 
 User = get_user_model()
 
@@ -20,6 +21,12 @@ class DeliveryRequest(models.Model):
     pickup_time = models.DateTimeField(null=True, blank=True)
     delivered_time = models.DateTimeField(null=True, blank=True)
     delivery_notes = models.TextField(blank=True, null=True)
+    # Set while the courier holds an unaccepted dispatch offer, see DispatchService
+    offer_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Couriers who declined or let the offer expire, skipped when it cascades
+    passed_over = models.ManyToManyField(User, blank=True, related_name='passed_delivery_requests')
+    # Set once accepted; past it the delivery is taken back, see ExpiryService
+    pickup_deadline = models.DateTimeField(null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -37,3 +44,52 @@ class DeliveryPersonLocation(models.Model):
 
     def __str__(self):
         return f"{self.delivery_person.username} - {self.campus_area} ({'Available' if self.is_available else 'Busy'})"
+
+
+class CampusNode(models.Model):
+    """A place on the campus walking graph: a delivery location, a cafeteria or a waypoint"""
+    name = models.CharField(max_length=100)
+    location = models.OneToOneField(DeliveryLocation, on_delete=models.CASCADE, null=True, blank=True, related_name='campus_node')
+    cafeteria = models.OneToOneField(Cafeteria, on_delete=models.CASCADE, null=True, blank=True, related_name='campus_node')
+
+    def __str__(self):
+        return self.name
+
+
+class WalkingEdge(models.Model):
+    """A walkable path between two campus nodes"""
+    source = models.ForeignKey(CampusNode, on_delete=models.CASCADE, related_name='edges_out')
+    target = models.ForeignKey(CampusNode, on_delete=models.CASCADE, related_name='edges_in')
+    travel_seconds = models.PositiveIntegerField(help_text="Walking time in seconds")
+    bidirectional = models.BooleanField(default=True)  # False for e.g. exit-only turnstiles
+
+    def __str__(self):
+        arrow = '<->' if self.bidirectional else '->'
+        return f"{self.source} {arrow} {self.target} ({self.travel_seconds}s)"
+
+
+class DemandCell(models.Model):
+    """Orders seen per delivery area, pickup cafeteria and quarter hour of the week, see delivery.demand"""
+    weekday = models.PositiveSmallIntegerField()  # Monday is 0
+    bucket = models.PositiveSmallIntegerField()  # Quarter hour of the day, 0-95
+    area = models.CharField(max_length=20)
+    vendor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='demand_cells', limit_choices_to={'user_type': 'vendor'})
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['weekday', 'bucket', 'area', 'vendor'], name='unique_demand_cell'),
+        ]
+
+    def __str__(self):
+        return f"{self.area} from {self.vendor.username}, day {self.weekday} bucket {self.bucket}: {self.orders}"
+
+
+class DemandProgress(models.Model):
+    """How far orders have been folded into DemandCell; a single row"""
+    last_order_id = models.PositiveBigIntegerField(default=0)
+    first_order_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Demand aggregated up to order #{self.last_order_id}"
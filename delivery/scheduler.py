@@ -0,0 +1,181 @@
+"""
+Deadline scheduler for timed order and delivery transitions (deferred
+orders, dispatch holds, unconfirmed orders, deliveries never picked up) and periodic
+sweeps such as courier liveness and the demand heatmap.
+
+Deadlines are kept in a heap by a single long-running process
+(``manage.py run_delivery_scheduler``) instead of being found by scanning
+tables on a timer. On start it loads the open deadlines once through each
+job's indexed query; afterwards web workers announce new deadlines over
+the channel layer on SCHEDULER_CHANNEL, so that layer must be shared
+between processes (Redis or the Unix socket broker). Job handlers re-check
+every deadline against the database, which makes stale and duplicate
+entries harmless.
+"""
+import asyncio
+import heapq
+import logging
+import time
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_CHANNEL = 'delivery-scheduler'
+# Seconds to wait before listening again after the channel layer failed
+RECEIVE_RETRY_DELAY = 1
+
+
+def jobs() -> dict:
+    """
+    Scheduled job kinds, mapped to (load, handle). ``load()`` yields
+    (object_id, deadline) pairs for every open deadline; ``handle(ids)``
+    processes a batch of due ids.
+    """
+    from orders.services import KitchenService
+    from .services import DispatchService, ExpiryService
+
+    return {
+        'order_release': (KitchenService.deferred_orders, KitchenService.release_orders),
+        'dispatch_offer': (DispatchService.open_holds, DispatchService.expire_offers),
+        'order_confirmation': (ExpiryService.unconfirmed_orders, ExpiryService.cancel_unconfirmed),
+        'delivery_pickup': (ExpiryService.stalled_pickups, ExpiryService.escalate_pickups),
+    }
+
+
+def periodic_jobs() -> dict:
+    """Jobs run every few seconds, mapped to (interval, handle)"""
+    from .demand import DemandService
+    from .liveness import LivenessService
+
+    return {
+        'liveness_sweep': (LivenessService.heartbeat_interval(), LivenessService.sweep),
+        'demand_refresh': (DemandService.refresh_interval(), DemandService.refresh),
+    }
+
+
+def schedule(kind: str, object_id: int, deadline):
+    """Tell the scheduler about a deadline once the current transaction commits"""
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+
+    message = {'type': 'schedule', 'kind': kind, 'id': object_id, 'deadline': deadline.timestamp()}
+
+    def send():
+        try:
+            async_to_sync(get_channel_layer().send)(SCHEDULER_CHANNEL, message)
+        except ChannelFull:
+            # No scheduler is draining the channel; it picks the deadline up from the table when it starts
+            logger.warning('Scheduler channel full, dropped %s %s', kind, object_id)
+
+    transaction.on_commit(send)
+
+
+class DeadlineHeap:
+    """
+    Min-heap of (deadline, kind, id). Rescheduling pushes a new entry and
+    leaves the old one in place; it is skipped when popped because it no
+    longer matches the latest deadline for that key.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def push(self, kind: str, object_id: int, deadline: float):
+        self._deadlines[(kind, object_id)] = deadline
+        heapq.heappush(self._heap, (deadline, kind, object_id))
+
+    def discard(self, kind: str, object_id: int):
+        self._deadlines.pop((kind, object_id), None)
+
+    def _drop_stale(self):
+        while self._heap:
+            deadline, kind, object_id = self._heap[0]
+            if self._deadlines.get((kind, object_id)) == deadline:
+                return
+            heapq.heappop(self._heap)
+
+    def next_deadline(self):
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> dict:
+        """Remove every entry due by now, as {kind: [ids]}"""
+        due = {}
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, kind, object_id = heapq.heappop(self._heap)
+            del self._deadlines[(kind, object_id)]
+            due.setdefault(kind, []).append(object_id)
+
+
+class DeliveryScheduler:
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.heap = DeadlineHeap()
+        self.changed = asyncio.Event()
+        self.jobs = jobs()
+        self.periodic = periodic_jobs()
+
+    def load(self):
+        for kind, (load, _) in self.jobs.items():
+            for object_id, deadline in load():
+                self.heap.push(kind, object_id, deadline.timestamp())
+        for kind, (interval, _) in self.periodic.items():
+            self.heap.push(kind, 0, time.time() + interval)
+
+    async def receive_deadlines(self):
+        while True:
+            try:
+                message = await self.channel_layer.receive(SCHEDULER_CHANNEL)
+                if message.get('kind') in self.jobs:
+                    self.heap.push(message['kind'], message['id'], message['deadline'])
+                    self.changed.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Deadlines announced meanwhile may be lost, so pick them up from the tables again
+                logger.exception('Receiving scheduler deadlines failed, reloading')
+                await asyncio.sleep(RECEIVE_RETRY_DELAY)
+                try:
+                    await database_sync_to_async(self.load)()
+                except Exception:
+                    logger.exception('Reloading scheduler deadlines failed')
+                self.changed.set()
+
+    async def run_due(self):
+        for kind, ids in self.heap.pop_due(time.time()).items():
+            if kind in self.periodic:
+                interval, handle = self.periodic[kind]
+                self.heap.push(kind, 0, time.time() + interval)
+                args = ()
+            else:
+                _, handle = self.jobs[kind]
+                args = (ids,)
+            try:
+                await database_sync_to_async(handle)(*args)
+            except Exception:
+                logger.exception('Scheduled %s failed for %s', kind, ids)
+
+    async def run(self):
+        await database_sync_to_async(self.load)()
+        receiver = asyncio.ensure_future(self.receive_deadlines())
+        try:
+            while True:
+                await self.run_due()
+                next_deadline = self.heap.next_deadline()
+                timeout = None if next_deadline is None else max(0, next_deadline - time.time())
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            receiver.cancel()
@@ -1,16 +1,32 @@
 """
 Services for delivery management
 """
+import asyncio
 import math
+from datetime import timedelta
 from typing import List, Optional
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models import F, Q
 from django.utils import timezone
+from . import campus_graph
+from .liveness import LivenessService
 from .models import DeliveryRequest, DeliveryPersonLocation
 from orders.models import Order
+from orders.services import OrderTimeline, SlotService
 
 User = get_user_model()
 
+# Keyword matching for campus areas
+CAMPUS_AREAS = {
+    'north': ['north', 'library', 'science', 'engineering'],
+    'south': ['south', 'sports', 'gym', 'stadium'],
+    'east': ['east', 'dormitory', 'hostel', 'residence'],
+    'west': ['west', 'cafeteria', 'dining', 'food'],
+    'central': ['central', 'admin', 'main', 'center']
+}
+
 
 class DeliveryAssignmentService:
     """Service for delivery assignment"""
@@ -19,7 +35,8 @@ class DeliveryAssignmentService:
     def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """
         Calculate distance between two points using Haversine formula
-        Returns distance in kilometers
+        Returns distance in kilometers. Straight-line only; prefer walking
+        times from delivery.campus_graph where the graph covers both places
         """
         R = 6371  # Earth's radius in kilometers
         
@@ -43,11 +60,14 @@ class DeliveryAssignmentService:
             is_active=True
         ).select_related('location_info')
         
+        # Couriers who closed the app, from the heartbeat table rather than the database
+        stale = LivenessService.stale_couriers(person.id for person in available_personnel)
+        
         suitable_personnel = []
         
         for person in available_personnel:
             # Check if they have location info
-            if not hasattr(person, 'location_info'):
+            if not hasattr(person, 'location_info') or person.id in stale:
                 continue
                 
             location_info = person.location_info
@@ -62,29 +82,133 @@ class DeliveryAssignmentService:
         
         return suitable_personnel
     
+    @staticmethod
+    def pick_courier(order: Order, candidates: List[User]) -> Optional[User]:
+        """
+        Closest courier by walking time to the order's cafeteria where the
+        campus graph knows both places, then the least busy one
+        """
+        routes = campus_graph.routes()
+        
+        def rank(person):
+            walk = routes.pickup_seconds(person.location_info, order) if routes else None
+            return (math.inf if walk is None else walk, person.location_info.current_orders_count)
+        
+        return min(candidates, key=rank, default=None)
+    
+    @staticmethod
+    def estimate_delivery_time(order: Order, delivery_person: User):
+        """Arrival time from walking times (courier to cafeteria to address), or the current estimate"""
+        routes = campus_graph.routes()
+        if routes is None:
+            return order.estimated_delivery_time
+        pickup = routes.pickup_seconds(delivery_person.location_info, order)
+        delivery = routes.delivery_seconds(order)
+        if pickup is None or delivery is None:
+            return order.estimated_delivery_time
+        return timezone.now() + timedelta(seconds=pickup + delivery)
+    
     @staticmethod
     def _is_in_service_area(delivery_person: User, order: Order) -> bool:
         """
         Check if delivery person serves the order's area
         This is a simplified version - can be enhanced with actual coordinates
         """
-        delivery_area = delivery_person.location_info.campus_area.lower()
+        area = DeliveryAssignmentService.courier_service_area(delivery_person.location_info)
+        if area is None:
+            return True  # Default to available if no specific area matching
+        return area in DeliveryAssignmentService.order_service_areas(order)
+    
+    @staticmethod
+    def courier_service_area(location_info: DeliveryPersonLocation) -> Optional[str]:
+        """The campus area a courier works, or None when they cover all of campus"""
+        delivery_area = location_info.campus_area.lower()
+        for area in CAMPUS_AREAS:
+            if area in delivery_area:
+                return area
+        return None
+    
+    @staticmethod
+    def order_service_areas(order: Order) -> List[str]:
+        """Campus areas whose keywords appear in the order's delivery address"""
         order_area = order.delivery_address.lower()
+        return [
+            area for area, keywords in CAMPUS_AREAS.items()
+            if any(keyword in order_area for keyword in keywords)
+        ]
+    
+    @staticmethod
+    def offer_group_name(area: Optional[str]) -> str:
+        return f'delivery_offers_{area or "any"}'
+    
+    @classmethod
+    def offer_groups(cls, order: Order) -> List[str]:
+        """Groups an offer for this order goes to: its areas plus couriers covering all of campus"""
+        return [cls.offer_group_name(area) for area in cls.order_service_areas(order)] + [cls.offer_group_name(None)]
+    
+    @staticmethod
+    def has_capacity(delivery_person: User, location_info: Optional[DeliveryPersonLocation]) -> bool:
+        """Whether a courier is available and below their max_orders"""
+        return (location_info is not None and delivery_person.is_available and location_info.is_available
+                and location_info.current_orders_count < location_info.max_orders)
+    
+    @classmethod
+    def offer_group_for(cls, delivery_person: User) -> Optional[str]:
+        """Offer group a courier should listen to, or None while they can't take more work"""
+        location_info = DeliveryPersonLocation.objects.filter(delivery_person=delivery_person).first()
+        if not cls.has_capacity(delivery_person, location_info):
+            return None
+        return cls.offer_group_name(cls.courier_service_area(location_info))
+    
+    @classmethod
+    def open_offers(cls, offer_group: str) -> List[Order]:
+        """Unclaimed orders ready for delivery that are offered to a group"""
+        orders = Order.objects.filter(
+            status='ready_for_delivery',
+            delivery_person__isnull=True
+        ).select_related('vendor').order_by('updated_at')
+        return [order for order in orders if offer_group in cls.offer_groups(order)]
+    
+    @classmethod
+    @transaction.atomic
+    def claim_order(cls, order: Order, delivery_person: User) -> bool:
+        """
+        Claim an unassigned order from the open feed for a courier with
+        spare capacity. The courier's row is locked so concurrent claims
+        can't overfill them, and the conditional UPDATE means only one
+        courier can win the order. The claim is an accepted delivery, so it
+        frees the slot the same way as a dispatched one.
+        """
+        from . import scheduler
         
-        # Keyword matching for campus areas
-        campus_areas = {
-            'north': ['north', 'library', 'science', 'engineering'],
-            'south': ['south', 'sports', 'gym', 'stadium'],
-            'east': ['east', 'dormitory', 'hostel', 'residence'],
-            'west': ['west', 'cafeteria', 'dining', 'food'],
-            'central': ['central', 'admin', 'main', 'center']
-        }
-        
-        for area, keywords in campus_areas.items():
-            if area in delivery_area:
-                return any(keyword in order_area for keyword in keywords)
+        location_info, _ = DeliveryPersonLocation.objects.select_for_update().get_or_create(
+            delivery_person=delivery_person,
+            defaults={'campus_area': 'Main Campus', 'is_available': True}
+        )
+        if not cls.has_capacity(delivery_person, location_info):
+            return False
+        claimed = Order.objects.filter(
+            id=order.id,
+            status='ready_for_delivery',
+            delivery_person__isnull=True
+        ).update(delivery_person=delivery_person, updated_at=timezone.now())
+        if not claimed:
+            return False
+        order.refresh_from_db()
         
-        return True  # Default to available if no specific area matching
+        pickup_deadline = timezone.now() + timedelta(seconds=ExpiryService.pickup_timeout())
+        delivery_request, _ = DeliveryRequest.objects.update_or_create(
+            order=order,
+            defaults={
+                'delivery_person': delivery_person, 'status': 'accepted',
+                'offer_expires_at': None, 'pickup_deadline': pickup_deadline
+            }
+        )
+        location_info.current_orders_count += 1
+        location_info.save()
+        NotificationService.sync_offer_subscription(delivery_person)
+        scheduler.schedule('delivery_pickup', delivery_request.id, pickup_deadline)
+        return True
     
     @classmethod
     @transaction.atomic
@@ -92,34 +216,41 @@ class DeliveryAssignmentService:
         """
         Assign a delivery person to an order
         """
+        from . import scheduler
+        
         if delivery_person is None:
             # Assign based on availability and location
             available_personnel = cls.find_available_delivery_personnel(order)
             if not available_personnel:
                 return None
             
-            # Select the person with the lowest current orders count
-            delivery_person = min(
-                available_personnel,
-                key=lambda p: p.location_info.current_orders_count
-            )
+            # Select the nearest person, then the one with the lowest current orders count
+            delivery_person = cls.pick_courier(order, available_personnel)
         
-        # Create delivery assignment
+        # Create delivery assignment, held until accepted like a dispatch offer
+        expires_at = timezone.now() + timedelta(seconds=DispatchService.offer_ttl())
         delivery_request = DeliveryRequest.objects.create(
             order=order,
             delivery_person=delivery_person,
-            status='pending'
+            status='pending',
+            offer_expires_at=expires_at
         )
+        scheduler.schedule('dispatch_offer', delivery_request.id, expires_at)
         
         # Update order status and assign delivery person
         order.delivery_person = delivery_person
         order.status = 'ready_for_delivery'
+        order.estimated_delivery_time = cls.estimate_delivery_time(order, delivery_person)
         order.save()
+        OrderTimeline.record(order, 'assigned', delivery_person)
+        NotificationService.notify_vendor_order(order)
+        NotificationService.retract_delivery_offer(order)
         
         # Update delivery person's current orders count
         location_info = delivery_person.location_info
         location_info.current_orders_count += 1
         location_info.save()
+        NotificationService.sync_offer_subscription(delivery_person)
         
         return delivery_request
     
@@ -138,11 +269,14 @@ class DeliveryAssignmentService:
         order.status = 'delivered'
         order.delivered_at = timezone.now()
         order.save()
+        OrderTimeline.record(order, 'delivered', delivery_request.delivery_person)
+        NotificationService.notify_vendor_order(order)
         
         # Decrease delivery person's current orders count
         location_info = delivery_request.delivery_person.location_info
         location_info.current_orders_count = max(0, location_info.current_orders_count - 1)
         location_info.save()
+        NotificationService.sync_offer_subscription(delivery_request.delivery_person)
         
         return True
     
@@ -168,67 +302,465 @@ class DeliveryAssignmentService:
         }
 
 
+class DispatchService:
+    """
+    Timed dispatch. An order is offered to one courier at a time, who holds
+    one of their max_orders slots until they accept or DISPATCH_OFFER_TTL
+    seconds pass. A decline or an expired hold frees the slot and cascades
+    the offer to the next best courier; once nobody is left the order goes
+    to the open offer feed. Holds are expired by delivery.scheduler.
+    """
+    
+    @staticmethod
+    def offer_ttl() -> int:
+        return getattr(settings, 'DISPATCH_OFFER_TTL', 45)
+    
+    @staticmethod
+    def next_candidate(order: Order, exclude_ids=()) -> Optional[User]:
+        """Nearest, then least busy, available courier for the order who hasn't passed on it yet"""
+        candidates = [
+            person for person in DeliveryAssignmentService.find_available_delivery_personnel(order)
+            if person.id not in exclude_ids
+        ]
+        return DeliveryAssignmentService.pick_courier(order, candidates)
+    
+    @classmethod
+    @transaction.atomic
+    def offer(cls, order: Order) -> Optional[DeliveryRequest]:
+        """Offer an order to the best courier, or return None when nobody can take it"""
+        delivery_person = cls.next_candidate(order)
+        if delivery_person is None:
+            return None
+        return cls.offer_to(order, delivery_person)
+    
+    @classmethod
+    @transaction.atomic
+    def offer_to(cls, order: Order, delivery_person: User) -> DeliveryRequest:
+        """Hold a slot of the courier's capacity for the order until they accept or the offer expires"""
+        from . import scheduler
+        
+        expires_at = timezone.now() + timedelta(seconds=cls.offer_ttl())
+        delivery_request, _ = DeliveryRequest.objects.update_or_create(
+            order=order,
+            defaults={'delivery_person': delivery_person, 'status': 'pending', 'offer_expires_at': expires_at}
+        )
+        order.delivery_person = delivery_person
+        order.estimated_delivery_time = DeliveryAssignmentService.estimate_delivery_time(order, delivery_person)
+        order.save()
+        OrderTimeline.record(order, 'assigned', delivery_person)
+        DeliveryPersonLocation.objects.filter(delivery_person=delivery_person).update(
+            current_orders_count=F('current_orders_count') + 1
+        )
+        
+        NotificationService.notify_vendor_order(order)
+        NotificationService.retract_delivery_offer(order)
+        NotificationService.sync_offer_subscription(delivery_person)
+        transaction.on_commit(lambda: NotificationService.notify_delivery_assignment(order))
+        scheduler.schedule('dispatch_offer', delivery_request.id, expires_at)
+        return delivery_request
+    
+    @staticmethod
+    def accept(delivery_request: DeliveryRequest) -> bool:
+        """Turn a held offer into an accepted delivery, unless the hold has already expired"""
+        from . import scheduler
+        
+        pickup_deadline = timezone.now() + timedelta(seconds=ExpiryService.pickup_timeout())
+        accepted = DeliveryRequest.objects.filter(
+            Q(offer_expires_at__isnull=True) | Q(offer_expires_at__gt=timezone.now()),
+            id=delivery_request.id,
+            delivery_person=delivery_request.delivery_person,
+            status='pending'
+        ).update(status='accepted', offer_expires_at=None, pickup_deadline=pickup_deadline)
+        if accepted:
+            delivery_request.status = 'accepted'
+            delivery_request.offer_expires_at = None
+            delivery_request.pickup_deadline = pickup_deadline
+            scheduler.schedule('delivery_pickup', delivery_request.id, pickup_deadline)
+        return bool(accepted)
+    
+    @classmethod
+    @transaction.atomic
+    def release(cls, delivery_request_id: int, delivery_person: User = None, expired_only: bool = False) -> bool:
+        """
+        Take an unaccepted offer back from its courier and cascade it. The
+        conditional UPDATE makes this safe to race against accept() and
+        against a second release of the same offer.
+        """
+        holds = DeliveryRequest.objects.filter(id=delivery_request_id, status='pending')
+        if delivery_person is not None:
+            holds = holds.filter(delivery_person=delivery_person)
+        if expired_only:
+            holds = holds.filter(offer_expires_at__lte=timezone.now())
+        if not holds.update(status='cancelled', offer_expires_at=None):
+            return False
+        cls.reassign(delivery_request_id)
+        return True
+    
+    @classmethod
+    @transaction.atomic
+    def reassign(cls, delivery_request_id: int):
+        """
+        Free the slot of a courier whose request was just taken away from them
+        and offer the order to the next courier, or to the open feed
+        """
+        delivery_request = DeliveryRequest.objects.select_related('order', 'delivery_person').get(id=delivery_request_id)
+        previous = delivery_request.delivery_person
+        DeliveryPersonLocation.objects.filter(delivery_person=previous, current_orders_count__gt=0).update(
+            current_orders_count=F('current_orders_count') - 1
+        )
+        delivery_request.passed_over.add(previous)
+        OrderTimeline.record(delivery_request.order, 'unassigned', previous)
+        NotificationService.sync_offer_subscription(previous)
+        NotificationService.notify_offer_withdrawn(delivery_request.order, previous.id)
+        
+        order = delivery_request.order
+        excluded = set(delivery_request.passed_over.values_list('id', flat=True))
+        delivery_person = cls.next_candidate(order, excluded)
+        if delivery_person is not None:
+            cls.offer_to(order, delivery_person)
+            return
+        
+        # Nobody left to ask: let any courier in the area claim it from the open feed
+        delivery_request.delete()
+        order.delivery_person = None
+        order.save()
+        NotificationService.notify_vendor_order(order)
+        NotificationService.publish_delivery_offer(order)
+    
+    @classmethod
+    def expire_offers(cls, delivery_request_ids) -> int:
+        """Scheduler job: cascade every offer in the batch whose hold has run out"""
+        return sum(cls.release(delivery_request_id, expired_only=True) for delivery_request_id in delivery_request_ids)
+    
+    @staticmethod
+    def open_holds():
+        """(id, expires_at) of every held offer, for the scheduler to load on start"""
+        return DeliveryRequest.objects.filter(
+            status='pending',
+            offer_expires_at__isnull=False
+        ).values_list('id', 'offer_expires_at')
+
+
+class ExpiryService:
+    """
+    Deadlines for work nobody moves forward. Orders a vendor hasn't
+    confirmed within ORDER_CONFIRMATION_TIMEOUT are cancelled, and accepted
+    deliveries not picked up within DELIVERY_PICKUP_TIMEOUT go back to
+    dispatch with the courier's slot freed. Both run as delivery.scheduler
+    jobs, so due items are handled in batches with one notification bridge.
+    """
+    
+    @staticmethod
+    def confirmation_timeout() -> int:
+        return getattr(settings, 'ORDER_CONFIRMATION_TIMEOUT', 900)
+    
+    @staticmethod
+    def pickup_timeout() -> int:
+        return getattr(settings, 'DELIVERY_PICKUP_TIMEOUT', 1800)
+    
+    @classmethod
+    def schedule_confirmation(cls, order: Order):
+        from . import scheduler
+        
+        # Deferred orders get the full timeout from when the vendor first sees them
+        received_at = order.release_at or order.created_at
+        scheduler.schedule('order_confirmation', order.id, received_at + timedelta(seconds=cls.confirmation_timeout()))
+    
+    @classmethod
+    def unconfirmed_orders(cls):
+        """(id, deadline) of every pending order, for the scheduler to load on start"""
+        timeout = timedelta(seconds=cls.confirmation_timeout())
+        for order_id, created_at, release_at in Order.objects.filter(status='pending').values_list(
+            'id', 'created_at', 'release_at'
+        ):
+            yield order_id, (release_at or created_at) + timeout
+    
+    @classmethod
+    @transaction.atomic
+    def cancel_unconfirmed(cls, order_ids) -> int:
+        """Scheduler job: cancel the orders in the batch still pending past their deadline"""
+        cutoff = timezone.now() - timedelta(seconds=cls.confirmation_timeout())
+        orders = list(Order.objects.select_for_update().filter(
+            Q(release_at__isnull=True, created_at__lte=cutoff) | Q(release_at__lte=cutoff),
+            id__in=order_ids, status='pending'
+        ))
+        if not orders:
+            return 0
+        
+        Order.objects.filter(id__in=[order.id for order in orders], status='pending').update(
+            status='cancelled', updated_at=timezone.now()
+        )
+        SlotService.cancel(orders)
+        OrderTimeline.record_many(orders, 'cancelled')
+        for order in orders:
+            order.status = 'cancelled'
+            NotificationService.notify_vendor_order(order)
+        transaction.on_commit(lambda: NotificationService.notify_orders_update(
+            orders, 'Your order was cancelled because the vendor did not confirm it in time.'
+        ))
+        return len(orders)
+    
+    @staticmethod
+    def stalled_pickups():
+        """(id, deadline) of every accepted delivery not yet picked up, for the scheduler to load on start"""
+        return DeliveryRequest.objects.filter(
+            status='accepted',
+            pickup_deadline__isnull=False
+        ).values_list('id', 'pickup_deadline')
+    
+    @classmethod
+    def escalate_pickups(cls, delivery_request_ids) -> int:
+        """Scheduler job: take back accepted deliveries whose courier never picked them up"""
+        order_ids = dict(DeliveryRequest.objects.filter(id__in=delivery_request_ids).values_list('id', 'order_id'))
+        escalated = []
+        for delivery_request_id in delivery_request_ids:
+            with transaction.atomic():
+                claimed = DeliveryRequest.objects.filter(
+                    id=delivery_request_id, status='accepted', pickup_deadline__lte=timezone.now()
+                ).update(status='cancelled', pickup_deadline=None)
+                if claimed:
+                    DispatchService.reassign(delivery_request_id)
+                    escalated.append(order_ids[delivery_request_id])
+        if escalated:
+            NotificationService.notify_orders_update(
+                Order.objects.filter(id__in=escalated),
+                'Your courier could not pick up the order, it is being passed to another courier.'
+            )
+        return len(escalated)
+
+
 class NotificationService:
     """Service for sending real-time notifications"""
     
     @staticmethod
-    def notify_order_update(order: Order, message: str):
-        """Send order update notification"""
+    def _build_events(user_ids, payload: dict) -> list:
+        """
+        Build the (group, event) pairs for one notification. Each user's copy
+        is stamped with their next sequence number and kept for replay, then
+        encoded once for every wire format and carried in the event, so
+        consumers don't re-serialize it per socket.
+        """
+        from chat.encoding import encode_frames
+        from chat.replay import ReplayBuffer
+        
+        events = []
+        for user_id in user_ids:
+            sequenced = ReplayBuffer.append(user_id, payload)
+            events.append((f'user_{user_id}', {**sequenced, 'frames': encode_frames(sequenced)}))
+        return events
+    
+    @staticmethod
+    async def _send_events(events: list):
+        """Send all group messages concurrently"""
         from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
         
         channel_layer = get_channel_layer()
+        await asyncio.gather(*(
+            channel_layer.group_send(group_name, event) for group_name, event in events
+        ))
+    
+    @classmethod
+    def _send_to_users(cls, user_ids, payload: dict):
+        """Sync entry point: crosses the sync/async bridge once per notification"""
+        from asgiref.sync import async_to_sync
         
-        # Tell all involved users
-        users_to_notify = [order.student, order.vendor]
-        if order.delivery_person:
-            users_to_notify.append(order.delivery_person)
+        async_to_sync(cls._send_events)(cls._build_events(user_ids, payload))
+    
+    @classmethod
+    async def _asend_to_users(cls, user_ids, payload: dict):
+        from asgiref.sync import sync_to_async
         
-        for user in users_to_notify:
-            async_to_sync(channel_layer.group_send)(
-                f'user_{user.id}',
-                {
-                    'type': 'order_update',
-                    'order_id': order.id,
-                    'status': order.status,
-                    'message': message
-                }
-            )
+        events = await sync_to_async(cls._build_events)(user_ids, payload)
+        await cls._send_events(events)
+    
+    @staticmethod
+    def _order_recipients(order: Order) -> list:
+        users_to_notify = [order.student_id, order.vendor_id]
+        if order.delivery_person_id:
+            users_to_notify.append(order.delivery_person_id)
+        return users_to_notify
     
     @staticmethod
-    def notify_new_message(chat_message):
+    def _order_update_payload(order: Order, message: str) -> dict:
+        return {
+            'type': 'order_update',
+            'order_id': order.id,
+            'status': order.status,
+            'message': message
+        }
+    
+    @classmethod
+    def notify_order_update(cls, order: Order, message: str):
+        """Send order update notification"""
+        # Tell all involved users
+        cls._send_to_users(cls._order_recipients(order), cls._order_update_payload(order, message))
+    
+    @classmethod
+    async def anotify_order_update(cls, order: Order, message: str):
+        """Async variant of notify_order_update for use inside consumers"""
+        await cls._asend_to_users(cls._order_recipients(order), cls._order_update_payload(order, message))
+    
+    @classmethod
+    def notify_orders_update(cls, orders, message: str):
+        """Send order updates for many orders in a single bridge, e.g. after batch dispatch"""
+        from asgiref.sync import async_to_sync
+        
+        events = []
+        for order in orders:
+            events.extend(cls._build_events(
+                cls._order_recipients(order), cls._order_update_payload(order, message)
+            ))
+        async_to_sync(cls._send_events)(events)
+    
+    @classmethod
+    def notify_new_message(cls, chat_message):
         """Send new message notification"""
-        from channels.layers import get_channel_layer
+        # Tell the receiver
+        cls._send_to_users([chat_message.receiver_id], {
+            'type': 'new_message',
+            'order_id': chat_message.order_id,
+            'sender_name': chat_message.sender.get_full_name(),
+            'message': chat_message.message[:50] + '...' if len(chat_message.message) > 50 else chat_message.message
+        })
+    
+    @classmethod
+    def notify_delivery_assignment(cls, order: Order):
+        """Send delivery assignment notification"""
+        if order.delivery_person_id:
+            cls._send_to_users([order.delivery_person_id], {
+                'type': 'delivery_request',
+                'order_id': order.id,
+                'location': order.delivery_address,
+                'amount': str(order.total_amount)
+            })
+
+    @classmethod
+    def notify_offer_withdrawn(cls, order: Order, user_id: int):
+        """Tell a courier a dispatch offer they didn't accept in time has moved on"""
+        transaction.on_commit(lambda: cls._send_to_users([user_id], {
+            'type': 'offer_retracted',
+            'order_id': order.id
+        }))
+
+    @classmethod
+    def notify_unread_update(cls, user_id: int, order_id: int):
+        """Push the current unread counters for an order to its user"""
+        from chat.models import UnreadCounter
+        
+        total, per_order = UnreadCounter.get_totals(user_id)
+        
+        cls._send_to_users([user_id], {
+            'type': 'unread_update',
+            'order_id': order_id,
+            'unread_count': per_order.get(order_id, 0),
+            'total_unread': total
+        })
+
+    @staticmethod
+    def _vendor_feed_version_key(vendor_id) -> str:
+        return f'vendor_feed:version:{vendor_id}'
+    
+    @classmethod
+    def vendor_feed_version(cls, vendor_id) -> int:
+        """Version of the last delta published to a vendor's live queue"""
+        from django.core.cache import cache
+        
+        return cache.get(cls._vendor_feed_version_key(vendor_id), 0)
+    
+    @classmethod
+    def notify_vendor_order(cls, order: Order, action: str = 'updated'):
+        """
+        Publish an order summary to the vendor's live queue (group
+        vendor_{id}) once the current transaction commits. Each delta
+        carries the vendor's next feed version; clients drop deltas that
+        are not newer than their snapshot and upsert the rest by order id.
+        """
         from asgiref.sync import async_to_sync
+        from django.core.cache import cache
+        from chat.encoding import encode_frames
+        from orders.serializers import OrderSummarySerializer
         
-        channel_layer = get_channel_layer()
+        summary = dict(OrderSummarySerializer(order).data)
         
-        # Tell the receiver
-        async_to_sync(channel_layer.group_send)(
-            f'user_{chat_message.receiver.id}',
-            {
-                'type': 'new_message',
-                'order_id': chat_message.order.id,
-                'sender_name': chat_message.sender.get_full_name(),
-                'message': chat_message.message[:50] + '...' if len(chat_message.message) > 50 else chat_message.message
+        def publish():
+            key = cls._vendor_feed_version_key(order.vendor_id)
+            cache.add(key, 0, timeout=None)
+            payload = {
+                'type': 'vendor_order',
+                'action': action,
+                'version': cache.incr(key),
+                'order_id': order.id,
+                'status': order.status,
+                'order': summary
             }
-        )
+            async_to_sync(cls._send_events)([
+                (f'vendor_{order.vendor_id}', {**payload, 'frames': encode_frames(payload)})
+            ])
+        
+        transaction.on_commit(publish)
+
+    @staticmethod
+    def _delivery_offer_payload(order: Order) -> dict:
+        return {
+            'type': 'delivery_offer',
+            'order_id': order.id,
+            'location': order.delivery_address,
+            'amount': str(order.total_amount),
+            'vendor_name': order.vendor.get_full_name()
+        }
+    
+    @classmethod
+    def _publish_to_offer_groups(cls, order: Order, payload: dict):
+        from asgiref.sync import async_to_sync
+        from chat.encoding import encode_frames
+        
+        event = {**payload, 'frames': encode_frames(payload)}
+        groups = DeliveryAssignmentService.offer_groups(order)
+        transaction.on_commit(lambda: async_to_sync(cls._send_events)([(group, event) for group in groups]))
+    
+    @classmethod
+    def publish_delivery_offer(cls, order: Order):
+        """Offer an unclaimed order to the couriers serving its area"""
+        cls._publish_to_offer_groups(order, cls._delivery_offer_payload(order))
     
+    @classmethod
+    def retract_delivery_offer(cls, order: Order):
+        """Withdraw an offer from every courier it was sent to, e.g. once it is claimed"""
+        cls._publish_to_offer_groups(order, {'type': 'offer_retracted', 'order_id': order.id})
+    
+    @classmethod
+    def sync_offer_subscription(cls, delivery_person: User):
+        """
+        Move a courier's sockets to the offer group matching their area,
+        or out of every offer group while they are unavailable or full
+        """
+        from asgiref.sync import async_to_sync
+        
+        group = DeliveryAssignmentService.offer_group_for(delivery_person)
+        transaction.on_commit(lambda: async_to_sync(cls._send_events)([
+            (f'user_{delivery_person.id}', {'type': 'offers.subscription', 'group': group})
+        ]))
+
     @staticmethod
-    def notify_delivery_assignment(order: Order):
-        """Send delivery assignment notification"""
-        from channels.layers import get_channel_layer
+    def notify_courier_location(location_info):
+        """Publish a courier's location to the streams of their active orders"""
         from asgiref.sync import async_to_sync
         
-        channel_layer = get_channel_layer()
+        active_order_ids = Order.objects.filter(
+            delivery_person_id=location_info.delivery_person_id,
+            status__in=['ready_for_delivery', 'out_for_delivery']
+        ).values_list('id', flat=True)
         
-        if order.delivery_person:
-            async_to_sync(channel_layer.group_send)(
-                f'user_{order.delivery_person.id}',
+        async_to_sync(NotificationService._send_events)([
+            (
+                f'courier_location_order_{order_id}',
                 {
-                    'type': 'delivery_request',
-                    'order_id': order.id,
-                    'location': order.delivery_address,
-                    'amount': str(order.total_amount)
+                    'type': 'courier_location',
+                    'order_id': order_id,
+                    'delivery_person_id': location_info.delivery_person_id,
+                    'campus_area': location_info.campus_area,
+                    'is_available': location_info.is_available
                 }
             )
+            for order_id in active_order_ids
+        ])
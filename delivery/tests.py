@@ -1,11 +1,27 @@
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.core.cache import cache
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
+import asyncio
+import os
+import tempfile
+import time
+from unittest import mock
+from datetime import timedelta
 from decimal import Decimal
-from .models import DeliveryRequest, DeliveryPersonLocation
-from .services import DeliveryAssignmentService
-from orders.models import Order
+from .models import DeliveryRequest, DeliveryPersonLocation, CampusNode, WalkingEdge, DemandCell
+from . import campus_graph
+from .demand import DemandService
+from .liveness import LivenessService, _beat_key
+from .scheduler import DeadlineHeap, DeliveryScheduler
+from .services import DeliveryAssignmentService, DispatchService, ExpiryService, NotificationService
+from orders.models import Order, DeliveryLocation
 from users.models import Cafeteria
 
 User = get_user_model()
@@ -154,6 +170,38 @@ class DeliveryTestCase(TestCase):
         self.assertIn('current_orders', response.data)
         self.assertIn('is_available', response.data)
 
+    def test_demand_heatmap_recommends_underserved_area(self):
+        """Test that new orders are folded into the matrix once and drive the courier recommendation"""
+        for _ in range(3):
+            Order.objects.create(
+                student=self.student, vendor=self.vendor, total_amount=Decimal('4.00'),
+                delivery_address='South Campus Gym', estimated_preparation_time=10
+            )
+        # A pre-order counts in the quarter hour of its slot
+        placed = timezone.now() - timedelta(weeks=1)
+        slot = placed + timedelta(hours=3)
+        Order.objects.create(
+            student=self.student, vendor=self.vendor, total_amount=Decimal('4.00'),
+            delivery_address='South Campus Gym', estimated_preparation_time=10, requested_slot=slot
+        )
+        Order.objects.update(created_at=placed)
+        self.assertEqual(DemandService.refresh(), 5)
+        self.assertEqual(DemandService.refresh(), 0)
+        self.assertEqual(
+            sorted(DemandCell.objects.filter(area='south').values_list('weekday', 'bucket', 'orders')),
+            sorted([DemandService.bucket_of(placed) + (3,), DemandService.bucket_of(slot) + (1,)])
+        )
+
+        courier = User.objects.create_user(username='delivery2', password='testpass123', user_type='delivery')
+        DeliveryPersonLocation.objects.create(delivery_person=courier, campus_area='South Campus')
+        self.client.force_authenticate(user=self.delivery_person)
+        response = self.client.get('/api/delivery/recommendation/')
+        self.assertEqual(response.data['recommended_area'], 'south')
+        self.assertEqual(
+            [(area['area'], area['expected_orders'], area['couriers'], area['cafeterias']) for area in response.data['areas']],
+            [('south', 3.0, 1, ['Test Cafeteria']), ('north', 1.0, 0, ['Test Cafeteria'])]
+        )
+
 
 class DeliveryAssignmentServiceTestCase(TestCase):
     def setUp(self):
@@ -254,3 +302,328 @@ class DeliveryAssignmentServiceTestCase(TestCase):
         location_info = self.delivery_person1.location_info
         location_info.refresh_from_db()
         self.assertEqual(location_info.current_orders_count, 0)
+
+    def test_offer_feed_reaches_area_couriers_and_is_retracted_on_claim(self):
+        """Test that offers go to available couriers in the order's area and are withdrawn once claimed"""
+        south_courier = User.objects.create_user(username='delivery3', password='testpass123', user_type='delivery')
+        DeliveryPersonLocation.objects.create(delivery_person=south_courier, campus_area='South Campus')
+        location_info = self.delivery_person2.location_info
+        location_info.current_orders_count = location_info.max_orders
+        location_info.save()
+
+        self.assertEqual(DeliveryAssignmentService.offer_group_for(self.delivery_person1), 'delivery_offers_north')
+        self.assertEqual(DeliveryAssignmentService.offer_group_for(south_courier), 'delivery_offers_south')
+        self.assertIsNone(DeliveryAssignmentService.offer_group_for(self.delivery_person2))
+        self.assertEqual(DeliveryAssignmentService.open_offers('delivery_offers_north'), [self.order])
+        self.assertEqual(DeliveryAssignmentService.open_offers('delivery_offers_south'), [])
+
+        channel_layer = get_channel_layer()
+        channels = {}
+        for group in ('delivery_offers_north', 'delivery_offers_south'):
+            channels[group] = async_to_sync(channel_layer.new_channel)()
+            async_to_sync(channel_layer.group_add)(group, channels[group])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationService.publish_delivery_offer(self.order)
+        offer = async_to_sync(channel_layer.receive)(channels['delivery_offers_north'])
+        self.assertEqual((offer['type'], offer['order_id'], offer['amount']), ('delivery_offer', self.order.id, '15.99'))
+
+        # The claim takes courier 1's last slot, which moves them out of the offer groups
+        location_info = self.delivery_person1.location_info
+        location_info.max_orders = 2
+        location_info.save()
+        courier_channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(f'user_{self.delivery_person1.id}', courier_channel)
+
+        client = APIClient()
+        client.force_authenticate(user=self.delivery_person1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(f'/api/orders/{self.order.id}/accept-delivery/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        retracted = async_to_sync(channel_layer.receive)(channels['delivery_offers_north'])
+        self.assertEqual((retracted['type'], retracted['order_id']), ('offer_retracted', self.order.id))
+        self.assertEqual(DeliveryAssignmentService.open_offers('delivery_offers_north'), [])
+        location_info.refresh_from_db()
+        self.assertEqual(location_info.current_orders_count, 2)
+        self.assertEqual(DeliveryRequest.objects.get(order=self.order).status, 'accepted')
+        subscription = async_to_sync(channel_layer.receive)(courier_channel)
+        self.assertEqual((subscription['type'], subscription['group']), ('offers.subscription', None))
+
+        client.force_authenticate(user=south_courier)
+        response = client.patch(f'/api/orders/{self.order.id}/accept-delivery/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # A full courier can't claim more from the feed
+        second = Order.objects.create(
+            student=self.student, vendor=self.vendor, total_amount=Decimal('9.99'),
+            delivery_address='North Campus Dorm B', status='ready_for_delivery', estimated_preparation_time=20
+        )
+        client.force_authenticate(user=self.delivery_person1)
+        response = client.patch(f'/api/orders/{second.id}/accept-delivery/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('as many deliveries', response.data['error'])
+        second.refresh_from_db()
+        self.assertIsNone(second.delivery_person)
+
+    def test_dispatch_offer_cascades_on_expiry_and_decline(self):
+        """Test that an unaccepted offer moves to the next courier and finally to the open feed"""
+        with self.captureOnCommitCallbacks(execute=True):
+            delivery_request = DispatchService.offer(self.order)
+        self.assertEqual(delivery_request.delivery_person, self.delivery_person2)
+        self.assertEqual(DeliveryPersonLocation.objects.get(delivery_person=self.delivery_person2).current_orders_count, 1)
+        self.assertEqual(DispatchService.expire_offers([delivery_request.id]), 0)
+
+        # The hold runs out before courier 2 accepts
+        DeliveryRequest.objects.filter(id=delivery_request.id).update(offer_expires_at=timezone.now())
+        self.assertFalse(DispatchService.accept(delivery_request))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(DispatchService.expire_offers([delivery_request.id]), 1)
+        delivery_request.refresh_from_db()
+        self.assertEqual((delivery_request.delivery_person, delivery_request.status), (self.delivery_person1, 'pending'))
+        counts = dict(DeliveryPersonLocation.objects.values_list('delivery_person', 'current_orders_count'))
+        self.assertEqual(counts, {self.delivery_person1.id: 2, self.delivery_person2.id: 0})
+
+        # Courier 1 declines and nobody else is left
+        client = APIClient()
+        client.force_authenticate(user=self.delivery_person1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(
+                f'/api/delivery/requests/{delivery_request.id}/status/', {'status': 'cancelled'}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(DeliveryRequest.objects.filter(id=delivery_request.id).exists())
+        self.order.refresh_from_db()
+        self.assertIsNone(self.order.delivery_person)
+        self.assertEqual(DeliveryPersonLocation.objects.get(delivery_person=self.delivery_person1).current_orders_count, 1)
+
+    def test_decline_after_the_hold_moved_on_is_rejected(self):
+        """Test that declining a hold which expired to another courier mid-request is not reported as declined"""
+        with self.captureOnCommitCallbacks(execute=True):
+            delivery_request = DispatchService.offer(self.order)
+        self.assertEqual(delivery_request.delivery_person, self.delivery_person2)
+        DeliveryRequest.objects.filter(id=delivery_request.id).update(offer_expires_at=timezone.now())
+        release = DispatchService.release
+
+        def expire_first(*args, **kwargs):
+            # The scheduler expires the hold between the ownership check and the decline
+            if not kwargs.get('expired_only'):
+                DispatchService.expire_offers([delivery_request.id])
+            return release(*args, **kwargs)
+
+        client = APIClient()
+        client.force_authenticate(user=self.delivery_person2)
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch.object(DispatchService, 'release', side_effect=expire_first):
+            response = client.patch(
+                f'/api/delivery/requests/{delivery_request.id}/status/', {'status': 'cancelled'}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'error': 'This delivery offer is no longer yours to decline.'})
+        delivery_request.refresh_from_db()
+        self.assertEqual((delivery_request.delivery_person, delivery_request.status), (self.delivery_person1, 'pending'))
+
+    def test_scheduler_loads_holds_and_expires_due_batch(self):
+        """Test the deadline heap ordering and that the scheduler expires only due holds"""
+        heap = DeadlineHeap()
+        heap.push('dispatch_offer', 1, 30.0)
+        heap.push('dispatch_offer', 2, 10.0)
+        heap.push('dispatch_offer', 1, 5.0)  # rescheduled earlier, the old entry is skipped
+        self.assertEqual(heap.next_deadline(), 5.0)
+        self.assertEqual(heap.pop_due(20.0), {'dispatch_offer': [1, 2]})
+        self.assertEqual((len(heap), heap.next_deadline()), (0, None))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            delivery_request = DispatchService.offer(self.order)
+        DeliveryRequest.objects.filter(id=delivery_request.id).update(offer_expires_at=timezone.now())
+
+        scheduler = DeliveryScheduler(get_channel_layer())
+        scheduler.load()
+        self.assertEqual(len(scheduler.heap), 3)  # the hold and the periodic liveness and demand jobs
+        async_to_sync(scheduler.run_due)()
+        delivery_request.refresh_from_db()
+        self.assertEqual(delivery_request.delivery_person, self.delivery_person1)
+        self.assertEqual(len(scheduler.heap), 2)
+
+        # A failing layer is logged and the listener keeps going after reloading from the tables
+        class FlakyLayer:
+            def __init__(self):
+                self.calls = 0
+
+            async def receive(self, channel):
+                self.calls += 1
+                if self.calls == 1:
+                    raise ConnectionError('broker went away')
+                if self.calls == 2:
+                    return {'type': 'schedule', 'kind': 'dispatch_offer', 'id': 99, 'deadline': 1.0}
+                await asyncio.Event().wait()
+
+        async def listen():
+            scheduler.channel_layer = FlakyLayer()
+            listener = asyncio.ensure_future(scheduler.receive_deadlines())
+            while scheduler.channel_layer.calls < 3:
+                await asyncio.sleep(0.01)
+            listener.cancel()
+
+        with mock.patch('delivery.scheduler.RECEIVE_RETRY_DELAY', 0), self.assertLogs('delivery.scheduler', 'ERROR'):
+            async_to_sync(listen)()
+        self.assertEqual(scheduler.heap.pop_due(1.0), {'dispatch_offer': [99]})
+
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}), \
+                self.assertRaisesMessage(CommandError, 'channel layer shared with the web workers'):
+            call_command('run_delivery_scheduler')
+
+    def test_expiry_cancels_unconfirmed_orders_in_one_batch(self):
+        """Test that only orders pending past the confirmation timeout are cancelled, with notifications"""
+        stale, fresh = [
+            Order.objects.create(
+                student=self.student, vendor=self.vendor, total_amount=Decimal('4.00'),
+                delivery_address='North Campus', estimated_preparation_time=10
+            )
+            for _ in range(2)
+        ]
+        Order.objects.filter(id=stale.id).update(
+            created_at=timezone.now() - timedelta(seconds=ExpiryService.confirmation_timeout() + 1)
+        )
+        self.assertEqual(sorted(order_id for order_id, _ in ExpiryService.unconfirmed_orders()), [stale.id, fresh.id])
+
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(f'user_{self.student.id}', channel)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(ExpiryService.cancel_unconfirmed([stale.id, fresh.id]), 1)
+
+        self.assertEqual(Order.objects.get(id=stale.id).status, 'cancelled')
+        self.assertEqual(Order.objects.get(id=fresh.id).status, 'pending')
+        event = async_to_sync(channel_layer.receive)(channel)
+        self.assertEqual((event['order_id'], event['status']), (stale.id, 'cancelled'))
+
+    def test_expiry_escalates_deliveries_never_picked_up(self):
+        """Test that an accepted delivery past its pickup deadline frees the courier and is re-dispatched"""
+        with self.captureOnCommitCallbacks(execute=True):
+            delivery_request = DispatchService.offer(self.order)
+            self.assertTrue(DispatchService.accept(delivery_request))
+        self.assertEqual([request_id for request_id, _ in ExpiryService.stalled_pickups()], [delivery_request.id])
+
+        DeliveryRequest.objects.filter(id=delivery_request.id).update(pickup_deadline=timezone.now())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(ExpiryService.escalate_pickups([delivery_request.id]), 1)
+            self.assertEqual(ExpiryService.escalate_pickups([delivery_request.id]), 0)
+
+        delivery_request.refresh_from_db()
+        self.assertEqual((delivery_request.delivery_person, delivery_request.status), (self.delivery_person1, 'pending'))
+        self.assertEqual(DeliveryPersonLocation.objects.get(delivery_person=self.delivery_person2).current_orders_count, 0)
+
+    def test_missed_heartbeats_take_courier_offline_until_next_beat(self):
+        """Test that the matcher skips stale couriers and the sweep flips them unavailable in bulk"""
+        cache.clear()
+        LivenessService.beat(self.delivery_person2.id)
+        cache.set(_beat_key(self.delivery_person1.id), time.time() - LivenessService.stale_after() - 1)
+
+        with self.assertNumQueries(1):
+            available = DeliveryAssignmentService.find_available_delivery_personnel(self.order)
+        self.assertEqual(available, [self.delivery_person2])
+
+        self.assertEqual(LivenessService.sweep(), 1)
+        self.assertEqual(LivenessService.sweep(), 0)
+        location_info = DeliveryPersonLocation.objects.get(delivery_person=self.delivery_person1)
+        self.assertFalse(location_info.is_available)
+
+        self.assertTrue(LivenessService.beat(self.delivery_person1.id))
+        location_info.refresh_from_db()
+        self.assertTrue(location_info.is_available)
+        self.assertFalse(LivenessService.beat(self.delivery_person1.id))
+
+        # The sweep runs in its own process and would never see beats in a local cache
+        with self.assertRaisesMessage(CommandError, 'shared with the web workers'):
+            call_command('run_delivery_scheduler')
+
+    def test_campus_graph_travel_times_drive_matching_and_eta(self):
+        """Test the precomputed walking matrix and that the nearest courier wins over the least busy one"""
+        cafeteria = Cafeteria.objects.create(
+            name='Main Cafeteria', vendor=self.vendor, location='Campus Center',
+            phone_number='1234567890', opening_time='08:00:00', closing_time='20:00:00'
+        )
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                override_settings(CAMPUS_ROUTES_PATH=os.path.join(tmpdir, 'routes.bin')):
+            campus_graph.reset()
+            with self.captureOnCommitCallbacks(execute=True) as rebuilds:
+                kitchen = CampusNode.objects.create(name='Main Cafeteria', cafeteria=cafeteria)
+                bridge = CampusNode.objects.create(name='Bridge')
+                north = CampusNode.objects.create(
+                    name='North', location=DeliveryLocation.objects.create(name='North Campus')
+                )
+                library = CampusNode.objects.create(name='Library')
+                WalkingEdge.objects.create(source=kitchen, target=bridge, travel_seconds=120)
+                WalkingEdge.objects.create(source=bridge, target=north, travel_seconds=60)
+                WalkingEdge.objects.create(source=library, target=kitchen, travel_seconds=900, bidirectional=False)
+            self.assertEqual(len(rebuilds), 1)
+
+            routes = campus_graph.routes()
+            self.assertEqual(routes.delivery_seconds(self.order), 180)
+            self.assertEqual(routes.seconds(routes.node_for_place('library'), routes.node_for_vendor(self.vendor.id)), 900)
+            self.assertIsNone(routes.seconds(routes.node_for_vendor(self.vendor.id), routes.node_for_place('library')))
+
+            # Courier 2 is less busy but a long walk away
+            DeliveryPersonLocation.objects.filter(delivery_person=self.delivery_person2).update(campus_area='North Library')
+            with self.captureOnCommitCallbacks(execute=True):
+                delivery_request = DispatchService.offer(self.order)
+            self.assertEqual(delivery_request.delivery_person, self.delivery_person1)
+            self.order.refresh_from_db()
+            eta = (self.order.estimated_delivery_time - timezone.now()).total_seconds()
+            self.assertAlmostEqual(eta, 360, delta=5)
+
+            # Deleting the location cascades to its node and edges without calling their delete()
+            with self.captureOnCommitCallbacks(execute=True) as rebuilds:
+                DeliveryLocation.objects.filter(name='North Campus').delete()
+            self.assertEqual(len(rebuilds), 1)
+            self.assertIsNone(campus_graph.routes().node_for_place('north campus'))
+        campus_graph.reset()
+
+
+class NotificationServiceTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user(
+            username='student1',
+            password='testpass123',
+            user_type='student'
+        )
+        self.vendor = User.objects.create_user(
+            username='vendor1',
+            password='testpass123',
+            user_type='vendor'
+        )
+        self.orders = [
+            Order.objects.create(
+                student=self.student,
+                vendor=self.vendor,
+                total_amount=Decimal('5.00'),
+                delivery_address='North Campus Dorm A',
+                status='ready_for_delivery',
+                estimated_preparation_time=10
+            )
+            for _ in range(2)
+        ]
+
+    def test_bulk_order_update_reaches_every_recipient(self):
+        """Test that the bulk variant fans out to all users of all orders in one go"""
+        channel_layer = get_channel_layer()
+
+        async def listen():
+            channels = {}
+            for user in (self.student, self.vendor):
+                channels[user.id] = await channel_layer.new_channel()
+                await channel_layer.group_add(f'user_{user.id}', channels[user.id])
+            return channels
+
+        async def drain(channel_name, count):
+            return [await channel_layer.receive(channel_name) for _ in range(count)]
+
+        channels = async_to_sync(listen)()
+        NotificationService.notify_orders_update(self.orders, 'Dispatched')
+
+        for user_id, channel_name in channels.items():
+            events = async_to_sync(drain)(channel_name, 2)
+            self.assertEqual([e['order_id'] for e in events], [o.id for o in self.orders])
+            self.assertEqual([e['seq'] for e in events], [1, 2])
+            self.assertTrue(all(e['message'] == 'Dispatched' for e in events))
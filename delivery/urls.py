@@ -12,6 +12,7 @@ urlpatterns = [
     # Delivery personnel management
     path('location/', views.DeliveryPersonLocationView.as_view(), name='delivery-person-location'),
     path('availability/toggle/', views.toggle_availability, name='toggle-availability'),
+    path('recommendation/', views.positioning_recommendation, name='positioning-recommendation'),
     
     # For vendors to find nearby delivery personnel
     path('nearby/', views.NearbyDeliveryPersonnelView.as_view(), name='nearby-delivery-personnel'),
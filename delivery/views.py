@@ -11,8 +11,11 @@ from .serializers import (
     DeliveryRequestSerializer, DeliveryStatusUpdateSerializer,
     DeliveryPersonLocationSerializer, DeliveryPersonAvailabilitySerializer
 )
-from .services import DeliveryAssignmentService, NotificationService
+from .demand import DemandService
+from .liveness import LivenessService
+from .services import DeliveryAssignmentService, DispatchService, NotificationService
 from orders.models import Order
+from orders.services import OrderTimeline
 
 User = get_user_model()
 
@@ -60,16 +63,34 @@ def update_delivery_status(request, delivery_id):
     
     # Update timestamps based on status
     new_status = serializer.validated_data.get('status')
-    if new_status == 'picked_up':
+    if new_status == 'accepted':
+        if not DispatchService.accept(delivery_request):
+            return Response(
+                {'error': 'This delivery offer has expired.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    elif new_status == 'cancelled':
+        # Declining frees the courier's slot and passes the offer on
+        if not DispatchService.release(delivery_request.id, delivery_person=request.user):
+            return Response(
+                {'error': 'This delivery offer is no longer yours to decline.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'message': 'Delivery declined'})
+    elif new_status == 'picked_up':
         delivery_request.pickup_time = timezone.now()
+        delivery_request.pickup_deadline = None
     elif new_status == 'delivered':
         delivery_request.delivered_time = timezone.now()
         # Also update the main order status
         delivery_request.order.status = 'delivered'
         delivery_request.order.delivered_at = timezone.now()
         delivery_request.order.save()
+        NotificationService.notify_vendor_order(delivery_request.order)
     
     serializer.save()
+    if new_status in ('accepted', 'picked_up', 'delivered'):
+        OrderTimeline.record(delivery_request.order, new_status, request.user)
     
     return Response({
         'message': f'Delivery status updated to {new_status}',
@@ -91,6 +112,11 @@ class DeliveryPersonLocationView(generics.RetrieveUpdateAPIView):
         )
         return location_info
 
+    def perform_update(self, serializer):
+        location_info = serializer.save()
+        NotificationService.notify_courier_location(location_info)
+        NotificationService.sync_offer_subscription(self.request.user)
+
 
 @api_view(['PATCH'])
 @permission_classes([permissions.IsAuthenticated])
@@ -106,6 +132,8 @@ def toggle_availability(request):
     # Toggle the availability
     location_info.is_available = not location_info.is_available
     location_info.save()
+    LivenessService.availability_set_by_hand(request.user.id, location_info.is_available)
+    NotificationService.sync_offer_subscription(request.user)
     
     return Response({
         'message': f'Availability updated to {"available" if location_info.is_available else "unavailable"}',
@@ -113,6 +141,23 @@ def toggle_availability(request):
     })
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def positioning_recommendation(request):
+    """
+    Where to wait between jobs: campus areas ranked by expected demand
+    over the next few quarter hours minus couriers already there
+    """
+    if request.user.user_type != 'delivery':
+        raise PermissionDenied("Only delivery personnel can get positioning recommendations.")
+    
+    areas = DemandService.recommend(request.user)
+    return Response({
+        'recommended_area': areas[0]['area'] if areas else None,
+        'areas': areas
+    })
+
+
 class NearbyDeliveryPersonnelView(generics.ListAPIView):
     serializer_class = DeliveryPersonLocationSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -141,6 +186,12 @@ def assign_delivery_person(request, order_id):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    if order.delivery_person_id is not None:
+        return Response(
+            {'error': 'This order has already been assigned to a delivery person.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
     delivery_person_id = request.data.get('delivery_person_id')
     if not delivery_person_id:
         return Response(
@@ -158,20 +209,8 @@ def assign_delivery_person(request, order_id):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Create delivery assignment
-    delivery_request = DeliveryRequest.objects.create(
-        order=order,
-        delivery_person=delivery_person,
-        status='pending'
-    )
-    
-    # Update order
-    order.delivery_person = delivery_person
-    order.save()
-    
-    # Update delivery person's current orders count
-    location_info.current_orders_count += 1
-    location_info.save()
+    # Hold the courier's slot until they accept, cascading to others if they don't
+    delivery_request = DispatchService.offer_to(order, delivery_person)
     
     return Response({
         'message': 'Delivery person assigned successfully',
@@ -199,12 +238,17 @@ def auto_assign_delivery(request, order_id):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    delivery_request = DeliveryAssignmentService.assign_delivery_person(order)
+    if order.delivery_person_id is not None:
+        return Response(
+            {'error': 'This order has already been assigned to a delivery person'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    delivery_request = DispatchService.offer(order)
     
     if delivery_request:
-        NotificationService.notify_delivery_assignment(order)
         return Response({
-            'message': 'Delivery person assigned successfully',
+            'message': 'Delivery offered to the best available courier',
             'delivery_request': DeliveryRequestSerializer(delivery_request).data
         })
     else:
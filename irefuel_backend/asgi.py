@@ -10,16 +10,21 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from chat.drain import lifespan
+from chat.middleware import JWTAuthMiddlewareStack
 from chat.routing import websocket_urlpatterns
+from irefuel_backend.deployment import check_shared_state
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'irefuel_backend.settings')
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "websocket": JWTAuthMiddlewareStack(
         URLRouter(
             websocket_urlpatterns
         )
     ),
+    "lifespan": lifespan,
 })
+
+check_shared_state()
@@ -0,0 +1,38 @@
+"""
+Checks that state meant to be shared between processes really is.
+
+Notification sequence numbers, presence, vendor feed versions, waiting
+room buckets and courier heartbeats live in the Django cache, and web
+workers reach each other and the delivery scheduler over the channel
+layer. A process-local cache or layer silently splits that state as soon
+as there is more than one process, so multi-process setups refuse to
+start on one.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+PROCESS_LOCAL_LAYERS = (
+    'channels.layers.InMemoryChannelLayer',
+)
+
+
+def cache_is_shared() -> bool:
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES
+
+
+def channel_layer_is_shared() -> bool:
+    return settings.CHANNEL_LAYERS['default']['BACKEND'] not in PROCESS_LOCAL_LAYERS
+
+
+def check_shared_state():
+    """A layer shared between processes needs a cache shared between them too"""
+    if channel_layer_is_shared() and not cache_is_shared():
+        raise ImproperlyConfigured(
+            f"{settings.CHANNEL_LAYERS['default']['BACKEND']} connects several processes, but the "
+            f"default cache ({settings.CACHES['default']['BACKEND']}) is local to each of them. "
+            "Configure a shared CACHES backend such as Redis."
+        )
@@ -0,0 +1,40 @@
+"""
+Minimal in-process metrics registry.
+
+Counters and gauges are kept per worker process and exposed through the
+admin-only /api/metrics/ endpoint; scrape every worker to get totals.
+"""
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+
+
+def incr(name: str, amount: int = 1) -> None:
+    with _lock:
+        _counters[name] += amount
+
+
+def set_gauge(name: str, value) -> None:
+    with _lock:
+        _gauges[name] = value
+
+
+def max_gauge(name: str, value) -> None:
+    """Keep the high-water mark of a gauge"""
+    with _lock:
+        if value > _gauges.get(name, value - 1):
+            _gauges[name] = value
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {'counters': dict(_counters), 'gauges': dict(_gauges)}
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
@@ -225,6 +225,16 @@ if config('USE_REDIS', default=False, cast=bool):
             },
         },
     }
+elif config('CHANNEL_BROKER_SOCKET', default=''):
+    # Several workers on one host without Redis for the layer; start `manage.py run_channel_broker` first
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'chat.layers.UnixSocketChannelLayer',
+            'CONFIG': {
+                'path': config('CHANNEL_BROKER_SOCKET'),
+            },
+        },
+    }
 else:
     # Use in-memory channel layer for development (no Redis required)
     CHANNEL_LAYERS = {
@@ -233,6 +243,84 @@ else:
         },
     }
 
+# Cache shared by every process: notification sequence numbers, presence, vendor feed
+# versions, waiting room buckets and courier heartbeats live here. irefuel_backend.deployment
+# refuses to start a multi-process setup on a process-local cache
+if config('USE_REDIS', default=False, cast=bool):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config(
+                'REDIS_CACHE_URL',
+                default=f"redis://{config('REDIS_HOST', default='127.0.0.1')}:{config('REDIS_PORT', default=6379, cast=int)}/1"
+            ),
+        },
+    }
+elif config('CHANNEL_BROKER_SOCKET', default=''):
+    # Served by the same broker as the channel layer, so one host still needs no Redis
+    CACHES = {
+        'default': {
+            'BACKEND': 'chat.layers.BrokerCache',
+            'LOCATION': config('CHANNEL_BROKER_SOCKET'),
+        },
+    }
+else:
+    # Single process development server only
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# Real-time chat settings
+# Seconds to coalesce read_up_to frames before issuing a single UPDATE
+CHAT_READ_RECEIPT_WINDOW = config('CHAT_READ_RECEIPT_WINDOW', default=0.5, cast=float)
+# Presence and typing state live in the cache (CACHES) and expire after these many seconds
+CHAT_PRESENCE_TTL = config('CHAT_PRESENCE_TTL', default=90, cast=int)
+CHAT_TYPING_TTL = config('CHAT_TYPING_TTL', default=5, cast=int)
+# Notifications kept per user for replay after a reconnect (last N events, for at most TTL seconds)
+NOTIFICATION_BUFFER_SIZE = config('NOTIFICATION_BUFFER_SIZE', default=200, cast=int)
+NOTIFICATION_BUFFER_TTL = config('NOTIFICATION_BUFFER_TTL', default=3600, cast=int)
+# WebSocket JWT auth keeps users in an in-process cache for this many seconds
+WS_AUTH_USER_CACHE_TTL = config('WS_AUTH_USER_CACHE_TTL', default=30, cast=int)
+WS_AUTH_USER_CACHE_SIZE = config('WS_AUTH_USER_CACHE_SIZE', default=10000, cast=int)
+# Frames queued per socket before a slow client is disconnected with a resume hint
+WS_OUTBOUND_HIGH_WATER = config('WS_OUTBOUND_HIGH_WATER', default=100, cast=int)
+# Upper bound on streams a single multiplexed socket (ws/stream/) may subscribe to
+WS_MAX_SUBSCRIPTIONS = config('WS_MAX_SUBSCRIPTIONS', default=100, cast=int)
+# On SIGTERM sockets are closed gradually over this many seconds (keep it below the
+# platform's kill timeout) and told to wait up to WS_RECONNECT_JITTER seconds to reconnect
+WS_DRAIN_WINDOW = config('WS_DRAIN_WINDOW', default=20, cast=float)
+WS_RECONNECT_JITTER = config('WS_RECONNECT_JITTER', default=10, cast=float)
+
+# Delivery dispatch
+# Seconds a courier holds an offered delivery before it cascades to the next courier
+# (expired by `manage.py run_delivery_scheduler`)
+DISPATCH_OFFER_TTL = config('DISPATCH_OFFER_TTL', default=45, cast=int)
+# Seconds before an unconfirmed order is cancelled, and before an accepted delivery
+# that was never picked up goes back to dispatch
+ORDER_CONFIRMATION_TIMEOUT = config('ORDER_CONFIRMATION_TIMEOUT', default=900, cast=int)
+DELIVERY_PICKUP_TIMEOUT = config('DELIVERY_PICKUP_TIMEOUT', default=1800, cast=int)
+# Courier apps send a heartbeat frame on ws/notifications/ every interval; after this many
+# missed beats the scheduler marks the courier unavailable until the next one arrives
+COURIER_HEARTBEAT_INTERVAL = config('COURIER_HEARTBEAT_INTERVAL', default=15, cast=int)
+COURIER_HEARTBEAT_MISSES = config('COURIER_HEARTBEAT_MISSES', default=3, cast=int)
+# Orders a kitchen is assumed to work on at once until its throughput has been observed
+KITCHEN_DEFAULT_PARALLELISM = config('KITCHEN_DEFAULT_PARALLELISM', default=4, cast=int)
+# Demand heatmap: seconds between folding new orders in, and how far ahead courier recommendations look
+DEMAND_REFRESH_INTERVAL = config('DEMAND_REFRESH_INTERVAL', default=300, cast=int)
+DEMAND_LOOKAHEAD_MINUTES = config('DEMAND_LOOKAHEAD_MINUTES', default=30, cast=int)
+# Order placement waiting room: token buckets (orders per second, burst) across all vendors and per vendor
+ORDER_ADMISSION_RATE = config('ORDER_ADMISSION_RATE', default=20, cast=float)
+ORDER_ADMISSION_BURST = config('ORDER_ADMISSION_BURST', default=60, cast=int)
+VENDOR_ADMISSION_RATE = config('VENDOR_ADMISSION_RATE', default=2, cast=float)
+VENDOR_ADMISSION_BURST = config('VENDOR_ADMISSION_BURST', default=10, cast=int)
+# Attempts that would wait longer than this are turned away; queued tokens stay valid this long past their turn
+WAITING_ROOM_MAX_WAIT = config('WAITING_ROOM_MAX_WAIT', default=300, cast=float)
+WAITING_ROOM_TOKEN_GRACE = config('WAITING_ROOM_TOKEN_GRACE', default=120, cast=int)
+# Precomputed walking times between campus nodes, memory-mapped by every worker; a build artifact kept out of git
+CAMPUS_ROUTES_PATH = config('CAMPUS_ROUTES_PATH', default=os.path.join(BASE_DIR, 'var', 'campus_routes.bin'))
+
 # Production Security Settings
 if not DEBUG:
     SECURE_SSL_REDIRECT = config('SECURE_SSL_REDIRECT', default=True, cast=bool)
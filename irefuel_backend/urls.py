@@ -32,6 +32,7 @@ urlpatterns = [
     
     # Utility endpoints
     path('api/health/', views.health_check, name='api_health_check'),
+    path('api/metrics/', views.metrics, name='api_metrics'),
     path('health/', views.health_check, name='health_check'),
     path('favicon.ico', views.favicon_view, name='favicon'),
     path('robots.txt', views.robots_txt, name='robots_txt'),
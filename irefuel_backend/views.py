@@ -5,6 +5,10 @@ from django.http import JsonResponse, HttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from datetime import datetime
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from . import metrics as metrics_registry
 
 @require_http_methods(["GET"])
 def api_root(request):
@@ -50,3 +54,9 @@ Disallow: /api/users/auth/
 Allow: /api/
 """
     return HttpResponse(content, content_type="text/plain")
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """In-process counters and gauges of the worker that served the request"""
+    return Response(metrics_registry.snapshot())
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_status_created_at_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='release_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='KitchenStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_seconds', models.FloatField(blank=True, null=True)),
+                ('orders_observed', models.PositiveIntegerField(default=0)),
+                ('last_ready_at', models.DateTimeField(blank=True, null=True)),
+                ('vendor', models.OneToOneField(limit_choices_to={'user_type': 'vendor'}, on_delete=django.db.models.deletion.CASCADE, related_name='kitchen_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
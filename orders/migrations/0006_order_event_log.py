@@ -0,0 +1,47 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_events(apps, schema_editor):
+    # Only the transitions Order kept a timestamp for can be recovered
+    Order = apps.get_model('orders', 'Order')
+    OrderEvent = apps.get_model('orders', 'OrderEvent')
+    events = []
+    for order in Order.objects.only('id', 'vendor_id', 'student_id', 'created_at', 'confirmed_at', 'delivered_at').iterator():
+        events.append(OrderEvent(order_id=order.id, vendor_id=order.vendor_id, event='pending', actor_id=order.student_id, ts=order.created_at))
+        if order.confirmed_at:
+            events.append(OrderEvent(order_id=order.id, vendor_id=order.vendor_id, event='confirmed', actor_id=order.vendor_id, ts=order.confirmed_at))
+        if order.delivered_at:
+            events.append(OrderEvent(order_id=order.id, vendor_id=order.vendor_id, event='delivered', ts=order.delivered_at))
+    OrderEvent.objects.bulk_create(events, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_slots'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('preparing', 'Preparing'), ('ready_for_delivery', 'Ready for Delivery'), ('out_for_delivery', 'Out for Delivery'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled'), ('assigned', 'Courier assigned'), ('accepted', 'Courier accepted'), ('picked_up', 'Picked up'), ('unassigned', 'Courier released')], max_length=20)),
+                ('ts', models.DateTimeField(default=django.utils.timezone.now)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='orders.order')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['ts', 'id'],
+                'indexes': [models.Index(fields=['order', 'ts'], name='orders_orde_order_i_62e021_idx'), models.Index(fields=['vendor', 'ts'], name='orders_orde_vendor__45c817_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_events, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from users.models import MenuItem
 
 User = get_user_model()
@@ -32,14 +33,76 @@ class Order(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     confirmed_at = models.DateTimeField(null=True, blank=True)
     delivered_at = models.DateTimeField(null=True, blank=True)
+    # Deferred orders reach the vendor's queue at this time, see orders.services.KitchenService
+    release_at = models.DateTimeField(null=True, blank=True)
+    # Start of the pre-order slot the student asked for, see orders.services.SlotService
+    requested_slot = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Open orders by age: active queues and the confirmation deadline loader
+            models.Index(fields=['status', 'created_at']),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} - {self.student.username} from {self.vendor.username}"
 
 
+class OrderEvent(models.Model):
+    """Append-only order lifecycle log, one row per transition; rows are never updated"""
+    EVENT_CHOICES = Order.ORDER_STATUS_CHOICES + (
+        ('assigned', 'Courier assigned'),
+        ('accepted', 'Courier accepted'),
+        ('picked_up', 'Picked up'),
+        ('unassigned', 'Courier released'),
+    )
+    
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='events')
+    vendor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')  # Copied from the order for vendor timelines
+    event = models.CharField(max_length=20, choices=EVENT_CHOICES)
+    # Who changed the status, or the courier a delivery event is about; empty for scheduler transitions
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    ts = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['ts', 'id']
+        indexes = [
+            models.Index(fields=['order', 'ts']),
+            models.Index(fields=['vendor', 'ts']),
+        ]
+
+    def __str__(self):
+        return f"Order #{self.order_id} {self.event} at {self.ts}"
+
+
+class KitchenStats(models.Model):
+    """Observed kitchen throughput per vendor, for queue-aware preparation estimates"""
+    vendor = models.OneToOneField(User, on_delete=models.CASCADE, related_name='kitchen_stats', limit_choices_to={'user_type': 'vendor'})
+    service_seconds = models.FloatField(null=True, blank=True)  # Moving average of seconds between finished orders
+    orders_observed = models.PositiveIntegerField(default=0)
+    last_ready_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Kitchen stats for {self.vendor.username}"
+
+
+class OrderSlot(models.Model):
+    """Booked pre-orders per vendor slot, kept alongside the orders so availability never counts them"""
+    vendor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='order_slots', limit_choices_to={'user_type': 'vendor'})
+    starts_at = models.DateTimeField()
+    booked = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['starts_at']
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'starts_at'], name='unique_vendor_slot'),
+        ]
+
+    def __str__(self):
+        return f"{self.vendor.username} slot at {self.starts_at}: {self.booked} booked"
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
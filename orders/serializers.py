@@ -1,7 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Order, OrderItem, DeliveryLocation
-from users.models import MenuItem
+from .models import Order, OrderEvent, OrderItem, DeliveryLocation
+from django.utils import timezone
+from users.models import Cafeteria, MenuItem
 
 User = get_user_model()
 
@@ -28,7 +29,22 @@ class OrderCreateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ('vendor', 'delivery_address', 'special_instructions', 'items')
+        fields = ('vendor', 'delivery_address', 'special_instructions', 'requested_slot', 'items')
+
+    def validate(self, attrs):
+        from .services import SlotService
+        
+        requested_slot = attrs.get('requested_slot')
+        if requested_slot is None:
+            return attrs
+        cafeteria = Cafeteria.objects.filter(vendor=attrs['vendor']).first()
+        if cafeteria is None or cafeteria.slot_capacity is None:
+            raise serializers.ValidationError({'requested_slot': "This cafeteria does not take pre-orders."})
+        if requested_slot <= timezone.now():
+            raise serializers.ValidationError({'requested_slot': "Pre-order slots must be in the future."})
+        if not SlotService.is_slot_start(cafeteria, requested_slot):
+            raise serializers.ValidationError({'requested_slot': "This is not one of the cafeteria's slots."})
+        return attrs
 
     def create(self, validated_data):
         items_data = validated_data.pop('items')
@@ -48,10 +64,11 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             if menu_item.preparation_time > max_prep_time:
                 max_prep_time = menu_item.preparation_time
         
+        # The view may pass a queue-aware estimate, see orders.services.KitchenService
+        validated_data.setdefault('estimated_preparation_time', max_prep_time)
         order = Order.objects.create(
             student=self.context['request'].user,
             total_amount=total_amount,
-            estimated_preparation_time=max_prep_time,
             **validated_data
         )
         
@@ -78,9 +95,27 @@ class OrderSerializer(serializers.ModelSerializer):
                  'delivery_person', 'delivery_person_name', 'status', 'total_amount',
                  'delivery_address', 'special_instructions', 'estimated_preparation_time',
                  'estimated_delivery_time', 'created_at', 'updated_at', 
-                 'confirmed_at', 'delivered_at', 'items')
+                 'confirmed_at', 'delivered_at', 'release_at', 'requested_slot', 'items')
         read_only_fields = ('id', 'student', 'total_amount', 'estimated_preparation_time',
-                          'created_at', 'updated_at', 'confirmed_at', 'delivered_at')
+                          'created_at', 'updated_at', 'confirmed_at', 'delivered_at', 'release_at',
+                          'requested_slot')
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """Compact order row for the vendor's live queue"""
+    student_name = serializers.CharField(source='student.get_full_name', read_only=True)
+    item_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Order
+        fields = ('id', 'status', 'student_name', 'delivery_person', 'total_amount', 'item_count',
+                 'estimated_preparation_time', 'created_at', 'updated_at')
+
+    def get_item_count(self, obj):
+        # Annotated by the snapshot query, counted for single orders
+        if hasattr(obj, 'item_count'):
+            return obj.item_count
+        return obj.items.count()
 
 
 class OrderStatusUpdateSerializer(serializers.ModelSerializer):
@@ -117,6 +152,15 @@ class OrderStatusUpdateSerializer(serializers.ModelSerializer):
         return value
 
 
+class OrderEventSerializer(serializers.ModelSerializer):
+    actor_name = serializers.CharField(source='actor.get_full_name', read_only=True)
+
+    class Meta:
+        model = OrderEvent
+        fields = ('event', 'actor', 'actor_name', 'ts')
+        read_only_fields = fields
+
+
 class DeliveryLocationSerializer(serializers.ModelSerializer):
     class Meta:
         model = DeliveryLocation
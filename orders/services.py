@@ -0,0 +1,228 @@
+"""
+Services for order intake
+"""
+import math
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, NamedTuple, Optional
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Order, OrderEvent, KitchenStats, OrderSlot
+
+User = get_user_model()
+
+# Orders the kitchen still has to get through
+IN_PROGRESS_STATUSES = ('pending', 'confirmed', 'preparing')
+# Weight of the newest observation in the service time moving average
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class OrderTimeline:
+    """
+    Writes and reads the append-only OrderEvent log. Every transition is
+    recorded here, so time spent in each status can be read back instead
+    of being inferred from the timestamps kept on Order.
+    """
+
+    @staticmethod
+    def record(order: Order, event: str, actor: Optional[User] = None) -> OrderEvent:
+        return OrderEvent.objects.create(order=order, vendor_id=order.vendor_id, event=event, actor=actor)
+
+    @staticmethod
+    def record_many(orders: Iterable[Order], event: str, actor: Optional[User] = None):
+        """One INSERT for a batch of orders reaching the same event"""
+        now = timezone.now()
+        OrderEvent.objects.bulk_create([
+            OrderEvent(order=order, vendor_id=order.vendor_id, event=event, actor=actor, ts=now)
+            for order in orders
+        ])
+
+    @staticmethod
+    def entered_at(order_id, event: str) -> Optional[datetime]:
+        """When the order last reached an event"""
+        return OrderEvent.objects.filter(order_id=order_id, event=event).order_by('-ts').values_list('ts', flat=True).first()
+
+    @staticmethod
+    def stage_seconds(events) -> dict:
+        """Seconds spent in each status the order has left, from consecutive status events"""
+        statuses = dict(Order.ORDER_STATUS_CHOICES)
+        transitions = [event for event in events if event.event in statuses]
+        seconds = {}
+        for current, following in zip(transitions, transitions[1:]):
+            seconds[current.event] = seconds.get(current.event, 0) + (following.ts - current.ts).total_seconds()
+        return seconds
+
+
+class KitchenQuote(NamedTuple):
+    wait_minutes: int  # Projected wait before the kitchen reaches a new order
+    estimate_minutes: int  # Queue-aware preparation estimate for the new order
+    refused: bool
+    release_at: Optional[datetime]  # Set when the order is deferred
+    retry_after: int  # Seconds until the wait should be back under the threshold
+
+
+class KitchenService:
+    """
+    Per-vendor kitchen load. The queue is the vendor's in-progress orders;
+    throughput is a moving average of the time between orders becoming
+    ready, which reflects how many the kitchen works on in parallel.
+    """
+
+    @staticmethod
+    def default_parallelism() -> int:
+        return getattr(settings, 'KITCHEN_DEFAULT_PARALLELISM', 4)
+
+    @classmethod
+    def queue_length(cls, vendor_id) -> int:
+        """
+        In-progress orders the kitchen has to get through. Orders deferred
+        by overload still count, so each one deferred in a rush is released
+        later than the one before; pre-orders only count once released.
+        """
+        return Order.objects.filter(
+            cls.released() | Q(requested_slot__isnull=True), vendor_id=vendor_id, status__in=IN_PROGRESS_STATUSES
+        ).count()
+
+    @classmethod
+    def service_seconds(cls, vendor_id, prep_minutes: int) -> float:
+        """Observed seconds per finished order, or a guess from the item's prep time until there are observations"""
+        observed = KitchenStats.objects.filter(vendor_id=vendor_id).values_list('service_seconds', flat=True).first()
+        if observed:
+            return observed
+        return prep_minutes * 60 / cls.default_parallelism()
+
+    @classmethod
+    def quote(cls, vendor: User, prep_minutes: int) -> KitchenQuote:
+        """Estimate a new order against the current queue and apply the cafeteria's admission threshold"""
+        from users.models import Cafeteria
+
+        queued = cls.queue_length(vendor.id)
+        interval = cls.service_seconds(vendor.id, prep_minutes)
+        wait_minutes = math.ceil(queued * interval / 60)
+        estimate_minutes = max(prep_minutes, math.ceil((queued + 1) * interval / 60))
+
+        cafeteria = Cafeteria.objects.filter(vendor=vendor).only('max_queue_wait', 'overload_action').first()
+        if cafeteria is None or cafeteria.max_queue_wait is None or wait_minutes <= cafeteria.max_queue_wait:
+            return KitchenQuote(wait_minutes, estimate_minutes, False, None, 0)
+
+        retry_after = (wait_minutes - cafeteria.max_queue_wait) * 60
+        if cafeteria.overload_action == 'defer':
+            release_at = timezone.now() + timedelta(seconds=retry_after)
+            return KitchenQuote(wait_minutes, estimate_minutes, False, release_at, retry_after)
+        return KitchenQuote(wait_minutes, estimate_minutes, True, None, retry_after)
+
+    @staticmethod
+    @transaction.atomic
+    def record_ready(order: Order):
+        """Fold a finished order into the vendor's observed service time"""
+        now = timezone.now()
+        stats, _ = KitchenStats.objects.select_for_update().get_or_create(vendor_id=order.vendor_id)
+        # A busy kitchen finishes an order every interval; an idle one takes the order's own prep time
+        started = OrderTimeline.entered_at(order.id, 'confirmed') or order.created_at
+        interval = (now - started).total_seconds()
+        if stats.last_ready_at:
+            interval = min(interval, (now - stats.last_ready_at).total_seconds())
+
+        if stats.service_seconds is None:
+            stats.service_seconds = interval
+        else:
+            stats.service_seconds += SERVICE_TIME_SMOOTHING * (interval - stats.service_seconds)
+        stats.orders_observed += 1
+        stats.last_ready_at = now
+        stats.save()
+
+    @staticmethod
+    def released() -> Q:
+        """Orders visible in the vendor's queue: not deferred, or deferred until now"""
+        return Q(release_at__isnull=True) | Q(release_at__lte=timezone.now())
+
+    @staticmethod
+    def deferred_orders():
+        """(id, release_at) of deferred orders, for the scheduler to load on start"""
+        return Order.objects.filter(status='pending', release_at__isnull=False).values_list('id', 'release_at')
+
+    @staticmethod
+    def release_orders(order_ids) -> int:
+        """Scheduler job: announce deferred orders to their vendors once they are due"""
+        from delivery.services import ExpiryService, NotificationService
+
+        orders = list(Order.objects.filter(id__in=order_ids, status='pending', release_at__lte=timezone.now()))
+        for order in orders:
+            NotificationService.notify_vendor_order(order, 'created')
+            ExpiryService.schedule_confirmation(order)
+        return len(orders)
+
+
+class SlotService:
+    """
+    Pre-order slots. A cafeteria with a slot_capacity splits its opening
+    hours into slot_minutes slots; OrderSlot keeps the booked count of each
+    slot, moved by conditional UPDATEs when orders are placed or cancelled,
+    so availability is one indexed range read however many orders there are.
+    Slotted orders stay out of the vendor's queue until their preparation
+    has to start, reusing the deferred order release in KitchenService.
+    """
+
+    @staticmethod
+    def slot_starts(cafeteria, day: date) -> List[datetime]:
+        """Starts of the cafeteria's slots on a day, in the current timezone"""
+        opens = timezone.make_aware(datetime.combine(day, cafeteria.opening_time))
+        closes = timezone.make_aware(datetime.combine(day, cafeteria.closing_time))
+        if closes <= opens:
+            closes += timedelta(days=1)
+        length = timedelta(minutes=cafeteria.slot_minutes)
+        starts = []
+        while opens + length <= closes:
+            starts.append(opens)
+            opens += length
+        return starts
+
+    @classmethod
+    def is_slot_start(cls, cafeteria, starts_at: datetime) -> bool:
+        return starts_at in cls.slot_starts(cafeteria, timezone.localtime(starts_at).date())
+
+    @classmethod
+    def availability(cls, cafeteria, day: date) -> list:
+        """Upcoming slots of a day with their remaining capacity"""
+        now = timezone.now()
+        starts = [starts_at for starts_at in cls.slot_starts(cafeteria, day) if starts_at > now]
+        if not starts:
+            return []
+        booked = dict(OrderSlot.objects.filter(
+            vendor_id=cafeteria.vendor_id, starts_at__gte=starts[0], starts_at__lte=starts[-1]
+        ).values_list('starts_at', 'booked'))
+        return [
+            {
+                'starts_at': starts_at,
+                'ends_at': starts_at + timedelta(minutes=cafeteria.slot_minutes),
+                'capacity': cafeteria.slot_capacity,
+                'available': max(0, cafeteria.slot_capacity - booked.get(starts_at, 0)),
+            }
+            for starts_at in starts
+        ]
+
+    @staticmethod
+    def reserve(cafeteria, starts_at: datetime) -> bool:
+        """Take a place in a slot; False when it is already full"""
+        OrderSlot.objects.get_or_create(vendor_id=cafeteria.vendor_id, starts_at=starts_at)
+        return bool(OrderSlot.objects.filter(
+            vendor_id=cafeteria.vendor_id, starts_at=starts_at, booked__lt=cafeteria.slot_capacity
+        ).update(booked=F('booked') + 1))
+
+    @staticmethod
+    def cancel(orders: Iterable[Order]):
+        """Give back the slot places of cancelled orders"""
+        freed = Counter((order.vendor_id, order.requested_slot) for order in orders if order.requested_slot)
+        for (vendor_id, starts_at), count in freed.items():
+            OrderSlot.objects.filter(vendor_id=vendor_id, starts_at=starts_at, booked__gte=count).update(
+                booked=F('booked') - count
+            )
+
+    @staticmethod
+    def release_time(starts_at: datetime, prep_minutes: int) -> Optional[datetime]:
+        """When a slotted order should reach the kitchen to be ready for its slot; None when that is now"""
+        release_at = starts_at - timedelta(minutes=prep_minutes)
+        return release_at if release_at > timezone.now() else None
@@ -1,10 +1,19 @@
-from django.test import TestCase
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.urls import reverse
+from django.utils import timezone
+from datetime import datetime, timedelta
+from datetime import time as clock
 from decimal import Decimal
-from .models import Order, OrderItem, DeliveryLocation
+from irefuel_backend import metrics
+from .models import Order, OrderItem, DeliveryLocation, KitchenStats, OrderEvent, OrderSlot
+from .services import KitchenService
 from users.models import Cafeteria, MenuItem
 
 User = get_user_model()
@@ -13,6 +22,8 @@ User = get_user_model()
 class OrderTestCase(TestCase):
     def setUp(self):
         self.client = APIClient()
+        # Waiting room buckets live in the cache
+        cache.clear()
         
         # Create test users
         self.student = User.objects.create_user(
@@ -179,6 +190,205 @@ class OrderTestCase(TestCase):
         order.refresh_from_db()
         self.assertEqual(order.delivery_person, self.delivery_person)
 
+    def test_order_timeline_reads_event_log(self):
+        """Test that each transition is appended to the order's event log and served as its timeline"""
+        self.client.force_authenticate(user=self.student)
+        order_id = self.client.post('/api/orders/', {
+            'vendor': self.vendor.id,
+            'delivery_address': 'Dorm Room 101',
+            'items': [{'menu_item': self.menu_item1.id, 'quantity': 1}]
+        }, format='json').data['id']
+
+        self.client.force_authenticate(user=self.vendor)
+        for new_status in ('confirmed', 'preparing', 'ready_for_delivery'):
+            self.client.patch(f'/api/orders/{order_id}/status/', {'status': new_status}, format='json')
+        self.client.force_authenticate(user=self.delivery_person)
+        self.client.patch(f'/api/orders/{order_id}/accept-delivery/')
+
+        self.client.force_authenticate(user=self.student)
+        response = self.client.get(f'/api/orders/{order_id}/timeline/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(event['event'], event['actor']) for event in response.data['events']],
+            [('pending', self.student.id), ('confirmed', self.vendor.id), ('preparing', self.vendor.id),
+             ('ready_for_delivery', self.vendor.id), ('assigned', self.delivery_person.id)]
+        )
+        self.assertEqual(set(response.data['stage_seconds']), {'pending', 'confirmed', 'preparing'})
+        self.assertEqual(OrderEvent.objects.filter(vendor=self.vendor).count(), 5)
+
+        other = User.objects.create_user(username='student2', password='testpass123', user_type='student')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(f'/api/orders/{order_id}/timeline/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_vendor_live_queue_snapshot_and_deltas(self):
+        """Test that new orders and status changes are pushed to the vendor after the snapshot version"""
+        cache.clear()
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(f'vendor_{self.vendor.id}', channel)
+
+        self.client.force_authenticate(user=self.student)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/orders/', {
+                'vendor': self.vendor.id,
+                'delivery_address': 'Dorm Room 101',
+                'items': [{'menu_item': self.menu_item1.id, 'quantity': 2}]
+            }, format='json')
+        order_id = response.data['id']
+
+        self.client.force_authenticate(user=self.vendor)
+        snapshot = self.client.get('/api/orders/vendor/live/').data
+        self.assertEqual(snapshot['version'], 1)
+        self.assertEqual([order['id'] for order in snapshot['orders']], [order_id])
+        self.assertEqual(snapshot['orders'][0]['item_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/orders/{order_id}/status/', {'status': 'cancelled'}, format='json')
+        self.assertEqual(self.client.get('/api/orders/vendor/live/').data['orders'], [])
+
+        created = async_to_sync(channel_layer.receive)(channel)
+        updated = async_to_sync(channel_layer.receive)(channel)
+        self.assertEqual((created['action'], created['version'], created['order']['id']), ('created', 1, order_id))
+        self.assertEqual((updated['action'], updated['version'], updated['status']), ('updated', 2, 'cancelled'))
+
+        self.client.force_authenticate(user=self.student)
+        response = self.client.get('/api/orders/vendor/live/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_kitchen_quote_tracks_queue_and_observed_throughput(self):
+        """Test that estimates grow with the vendor's queue and learn from orders becoming ready"""
+        for _ in range(4):
+            Order.objects.create(
+                student=self.student, vendor=self.vendor, total_amount=Decimal('5.99'),
+                delivery_address='Dorm Room 101', estimated_preparation_time=15
+            )
+        # Four queued orders at the default 15 min / 4 in parallel each
+        quote = KitchenService.quote(self.vendor, 15)
+        self.assertEqual((quote.wait_minutes, quote.estimate_minutes, quote.refused), (15, 19, False))
+
+        order = Order.objects.filter(vendor=self.vendor).first()
+        self.client.force_authenticate(user=self.vendor)
+        for new_status in ('confirmed', 'preparing', 'ready_for_delivery'):
+            self.client.patch(f'/api/orders/{order.id}/status/', {'status': new_status}, format='json')
+        stats = KitchenStats.objects.get(vendor=self.vendor)
+        self.assertEqual(stats.orders_observed, 1)
+        self.assertLess(stats.service_seconds, 60)
+        self.assertEqual(KitchenService.quote(self.vendor, 15).estimate_minutes, 15)
+
+    def test_overloaded_kitchen_refuses_or_defers_orders(self):
+        """Test the cafeteria's admission threshold on order creation"""
+        for _ in range(8):
+            Order.objects.create(
+                student=self.student, vendor=self.vendor, total_amount=Decimal('5.99'),
+                delivery_address='Dorm Room 101', estimated_preparation_time=15
+            )
+        self.cafeteria.max_queue_wait = 20
+        self.cafeteria.save()
+        order_data = {
+            'vendor': self.vendor.id,
+            'delivery_address': 'Dorm Room 101',
+            'items': [{'menu_item': self.menu_item1.id, 'quantity': 1}]
+        }
+
+        self.client.force_authenticate(user=self.student)
+        response = self.client.post('/api/orders/', order_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.data['projected_wait'], 30)
+        self.assertEqual(response['Retry-After'], '600')
+        self.assertEqual(Order.objects.count(), 8)
+
+        self.cafeteria.overload_action = 'defer'
+        self.cafeteria.save()
+        response = self.client.post('/api/orders/', order_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNotNone(response.data['release_at'])
+
+        # Deferred orders stay in the projected load, so a burst is released one service interval apart
+        burst = [self.client.post('/api/orders/', order_data, format='json').data['id'] for _ in range(2)]
+        release_times = [Order.objects.get(id=order_id).release_at for order_id in [response.data['id']] + burst]
+        self.assertEqual(
+            [round((later - earlier).total_seconds() / 60) for earlier, later in zip(release_times, release_times[1:])],
+            [4, 4]
+        )
+        Order.objects.filter(id__in=burst).delete()
+
+        self.client.force_authenticate(user=self.vendor)
+        live_ids = [order['id'] for order in self.client.get('/api/orders/vendor/live/').data['orders']]
+        self.assertEqual(len(live_ids), 8)
+        self.assertNotIn(response.data['id'], live_ids)
+
+        Order.objects.filter(id=response.data['id']).update(release_at=timezone.now())
+        self.assertEqual(KitchenService.release_orders([response.data['id']]), 1)
+        live_ids = [order['id'] for order in self.client.get('/api/orders/vendor/live/').data['orders']]
+        self.assertIn(response.data['id'], live_ids)
+
+    def test_pre_order_slots_track_capacity(self):
+        """Test booking, listing and freeing pre-order slots"""
+        self.cafeteria.slot_minutes = 30
+        self.cafeteria.slot_capacity = 1
+        self.cafeteria.save()
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        noon = timezone.make_aware(datetime.combine(tomorrow, clock(12, 0)))
+        order_data = {
+            'vendor': self.vendor.id,
+            'delivery_address': 'Dorm Room 101',
+            'requested_slot': noon.isoformat(),
+            'items': [{'menu_item': self.menu_item1.id, 'quantity': 1}]
+        }
+
+        self.client.force_authenticate(user=self.student)
+        response = self.client.post('/api/orders/', order_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(id=response.data['id'])
+        self.assertEqual(order.release_at, noon - timedelta(minutes=15))
+        self.assertEqual(self.client.post('/api/orders/', order_data, format='json').status_code, status.HTTP_409_CONFLICT)
+        order_data['requested_slot'] = (noon + timedelta(minutes=10)).isoformat()
+        self.assertEqual(self.client.post('/api/orders/', order_data, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(f'/api/orders/vendor/{self.vendor.id}/slots/', {'date': tomorrow.isoformat()})
+        slots = {slot['starts_at']: slot['available'] for slot in response.data['slots']}
+        self.assertEqual(len(slots), 24)
+        self.assertEqual(slots[noon], 0)
+        self.assertEqual(slots[noon + timedelta(minutes=30)], 1)
+
+        # Tomorrow's pre-order is not in today's kitchen queue
+        self.assertEqual(KitchenService.quote(self.vendor, 15).wait_minutes, 0)
+
+        self.client.force_authenticate(user=self.vendor)
+        self.client.patch(f'/api/orders/{order.id}/status/', {'status': 'cancelled'}, format='json')
+        self.assertEqual(OrderSlot.objects.get(vendor=self.vendor, starts_at=noon).booked, 0)
+
+    @override_settings(VENDOR_ADMISSION_RATE=8, VENDOR_ADMISSION_BURST=1, WAITING_ROOM_MAX_WAIT=0.15)
+    def test_waiting_room_queues_order_bursts(self):
+        """Test that attempts over the vendor's bucket get a queue token instead of an error"""
+        metrics.reset()
+        order_data = {
+            'vendor': self.vendor.id,
+            'delivery_address': 'Dorm Room 101',
+            'items': [{'menu_item': self.menu_item1.id, 'quantity': 1}]
+        }
+        self.client.force_authenticate(user=self.student)
+        with mock.patch('orders.waiting_room.time') as waiting_room_time:
+            waiting_room_time.time.return_value = 1000.0
+            admitted = self.client.post('/api/orders/', order_data, format='json')
+            self.assertEqual(admitted.status_code, status.HTTP_201_CREATED)
+            queued = self.client.post('/api/orders/', order_data, format='json')
+            self.assertEqual(queued.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual((queued.data['position'], queued['Retry-After']), (1, '1'))
+            rejected = self.client.post('/api/orders/', order_data, format='json')
+            self.assertEqual(rejected.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+            waiting_room_time.time.return_value = 1000.125
+            response = self.client.post(
+                '/api/orders/', order_data, format='json', HTTP_X_WAITING_ROOM_TOKEN=queued.data['token']
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 2)
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(
+            [counters['orders.admission.' + outcome] for outcome in ('admitted', 'queued', 'rejected')], [2, 1, 1]
+        )
+
 
 class DeliveryLocationTestCase(TestCase):
     def setUp(self):
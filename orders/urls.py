@@ -9,9 +9,12 @@ urlpatterns = [
     path('my-orders/', views.StudentOrdersView.as_view(), name='student-orders'),
     path('<int:pk>/', views.OrderDetailView.as_view(), name='order-detail'),
     path('<int:order_id>/status/', views.update_order_status, name='update-order-status'),
+    path('<int:order_id>/timeline/', views.order_timeline, name='order-timeline'),
     
     # Vendor endpoints
     path('vendor/', views.VendorOrdersView.as_view(), name='vendor-orders'),
+    path('vendor/live/', views.vendor_live_orders, name='vendor-live-orders'),
+    path('vendor/<int:vendor_id>/slots/', views.vendor_slots, name='vendor-slots'),
     
     # Delivery endpoints
     path('delivery/', views.DeliveryOrdersView.as_view(), name='delivery-orders'),
@@ -4,12 +4,21 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count
 from django.utils import timezone
-from .models import Order, OrderItem, DeliveryLocation
+from django.utils.dateparse import parse_date
+from .models import Order, OrderEvent, OrderItem, DeliveryLocation
 from .serializers import (
     OrderCreateSerializer, OrderSerializer, OrderStatusUpdateSerializer,
-    DeliveryLocationSerializer
+    OrderSummarySerializer, OrderEventSerializer, DeliveryLocationSerializer
 )
+from .services import KitchenService, OrderTimeline, SlotService
+from .waiting_room import WaitingRoom
+from delivery import scheduler
+from delivery.models import DeliveryPersonLocation
+from delivery.services import DeliveryAssignmentService, ExpiryService, NotificationService
+from users.models import Cafeteria
 
 User = get_user_model()
 
@@ -24,9 +33,65 @@ class OrderCreateView(generics.CreateAPIView):
         serializer.save()
 
     def create(self, request, *args, **kwargs):
+        # Admission control runs before anything touches the database
+        admission = WaitingRoom.admit(
+            request.user.id, request.data.get('vendor'), request.headers.get('X-Waiting-Room-Token')
+        )
+        if admission.rejected:
+            return Response(
+                {'error': 'Ordering is very busy right now, please try again later.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(admission.retry_after)}
+            )
+        if not admission.admitted:
+            # Place the order again with the token in X-Waiting-Room-Token after retry_after seconds
+            return Response(
+                {'status': 'queued', 'position': admission.position,
+                 'retry_after': admission.retry_after, 'token': admission.token},
+                status=status.HTTP_202_ACCEPTED,
+                headers={'Retry-After': str(admission.retry_after)}
+            )
+        
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        order = serializer.save()
+        
+        vendor = serializer.validated_data['vendor']
+        prep_minutes = max(
+            (item['menu_item'].preparation_time for item in serializer.validated_data['items']), default=0
+        )
+        requested_slot = serializer.validated_data.get('requested_slot')
+        
+        if requested_slot is not None:
+            # Pre-orders are prepared just before their slot, not against the current queue
+            with transaction.atomic():
+                if not SlotService.reserve(vendor.cafeteria, requested_slot):
+                    return Response(
+                        {'error': 'This slot is full, please pick another one.'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                order = serializer.save(
+                    estimated_preparation_time=prep_minutes,
+                    release_at=SlotService.release_time(requested_slot, prep_minutes)
+                )
+        else:
+            # Queue-aware estimate and the vendor's admission threshold
+            quote = KitchenService.quote(vendor, prep_minutes)
+            if quote.refused:
+                return Response(
+                    {'error': 'The kitchen is too busy right now, please try again later.',
+                     'projected_wait': quote.wait_minutes},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': str(quote.retry_after)}
+                )
+            order = serializer.save(estimated_preparation_time=quote.estimate_minutes, release_at=quote.release_at)
+        OrderTimeline.record(order, 'pending', request.user)
+        
+        if order.release_at is None:
+            NotificationService.notify_vendor_order(order, 'created')
+            ExpiryService.schedule_confirmation(order)
+        else:
+            # Held back from the vendor's queue until the kitchen catches up or the slot comes near
+            scheduler.schedule('order_release', order.id, order.release_at)
         
         # Return the created order with full details including ID
         order_serializer = OrderSerializer(order)
@@ -51,7 +116,54 @@ class VendorOrdersView(generics.ListAPIView):
     def get_queryset(self):
         if self.request.user.user_type != 'vendor':
             raise PermissionDenied("Only vendors can access this.")
-        return Order.objects.filter(vendor=self.request.user)
+        return Order.objects.filter(KitchenService.released(), vendor=self.request.user)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def vendor_live_orders(request):
+    """
+    Snapshot of the vendor's open orders for the live queue. Clients open
+    the notifications socket first, load this snapshot, then apply the
+    vendor_order deltas whose version is greater than the snapshot's.
+    """
+    if request.user.user_type != 'vendor':
+        raise PermissionDenied("Only vendors can access this.")
+    
+    # Read the version first: a change landing in between is then both in
+    # the snapshot and re-sent as a delta, never missing from both
+    version = NotificationService.vendor_feed_version(request.user.id)
+    orders = Order.objects.filter(KitchenService.released(), vendor=request.user).exclude(
+        status__in=['delivered', 'cancelled']
+    ).select_related('student').annotate(item_count=Count('items')).order_by('created_at')
+    
+    return Response({
+        'version': version,
+        'orders': OrderSummarySerializer(orders, many=True).data
+    })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def vendor_slots(request, vendor_id):
+    """Remaining capacity of a cafeteria's pre-order slots on a day (?date=YYYY-MM-DD, default today)"""
+    cafeteria = get_object_or_404(Cafeteria, vendor_id=vendor_id, is_active=True)
+    if cafeteria.slot_capacity is None:
+        return Response(
+            {'error': 'This cafeteria does not take pre-orders.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        day = parse_date(request.query_params.get('date', '')) or timezone.localdate()
+    except ValueError:
+        return Response({'error': 'Invalid date.'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        'vendor': cafeteria.vendor_id,
+        'date': day,
+        'slot_minutes': cafeteria.slot_minutes,
+        'slots': SlotService.availability(cafeteria, day)
+    })
 
 
 class DeliveryOrdersView(generics.ListAPIView):
@@ -122,6 +234,14 @@ def update_order_status(request, order_id):
         order.delivered_at = timezone.now()
     
     serializer.save()
+    OrderTimeline.record(order, new_status, user)
+    NotificationService.notify_vendor_order(order)
+    if new_status == 'cancelled':
+        SlotService.cancel([order])
+    elif new_status == 'ready_for_delivery':
+        KitchenService.record_ready(order)
+        if order.delivery_person_id is None:
+            NotificationService.publish_delivery_offer(order)
     
     return Response({
         'message': f'Order status updated to {new_status}',
@@ -129,6 +249,23 @@ def update_order_status(request, order_id):
     })
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def order_timeline(request, order_id):
+    """Lifecycle of an order from the event log, with the seconds spent in each status"""
+    order = get_object_or_404(Order, id=order_id)
+    if request.user.id not in (order.student_id, order.vendor_id, order.delivery_person_id):
+        raise PermissionDenied("You can only view the timeline of your own orders.")
+    
+    events = list(OrderEvent.objects.filter(order=order).select_related('actor'))
+    return Response({
+        'order': order.id,
+        'status': order.status,
+        'events': OrderEventSerializer(events, many=True).data,
+        'stage_seconds': OrderTimeline.stage_seconds(events)
+    })
+
+
 @api_view(['PATCH'])
 @permission_classes([permissions.IsAuthenticated])
 def accept_delivery(request, order_id):
@@ -137,14 +274,21 @@ def accept_delivery(request, order_id):
     
     order = get_object_or_404(Order, id=order_id, status='ready_for_delivery')
     
-    if order.delivery_person is not None:
+    if not DeliveryAssignmentService.claim_order(order, request.user):
+        location_info = DeliveryPersonLocation.objects.filter(delivery_person=request.user).first()
+        if not DeliveryAssignmentService.has_capacity(request.user, location_info):
+            return Response(
+                {'error': 'You are not available or already have as many deliveries as you can take.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         return Response(
             {'error': 'This order has already been assigned to a delivery person.'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    order.delivery_person = request.user
-    order.save()
+    OrderTimeline.record(order, 'assigned', request.user)
+    NotificationService.notify_vendor_order(order)
+    NotificationService.retract_delivery_offer(order)
     
     return Response({
         'message': 'Delivery accepted successfully',
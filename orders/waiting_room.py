@@ -0,0 +1,161 @@
+"""
+Waiting room in front of order placement.
+
+Admission is a token bucket per vendor and one across all vendors, kept
+in the Django cache as a virtual schedule: every attempt takes the next
+ticket of each bucket with an atomic incr, and ticket t is due at
+base_time + (t - base_ticket) / rate. A ticket due within the burst
+allowance is admitted at once. Later tickets are queued: the client gets
+its position, how long to wait and a signed token holding its tickets,
+and placing the order again with that token after the wait admits it
+without taking new tickets. A bucket that has been idle is rebased so it
+never holds more than its burst. Nothing here touches the database.
+"""
+import hashlib
+import math
+import time
+from typing import NamedTuple, Optional
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from irefuel_backend import metrics
+
+TOKEN_SALT = 'orders.waiting_room'
+# Bucket state is dropped after this long without attempts, which is the same as a full bucket
+BUCKET_TTL = 60 * 60
+
+
+def _tail_key(scope) -> str:
+    return f'waiting_room:{scope}:tail'
+
+
+def _base_key(scope) -> str:
+    return f'waiting_room:{scope}:base'
+
+
+def _used_key(token) -> str:
+    return f'waiting_room:used:{hashlib.sha1(token.encode()).hexdigest()}'
+
+
+class Admission(NamedTuple):
+    admitted: bool
+    rejected: bool = False
+    position: int = 0  # Tickets ahead in the longest of the queues
+    retry_after: int = 0  # Seconds until the token is due, or until it is worth trying again when rejected
+    token: Optional[str] = None
+
+
+class WaitingRoom:
+    """Admission control for OrderCreateView"""
+
+    @staticmethod
+    def buckets(vendor_id) -> dict:
+        """Scopes the attempt counts against, mapped to (rate per second, burst); a zero rate disables a bucket"""
+        buckets = {
+            'global': (getattr(settings, 'ORDER_ADMISSION_RATE', 20), getattr(settings, 'ORDER_ADMISSION_BURST', 60)),
+        }
+        if vendor_id is not None:
+            buckets[f'vendor:{vendor_id}'] = (
+                getattr(settings, 'VENDOR_ADMISSION_RATE', 2), getattr(settings, 'VENDOR_ADMISSION_BURST', 10)
+            )
+        return {scope: bucket for scope, bucket in buckets.items() if bucket[0] > 0}
+
+    @staticmethod
+    def max_wait() -> float:
+        return getattr(settings, 'WAITING_ROOM_MAX_WAIT', 300)
+
+    @staticmethod
+    def token_grace() -> int:
+        return getattr(settings, 'WAITING_ROOM_TOKEN_GRACE', 120)
+
+    @staticmethod
+    def _due_at(base, ticket: int, rate: float) -> float:
+        base_time, base_ticket = base
+        return base_time + (ticket - base_ticket) / rate
+
+    @classmethod
+    def _wait(cls, base, ticket: int, rate: float, burst: int, now: float) -> float:
+        """Seconds until a ticket fits in the bucket, zero or less when it fits now"""
+        return cls._due_at(base, ticket, rate) - (burst - 1) / rate - now
+
+    @classmethod
+    def admit(cls, user_id, vendor_id, token: Optional[str] = None) -> Admission:
+        """Decide an order attempt; records admitted, queued and rejected metrics"""
+        try:
+            vendor_id = int(vendor_id)
+        except (TypeError, ValueError):
+            vendor_id = None
+        buckets = cls.buckets(vendor_id)
+        now = time.time()
+
+        tickets = cls._redeem(token, user_id, vendor_id, now)
+        if tickets is None:
+            bases = cache.get_many([_base_key(scope) for scope in buckets] + [_tail_key(scope) for scope in buckets])
+            projected = max((
+                cls._wait(bases[_base_key(scope)], bases[_tail_key(scope)] + 1, rate, burst, now)
+                for scope, (rate, burst) in buckets.items()
+                if _base_key(scope) in bases and _tail_key(scope) in bases
+            ), default=0)
+            if projected > cls.max_wait():
+                metrics.incr('orders.admission.rejected')
+                return Admission(False, rejected=True, retry_after=math.ceil(projected - cls.max_wait()))
+            tickets = {scope: cls._take_ticket(scope, rate, now) for scope, (rate, _) in buckets.items()}
+
+        bases = cache.get_many([_base_key(scope) for scope in tickets])
+        position, wait = 0, 0
+        for scope, ticket in tickets.items():
+            if scope not in buckets or _base_key(scope) not in bases:
+                # Settings changed or the bucket expired since the ticket was issued
+                continue
+            rate, burst = buckets[scope]
+            scope_wait = cls._wait(bases[_base_key(scope)], ticket, rate, burst, now)
+            wait = max(wait, scope_wait)
+            position = max(position, math.ceil(scope_wait * rate))
+
+        if wait <= 0:
+            metrics.incr('orders.admission.admitted')
+            return Admission(True)
+
+        metrics.incr('orders.admission.queued')
+        token = signing.dumps(
+            {'user': user_id, 'vendor': vendor_id, 'tickets': tickets, 'due': now + wait},
+            salt=TOKEN_SALT
+        )
+        return Admission(False, position=position, retry_after=math.ceil(wait), token=token)
+
+    @classmethod
+    def _take_ticket(cls, scope: str, rate: float, now: float) -> int:
+        tail_key, base_key = _tail_key(scope), _base_key(scope)
+        cache.add(tail_key, 0, BUCKET_TTL)
+        try:
+            ticket = cache.incr(tail_key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.add(tail_key, 1, BUCKET_TTL)
+            ticket = 1
+        base = cache.get(base_key)
+        if base is None or cls._due_at(base, ticket, rate) < now:
+            # Idle since the last attempt: this ticket starts a full bucket
+            cache.set(base_key, (now, ticket), BUCKET_TTL)
+        else:
+            cache.touch(base_key, BUCKET_TTL)
+        return ticket
+
+    @classmethod
+    def _redeem(cls, token: Optional[str], user_id, vendor_id, now: float) -> Optional[dict]:
+        """Tickets of a waiting room token from this user for this vendor, None when there is no usable token"""
+        if not token:
+            return None
+        try:
+            payload = signing.loads(token, salt=TOKEN_SALT)
+        except signing.BadSignature:
+            return None
+        if payload['user'] != user_id or payload['vendor'] != vendor_id:
+            return None
+        if now > payload['due'] + cls.token_grace():
+            # Came back too late; their turn has passed, so they queue again
+            return None
+        if now >= payload['due'] and not cache.add(_used_key(token), True, cls.token_grace() + 1):
+            # Each token places one order
+            return None
+        return payload['tickets']
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cafeteria',
+            name='max_queue_wait',
+            field=models.PositiveIntegerField(blank=True, help_text='Projected wait in minutes, blank for no limit', null=True),
+        ),
+        migrations.AddField(
+            model_name='cafeteria',
+            name='overload_action',
+            field=models.CharField(choices=[('refuse', 'Refuse new orders'), ('defer', 'Defer new orders')], default='refuse', max_length=10),
+        ),
+    ]
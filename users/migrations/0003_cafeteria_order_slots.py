@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_kitchen_admission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cafeteria',
+            name='slot_capacity',
+            field=models.PositiveIntegerField(blank=True, help_text='Orders per pre-order slot, blank to disable pre-ordering', null=True),
+        ),
+        migrations.AddField(
+            model_name='cafeteria',
+            name='slot_minutes',
+            field=models.PositiveIntegerField(default=15),
+        ),
+    ]
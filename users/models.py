@@ -22,6 +22,11 @@ class CustomUser(AbstractUser):
 
 
 class Cafeteria(models.Model):
+    OVERLOAD_ACTIONS = (
+        ('refuse', 'Refuse new orders'),
+        ('defer', 'Defer new orders'),
+    )
+    
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     vendor = models.OneToOneField(CustomUser, on_delete=models.CASCADE, limit_choices_to={'user_type': 'vendor'})
@@ -30,6 +35,12 @@ class Cafeteria(models.Model):
     opening_time = models.TimeField()
     closing_time = models.TimeField()
     is_active = models.BooleanField(default=True)
+    # Admission control: what to do with new orders once the projected kitchen wait passes the threshold
+    max_queue_wait = models.PositiveIntegerField(null=True, blank=True, help_text="Projected wait in minutes, blank for no limit")
+    overload_action = models.CharField(max_length=10, choices=OVERLOAD_ACTIONS, default='refuse')
+    # Pre-ordering: fixed-length slots from opening time, each taking up to slot_capacity orders
+    slot_minutes = models.PositiveIntegerField(default=15)
+    slot_capacity = models.PositiveIntegerField(null=True, blank=True, help_text="Orders per pre-order slot, blank to disable pre-ordering")
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
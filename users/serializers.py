@@ -61,7 +61,8 @@ class CafeteriaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cafeteria
         fields = ('id', 'name', 'description', 'vendor', 'vendor_name', 'location', 
-                 'phone_number', 'opening_time', 'closing_time', 'is_active', 'created_at')
+                 'phone_number', 'opening_time', 'closing_time', 'is_active',
+                 'max_queue_wait', 'overload_action', 'slot_minutes', 'slot_capacity', 'created_at')
         read_only_fields = ('id', 'created_at')
 
 